@@ -0,0 +1,99 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class acquisition_source():
+    """ One telemetry source (LIN frames, SCPI charger...) read by a blocking function each tick."""
+
+    def __init__(self, name, read, timeout=0.15):
+        self.name = name
+        self.read = read
+        self.timeout = timeout
+        self.pending = None
+        self.started = 0.0
+        self.generation = 0 # tick the pending read was started on
+        self.reads = 0
+        self.timeouts = 0
+        self.late = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+
+class async_acquisition():
+    """ Read every source concurrently on each tick with asyncio.
+
+    Blocking reads run on a thread pool, one worker per source, and are
+    gathered on the engine's own event loop so a tick costs the slowest source
+    instead of the sum. A source that misses its timeout is reported as None;
+    its read is left to finish and is not started again until it has. The
+    result of such a late read belongs to a tick already reported as missing,
+    it is dropped (None again) rather than passed off as a fresh reading.
+    Reads must return their values, not store them, for this to hold.
+    """
+
+    def __init__(self, sources):
+        self.sources = list(sources)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.sources))
+        self.loop = asyncio.new_event_loop()
+        self.generation = 0
+        self.ticks = 0
+        self.total_tick = 0.0
+        self.max_tick = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def _read(self, source):
+        if source.pending is None:
+            source.started = time.perf_counter()
+            source.generation = self.generation
+            source.pending = self.executor.submit(source.read)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(source.pending)), source.timeout)
+        except asyncio.TimeoutError:
+            source.timeouts += 1
+            return None
+        source.pending = None
+        latency = time.perf_counter() - source.started
+        source.reads += 1
+        source.total_latency += latency
+        if latency > source.max_latency:
+            source.max_latency = latency
+        if source.generation != self.generation:
+            source.late += 1
+            return None
+        return result
+
+    async def acquire_async(self):
+        """ Gather one reading per source, as a dict of source name to result (None on timeout)."""
+        self.generation += 1
+        results = await asyncio.gather(*[self._read(source) for source in self.sources])
+        return dict(zip([source.name for source in self.sources], results))
+
+    def acquire(self):
+        """ Blocking wrapper of acquire_async for synchronous acquisition loops."""
+        start = time.perf_counter()
+        results = self.loop.run_until_complete(self.acquire_async())
+        elapsed = time.perf_counter() - start
+        self.ticks += 1
+        self.total_tick += elapsed
+        if elapsed > self.max_tick:
+            self.max_tick = elapsed
+        return results
+
+    def latency_lines(self):
+        lines = ['acquisition ticks={} mean={:.3f}ms max={:.3f}ms'.format(
+                    self.ticks, 1000.0 * self.total_tick / max(self.ticks, 1), 1000.0 * self.max_tick)]
+        for source in self.sources:
+            lines.append('source {} reads={} timeouts={} late={} mean={:.3f}ms max={:.3f}ms'.format(
+                source.name, source.reads, source.timeouts, source.late,
+                1000.0 * source.total_latency / max(source.reads, 1), 1000.0 * source.max_latency))
+        return lines
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.loop.close()
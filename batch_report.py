@@ -0,0 +1,262 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+import data_logger
+import display_data
+import json_files
+import log_archive
+
+SOC_THRESHOLDS = [50, 60, 70, 80, 90, 100] # %
+REPORT_FILE = 'batch_report.csv'
+REPORT_CACHE_FILE = 'batch_report_cache.json'
+# When a test was saved in several formats, the first one found here is analysed
+LOG_TYPES = [log_archive.ARCHIVE_EXTENSION, data_logger.LOG_EXTENSION, '.csv']
+
+
+def is_test_log(filename):
+    """ True for a soc_gauge_test log, False for trace logs, profiles and other tables.
+
+    A log whose channels cannot be read is kept, so its error shows in the report.
+    """
+    try:
+        if filename.endswith(log_archive.ARCHIVE_EXTENSION):
+            channels = log_archive.log_archive(filename).channels
+        else:
+            channels = data_logger.read_channels(filename)
+    except (OSError, ValueError):
+        return True
+    return 'batt_soc' in channels
+
+
+def find_logs(directory, exclude=()):
+    """ One log per test in directory, preferring archives over binary logs over .csv."""
+    exclude = [os.path.abspath(name) for name in exclude]
+    by_test = {}
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        filename = os.path.join(directory, name)
+        if ext not in LOG_TYPES or os.path.abspath(filename) in exclude:
+            continue
+        if not is_test_log(filename):
+            continue
+        by_test.setdefault(stem, []).append(ext)
+    return [os.path.join(directory, stem + min(exts, key=LOG_TYPES.index)) for stem, exts in sorted(by_test.items())]
+
+
+class log_totals():
+    """ Duration, final values, charge in/out and threshold times of a whole log, fed chunk by chunk.
+
+    The trapezoid step across each chunk boundary is carried over, so the
+    charge totals do not depend on the chunk size.
+    """
+
+    def __init__(self, thresholds):
+        self.thresholds = list(thresholds)
+        self.samples = 0
+        self.t_first = None
+        self.soc_first = None
+        self.last = None
+        self.charge_in_as = 0.0
+        self.charge_out_as = 0.0
+        self.time_to_soc = {str(threshold): None for threshold in self.thresholds}
+
+    def add(self, chunk):
+        if len(chunk) == 0:
+            return
+        time, current, soc = chunk['time'], chunk['batt_current'], chunk['batt_soc']
+        if self.last is None:
+            self.t_first, self.soc_first = float(time[0]), float(soc[0])
+            steps = 0.5 * (current[1:] + current[:-1]) * np.diff(time)
+        else:
+            steps = 0.5 * (current + np.concatenate(([self.last['batt_current']], current[:-1]))) * np.diff(time, prepend=self.last['time'])
+        self.charge_in_as += steps[steps > 0].sum()
+        self.charge_out_as -= steps[steps < 0].sum()
+        for threshold in self.thresholds:
+            key = str(threshold)
+            if self.time_to_soc[key] is not None:
+                continue
+            # Reached from below or above, depending on where the log starts
+            reached = soc >= threshold if self.soc_first <= threshold else soc <= threshold
+            if reached.any():
+                self.time_to_soc[key] = float(time[np.argmax(reached)] - self.t_first)
+        self.samples += len(chunk)
+        self.last = chunk[-1].copy()
+
+
+def analyse_log(filename, thresholds=SOC_THRESHOLDS, qmax_as=None, png_dir=None, chunk_size=65536):
+    """ Summary of one test log as a dict, run in a worker process.
+
+    Duration, charge and threshold times cover the whole log, the SOC error
+    uses the display_data window and coulomb counted reference, with the
+    capacity and initial SOC fitted to the log unless qmax_as is given. The
+    log is streamed in chunks, only a PNG needs the window in memory.
+    """
+    totals = log_totals(thresholds)
+    for chunk in display_data.iter_log_chunks(filename, chunk_size):
+        if 'batt_soc' not in chunk.dtype.names:
+            raise ValueError('not a soc_gauge_test log')
+        totals.add(chunk)
+    if totals.samples < 2:
+        raise ValueError('not a soc_gauge_test log')
+    result = {'samples': totals.samples,
+              'duration_s': float(totals.last['time'] - totals.t_first),
+              'final_voltage': float(totals.last['batt_voltage']),
+              'final_soc': float(totals.last['batt_soc']),
+              'charge_in_ah': float(totals.charge_in_as / 3600.0),
+              'charge_out_ah': float(totals.charge_out_as / 3600.0),
+              'time_to_soc': totals.time_to_soc,
+              'soc_error_max': None,
+              'soc_error_rms': None,
+              'capacity_ah': None,
+              'soc0': None,
+              'png': None}
+    soc0 = display_data.SOC_START
+    stats = display_data.log_statistics(['batt_soc'])
+    window_start = None
+    try:
+        if qmax_as is None:
+            fit = display_data.fit_log(filename, chunk_size=chunk_size)
+            qmax_as, soc0 = fit.capacity_as, fit.soc0
+            result['capacity_ah'] = fit.capacity_as / 3600.0
+            result['soc0'] = fit.soc0
+        for window_l, chunk, charge in display_data.iter_window_charge(filename, chunk_size=chunk_size):
+            if window_start is None:
+                window_start = chunk['time'][0]
+            stats.add(chunk, soc0 + 100 * charge / qmax_as)
+    except ValueError:
+        # SOC never reaches the window start or cannot be fitted, no reference to compare with
+        return result
+    result['soc_error_max'] = float(stats.error_max_abs)
+    result['soc_error_rms'] = float(np.sqrt(stats.error_square_sum / stats.count))
+
+    if png_dir is not None:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        window = display_data.load_log(filename, start=window_start)
+        soc_calc = display_data.soc_reference(window['time'], window['batt_current'], qmax_as, soc0)
+        fig, axs = display_data.plot_figure(window, soc_calc)
+        axs[0].set_title(os.path.basename(filename))
+        fig.set_size_inches(16, 9)
+        result['png'] = os.path.join(png_dir, os.path.splitext(os.path.basename(filename))[0] + '.png')
+        fig.savefig(result['png'], dpi=100)
+        plt.close(fig)
+    return result
+
+
+def cached_result(cache, filename, settings, png_dir):
+    """ Cached summary of filename if the file and settings are unchanged, else None."""
+    entry = cache.get(os.path.basename(filename))
+    if entry is None or entry['signature'] != json_files.file_signature(filename) or entry['settings'] != settings:
+        return None
+    png = entry['result'].get('png')
+    if png_dir is not None and entry['result'].get('soc_error_max') is not None and not (png and os.path.exists(png)):
+        return None
+    return entry['result']
+
+
+def analyse_directory(logs, thresholds=SOC_THRESHOLDS, qmax_as=None, png_dir=None, jobs=None, cache=None):
+    """ Analyse every log in a process pool, skipping the ones cache already holds.
+
+    Returns {filename: result dict}, failed logs get {'error': message}. cache
+    is updated with the new results.
+    """
+    settings = {'thresholds': list(thresholds), 'qmax_as': qmax_as}
+    results = {}
+    pending = []
+    for filename in logs:
+        result = cached_result(cache, filename, settings, png_dir) if cache is not None else None
+        if result is None:
+            pending.append(filename)
+        else:
+            results[filename] = result
+    print('{} logs, {} cached, {} to analyse'.format(len(logs), len(results), len(pending)))
+    if not pending:
+        return results
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(analyse_log, filename, thresholds, qmax_as, png_dir): filename for filename in pending}
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                results[filename] = future.result()
+            except Exception as e:
+                # Not cached, retried on the next run
+                results[filename] = {'error': str(e)}
+                print('{}: {}'.format(os.path.basename(filename), e))
+                continue
+            print('{}: done'.format(os.path.basename(filename)))
+            if cache is not None:
+                cache[os.path.basename(filename)] = {'signature': json_files.file_signature(filename), 'settings': settings,
+                                                     'result': results[filename]}
+    return results
+
+
+def report_rows(results, thresholds=SOC_THRESHOLDS):
+    """ Header and one row of text cells per analysed log."""
+    def number(value, fmt='{:.2f}'):
+        return '-' if value is None else fmt.format(value)
+
+    header = ['test', 'duration [h]', 'final V', 'final SOC', 'capacity [Ah]', 'SOC0', 'SOC err max', 'SOC err rms', 'charge in [Ah]', 'charge out [Ah]']
+    header += ['t SOC {} [h]'.format(threshold) for threshold in thresholds]
+    rows = []
+    for filename in sorted(results):
+        result = results[filename]
+        name = os.path.basename(filename)
+        if 'error' in result:
+            rows.append([name, 'error: ' + result['error']])
+            continue
+        row = [name, number(result['duration_s'] / 3600.0), number(result['final_voltage']), number(result['final_soc']),
+               number(result.get('capacity_ah')), number(result.get('soc0')), number(result['soc_error_max']), number(result['soc_error_rms']),
+               number(result['charge_in_ah']), number(result['charge_out_ah'])]
+        for threshold in thresholds:
+            seconds = result['time_to_soc'].get(str(threshold))
+            row.append(number(None if seconds is None else seconds / 3600.0))
+        rows.append(row)
+    return header, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarise every SOC gauge test log of a directory in one table')
+    parser.add_argument('directory', help='Directory of test logs (.csv, {} or {})'.format(data_logger.LOG_EXTENSION, log_archive.ARCHIVE_EXTENSION), type=str)
+    parser.add_argument('--output', help='Summary table .csv (default: {} in the directory)'.format(REPORT_FILE), type=str, default=None)
+    parser.add_argument('--png', help='Also render one plot per log into this directory', type=str, default=None)
+    parser.add_argument('--jobs', help='Worker processes (default: one per core)', type=int, default=None)
+    parser.add_argument('--thresholds', help='SOC thresholds [%%] to time (default {})'.format(','.join(map(str, SOC_THRESHOLDS))), type=str, default=None)
+    parser.add_argument('--qmax-ah', help='Skip the capacity fit, use this capacity [Ah] from {:.0f}% SOC'.format(display_data.SOC_START), type=float, default=None)
+    parser.add_argument('--no-cache', help='Analyse every log again', action='store_true')
+    args = parser.parse_args()
+
+    thresholds = SOC_THRESHOLDS
+    if args.thresholds:
+        thresholds = [float(value) if '.' in value else int(value) for value in args.thresholds.split(',')]
+    output = args.output or os.path.join(args.directory, REPORT_FILE)
+    cache_file = os.path.join(args.directory, REPORT_CACHE_FILE)
+    if args.png:
+        os.makedirs(args.png, exist_ok=True)
+
+    logs = find_logs(args.directory, exclude=[output])
+    cache = {} if args.no_cache else json_files.load_json(cache_file)
+    start = time.time()
+    qmax_as = None if args.qmax_ah is None else args.qmax_ah * 3600
+    results = analyse_directory(logs, thresholds, qmax_as, png_dir=args.png, jobs=args.jobs, cache=cache)
+    json_files.save_json(cache, cache_file)
+
+    header, rows = report_rows(results, thresholds)
+    widths = [max(len(row[i]) for row in [header] + rows if len(row) == len(header)) for i in range(len(header))]
+    print()
+    for row in [header] + rows:
+        print(' | '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    print('\n{} logs in {:.1f} s, table written to {}'.format(len(results), time.time() - start, output))
+
+
+if __name__ == '__main__':
+    main()
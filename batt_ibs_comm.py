@@ -1,11 +1,21 @@
+import argparse
 import time
 import sys
 import signal
-from threading import Timer
-import nixnet
-from nixnet import constants
-from nixnet import types
-from nixnet import convert
+
+# XNET driver is only needed for bench runs, --sim works without it
+try:
+    import nixnet
+    from nixnet import constants
+    from nixnet import types
+    from nixnet import convert
+except ImportError:
+    nixnet = None
+
+import sim_backends
+from sample_scheduler import sample_scheduler
+from periodic_scheduler import periodic_scheduler
+from telemetry_store import telemetry_store
 
 ibs_name = 'IBS_GEN2'
 
@@ -45,51 +55,19 @@ else:
 DISPLAY_RATE = 1 # every 1 second
 SAMPLE_RATE = 1 # every 200ms
 
-class InfiniteTimer():
-    """A Timer class that does not stop, unless you want it to."""
-
-    def __init__(self, seconds, target):
-        self._should_continue = False
-        self.is_running = False
-        self.seconds = seconds
-        self.target = target
-        self.thread = None
-
-
-    def _handle_target(self):
-        self.is_running = True
-        self.target()
-        self.is_running = False
-        self._start_timer()
-
-    def _start_timer(self):
-        if self._should_continue: # Code could have been running when cancel was called.
-            self.thread = Timer(self.seconds, self._handle_target)
-            self.thread.start()
-
-    def start(self):
-        if not self._should_continue and not self.is_running:
-            self._should_continue = True
-            self._start_timer()
-        else:
-            print("Timer already started or running, please wait if you're restarting.")
-
-    def cancel(self):
-        if self.thread is not None:
-            self._should_continue = False # Just in case thread is running and cancel fails.
-            self.thread.cancel()
-        else:
-            print("Timer never started or failed to initialize.")
-
 class battery:
-    voltage = 0
-    current = 0
-    soc = 0
-    temp = 0
-    cell_volts = [0,0,0,0]
-    data = []
+    """ Latest IBS sample, filled in place every tick."""
+    __slots__ = ('name', 'voltage', 'current', 'temp', 'soc', 'soc_nom', 'soc_recalibrated')
+
     def __init__(self, name):
         self.name = name
+        self.voltage = 0.0
+        self.current = 0.0
+        self.temp = 0.0
+        self.soc = 0.0
+        self.soc_nom = 0.0
+        self.soc_recalibrated = 0.0
+
     def pack_data(self, voltage, current, temp, soc, soc_nom, soc_recalibrated):
         self.voltage = voltage
         self.current = current
@@ -98,72 +76,97 @@ class battery:
         self.soc_nom = soc_nom
         self.soc_recalibrated = soc_recalibrated
 
-    def list_data(self):
-        return [self.voltage, self.current, self.temp, self.soc, self.soc_nom, self.soc_recalibrated]
+    def pack_signals(self, converted_signals):
+        """ Fill from the converter's (timestamp, value) pairs, in signals order."""
+        (_, voltage), (_, current), (_, temp), (_, soc), (_, soc_nom), (_, soc_recalibrated) = converted_signals
+        self.voltage = float(voltage)
+        self.current = float(current)
+        self.temp = float(temp)
+        self.soc = float(soc)
+        self.soc_nom = float(soc_nom)
+        self.soc_recalibrated = float(soc_recalibrated)
 
 
 
 def main():
 
+    parser = argparse.ArgumentParser(description='Script used to monitor IBS telemetry')
+    parser.add_argument('--sim', help='Run against a simulated IBS on a virtual clock', action='store_true')
+    args = parser.parse_args()
+
     batt = battery('YUASA_30')
+    telemetry = telemetry_store(signals)
+
+    if args.sim:
+        clock = sim_backends.virtual_clock()
+        model = sim_backends.battery_model(clock)
+        lin_session = sim_backends.sim_lin_session(model, frames)
+        signal_converter = sim_backends.sim_signal_converter(signals)
+    elif nixnet is None:
+        parser.error('nixnet is required for hardware runs, use --sim otherwise')
+    else:
+        clock = time
+        lin_session = nixnet.FrameInSinglePointSession(interface, database, cluster, frames)
+        signal_converter = convert.SignalConversionSinglePointSession(database, cluster, signals)
 
     def display_data_task():
         """Display latest data on console."""
-        print('Batt. Voltage = {:2.2f}V | Batt. Current = {:2.4f}A | Batt. temp = {:2.2f}C | Batt. SOC = {:2.2f}% | Q.Nom = {:2.2f}Ah | SOC.Recal = {}'.format(*( batt.list_data())))
+        row = telemetry.latest()
+        if row is None:
+            return
+        print('Batt. Voltage = {:2.2f}V | Batt. Current = {:2.4f}A | Batt. temp = {:2.2f}C | Batt. SOC = {:2.2f}% | Q.Nom = {:2.2f}Ah | SOC.Recal = {:.0f}'.format(*row[1:]))
     # Setup LIN Sessions
-    with nixnet.FrameInSinglePointSession(interface, database, cluster, frames) as session:
-        with convert.SignalConversionSinglePointSession(database, cluster, signals) as converter:
+    with lin_session as session:
+        with signal_converter as converter:
 
-            session.intf.lin_term = constants.LinTerm.ON
+            if nixnet is not None:
+                session.intf.lin_term = constants.LinTerm.ON
             session.intf.lin_master = True
 
-            def read_data_task():
+            def read_data_task(sample_time):
                 """Aquires and Converts Telemetry data on the SCPI and LIN buses."""
                 # Read Telemetry
-                frame = session.frames.read(frame_type=types.LinFrame)
+                frame = session.frames.read(frame_type=types.LinFrame if nixnet is not None else None)
 
                 # Format Data
                 converted_signals = converter.convert_frames_to_signals(frame)
-                batt.pack_data(*[float(v) for (_, v) in converted_signals])
+                batt.pack_signals(converted_signals)
+                telemetry.append(sample_time, batt.voltage, batt.current, batt.temp, batt.soc, batt.soc_nom, batt.soc_recalibrated)
 
             # Set the schedule. This will also automatically enable master mode.
             session.start()
 
             session.change_lin_schedule(lin_schedule)
-            time.sleep(1)
+            clock.sleep(1)
 
 
 
-            display_task = InfiniteTimer(DISPLAY_RATE, display_data_task)
+            tasks = periodic_scheduler()
+            display_task = tasks.add_task(DISPLAY_RATE, display_data_task)
 
 
             def exit_signal_handler(signal, frame):
                 print('Shutting Down...')
                 display_task.cancel()
+                tasks.stop()
                 #daq_task.cancel()
+                for line in scheduler.summary_lines():
+                    print(line)
                 sys.exit()
             signal.signal(signal.SIGINT, exit_signal_handler)
 
-            display_task.start()
+            tasks.start()
             #daq_task.start()
 
-            loop_count = 0;
-            start_time = time.time()
-            next_step = 0
-
+            scheduler = sample_scheduler(SAMPLE_RATE, clock=clock)
+            scheduler.start()
 
             while(1):
-                loop_start = time.time()
-                sample_time = loop_start - start_time
+                sample_time = scheduler.wait()
 
-                read_data_task()
+                read_data_task(sample_time)
                 # status = session.num_unused
                 # print(status)
-                loop_time = time.time() - loop_start
-                loop_wait = SAMPLE_RATE - loop_time
-                if(loop_wait < 0):
-                    loop_wait = 0
-                time.sleep(loop_wait)
 
     print('Data acquisition stopped.')
 
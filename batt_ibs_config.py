@@ -1,146 +1,214 @@
+import argparse
 import time
-import six
+import zlib
 import sys
 import signal
-from threading import Timer
-import nixnet
-from nixnet import constants
-from nixnet import types
-from nixnet import convert
-import struct
-
-
-class IBS200_GEN1():
-    """ Define IBS200 GEN1 Object."""
-
-    def __init__(self, lin_interface, lin_database_name):
-        self.interface = lin_interface
-        self.database = lin_database_name
-        self.cluster = 'Cluster'
-        self.master_req_output_frames = ['MasterReq']
-        self.slave_resp_input_frames =  ['SlaveResp']
-        self.lin_diag_schedule = 0
-        self.MasterReqId = 0x3C
-        self.master_payloads = {
-        'Empty_Frame': [0x00, 0x00, 0x00, 0x00 ,0x00, 0x00, 0x00, 0x00],
-        'BattCap_Read':[0x01, 0x06, 0xB2, 0x39, 0xFF, 0x7F, 0xFF, 0xFF],
-        'BattCap_Write':[0x01, 0x03, 0xB5, 0x39, 0xFF, 0xFF, 0xFF, 0xFF],
-        'BattType_Read':[0x01, 0x06, 0xB2, 0x3A, 0xFF, 0x7F, 0xFF, 0xFF],
-        'BattType_Write':[0x01, 0x03, 0xB5, 0x3A, 0x1E, 0xFF, 0xFF, 0xFF],
-        'BattTable_State':[0x01, 0x01, 0x30, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF],
-        'BattTable_OnOff':[0x82, 0x06, 0x31, 0x00, 0x11, 0x22, 0x33, 0x44],
-        'U0_MinMax_Read':[0x82, 0x06, 0xB2, 0x30, 0xFF, 0x7F, 0xFF, 0xFF],
-        'U0_MinMax_Write':[0x82, 0x06, 0xB5, 0x30, 0xFF, 0x7F, 0xFF, 0xFF],
-        'IQbatt_Read':[0x82, 0x06, 0xB2, 0x3C, 0xFF, 0x7F, 0xFF, 0xFF],
-        'IQbatt_Write':[0x82, 0x04, 0xB5, 0x3C, 0xFF, 0x7F, 0xFF, 0xFF]}
-
-
-    def set_switch_table_OnOff(self, state='Off'):
-        """ Change Master Payload to match table OnOff state request."""
-
-        if(state == 'On'):
-            self.master_payloads['BattTable_OnOff'][3] = 1
-        elif(state == 'Off'):
-            self.master_payloads['BattTable_OnOff'][3] = 0
-        else:
-            print('Error : Wrong State entered')
-
-    def set_nominal_capacity(self, capacity_ah=30):
-        """ Set Nominal Capacity value in Master Req payload."""
-
-        self.master_payloads['BattCap_Write'][4] = capacity_ah
-
-    def set_u0_minmax(self, u0_min = None, u0_max = None,):
-        """ Set U0 Min/Max Values in Master Req Payload in 1mV Resolution."""
-
-        u0_min_low = (0x0FF & u0_min)
-        u0_min_high = (0xFF00 & u0_min) >> 8
-        u0_max_low = (0x0FF & u0_max)
-        u0_max_high = (0xFF00 & u0_max) >> 8
-
-        self.master_payloads['U0_MinMax_Write'][4] = u0_min_high
-        self.master_payloads['U0_MinMax_Write'][5] = u0_min_low
-        self.master_payloads['U0_MinMax_Write'][6] = u0_max_high
-        self.master_payloads['U0_MinMax_Write'][7] = u0_max_low
-
-    def set_ibatt_quiescent(self, iqbatt = None, ichargemin = None):
-        """ Set battery quiescent current in Master Req payload."""
-
-        self.master_payloads['IQbatt_Write'][4] = iqbatt
-        self.master_payloads['IQbatt_Write'][5] = ichargemin
-
-
-class IBS_GLOBAL_GEN2():
-    """ Define HELLA IBS GLOBAL GEN2 Object."""
-
-    def __init__(self, lin_interface, lin_database_name):
-        self.interface = lin_interface
-        self.database = lin_database_name
-        self.cluster = 'Cluster'
-        self.master_req_output_frames = ['MasterReq']
-        self.slave_resp_input_frames =  ['SlaveResp']
-        self.lin_diag_schedule = 0
-        self.lin_normal_schedule = 1
-        self.MasterReqId = 0x3C
-        self.master_payloads = {
-        'Empty_Frame': [0x00, 0x00, 0x00, 0x00 ,0x00, 0x00, 0x00, 0x00],
-        'BattCap_Read':[0x01, 0x06, 0xB2, 0x39, 0xFF, 0x7F, 0xFF, 0xFF],
-        'BattCap_Write':[0x01, 0x03, 0xB5, 0x39, 0xFF, 0xFF, 0xFF, 0xFF],
-        'BattType_Read':[0x01, 0x06, 0xB2, 0x3A, 0xFF, 0x7F, 0xFF, 0xFF],
-        'BattType_Write':[0x01, 0x03, 0xB5, 0x3A, 0x1E, 0xFF, 0xFF, 0xFF],
-        'BattTable_State':[0x01, 0x01, 0x30, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF],
-        'BattTable_OnOff':[0x01, 0x06, 0x31, 0x00, 0x11, 0x22, 0x33, 0x44],
-        'U0_MinMax_Read':[0x01, 0x06, 0xB2, 0x30, 0xFF, 0x7F, 0xFF, 0xFF],
-        'U0_MinMax_Write':[0x01, 0x06, 0xB5, 0x30, 0xFF, 0x7F, 0xFF, 0xFF],
-        'Batt_Tech_Read':[0x01, 0x06, 0xB2, 0x32, 0xFF, 0x7F, 0xFF, 0xFF],
-        'Batt_Tech_Write':[0x01, 0x03, 0xB5, 0x32, 0xFF, 0x7F, 0xFF, 0xFF]}
-
-
-    def set_switch_table_OnOff(self, state='Off'):
-        """ Change Master Payload to match table OnOff state request."""
-
-        if(state == 'On'):
-            self.master_payloads['BattTable_OnOff'][3] = 1
-        elif(state == 'Off'):
-            self.master_payloads['BattTable_OnOff'][3] = 0
-        else:
-            print('Error : Wrong State entered')
-
-    def set_nominal_capacity(self, capacity_ah=30):
-        """ Set Nominal Capacity value in Master Req payload."""
-
-        self.master_payloads['BattCap_Write'][4] = int(capacity_ah / 2.0)
-
-    def set_u0_minmax(self, u0_min = None, u0_max = None,):
-        """ Set U0 Min/Max Values in Master Req Payload in 1mV Resolution."""
-
-        u0_min_low = (0x0FF & u0_min)
-        u0_min_high = (0xFF00 & u0_min) >> 8
-        u0_max_low = (0x0FF & u0_max)
-        u0_max_high = (0xFF00 & u0_max) >> 8
-
-        self.master_payloads['U0_MinMax_Write'][4] = u0_min_high
-        self.master_payloads['U0_MinMax_Write'][5] = u0_min_low
-        self.master_payloads['U0_MinMax_Write'][6] = u0_max_high
-        self.master_payloads['U0_MinMax_Write'][7] = u0_max_low
-
-    def set_batt_tech(self, batt_tech = 'AGM'):
-        """ Set battery quiescent current in Master Req payload."""
-        if(batt_tech == 'AGM'):
-            self.master_payloads['Batt_Tech_Write'][4] = 0x01
-        else:
-            print("Error: Wrong Battery Type")
+from contextlib import contextmanager
+
+# XNET driver is only needed for bench runs, --sim works without it
+try:
+    import nixnet
+    from nixnet import constants
+except ImportError:
+    nixnet = None
+
+import sim_backends
+import ibs_registers
+import json_files
+from lin_diag import lin_diag_engine
+
+EEPROM_SAVE_TIME = 10 # s, the IBS stores written parameters in the background
+CONFIG_CACHE_FILE = 'ibs_config_cache.json'
+
+_sim_nodes = {}
+
+
+def configuration_transactions(registers, writes, table_on):
+    """ MasterReq sequence writing [(parameter, values)], switching the table off first if it is on."""
+    transactions = [registers.table_switch(on=False)] if table_on else []
+    for parameter, values in writes:
+        transactions.append(parameter.write(values))
+    return transactions
+
+
+def verification_transactions(registers, writes):
+    """ MasterReq sequence reading the written parameters back."""
+    return [registers.table_state] + [parameter.read for parameter, values in writes]
+
+
+def target_configuration(writes):
+    """ {parameter name: values} as the IBS will report them once written."""
+    return {parameter.name: parameter.decode(parameter.encode(values)) for parameter, values in writes}
+
+
+def readback_mismatches(writes, results):
+    """ Names of the parameters whose read back value differs from what was written."""
+    by_name = {result.name: result for result in results}
+    target = target_configuration(writes)
+    mismatches = []
+    for parameter, values in writes:
+        result = by_name.get(parameter.read.name)
+        if result is None:
+            continue
+        if parameter.decode_result(result) != target[parameter.name]:
+            mismatches.append(parameter.name)
+    return mismatches
+
+
+def load_config_cache(filename=CONFIG_CACHE_FILE):
+    """ Last verified configuration per sensor key, empty if there is no cache yet."""
+    return json_files.load_json(filename)
+
+
+def save_config_cache(cache, filename=CONFIG_CACHE_FILE):
+    json_files.save_json(cache, filename)
+
+
+def wait_for_eeprom_save(clock=time, verbose=True):
+    if not verbose:
+        clock.sleep(EEPROM_SAVE_TIME)
+        return
+    print('Allow IBS to save all parameters ({}s wait)...'.format(EEPROM_SAVE_TIME))
+    print('[', end='')
+    for i in range(0, 100):
+        print('#', end='', flush=True)
+        clock.sleep(EEPROM_SAVE_TIME / 100.0)
+    print(']\n')
+
+
+class config_outcome():
+    """ What configure() did to one IBS."""
+
+    def __init__(self):
+        self.sensor_key = None
+        self.results = []
+        self.mismatches = []
+        self.written = []
+        self.from_cache = False
+        self.verified = None # {parameter name: values} once verified
+
+    def ok(self):
+        return self.verified is not None
+
+    def failures(self):
+        failures = ['{}: {}'.format(r.name, r.status()) for r in self.results if not r.ok]
+        return failures + ['{}: read back differs'.format(name) for name in self.mismatches]
+
+    def summary(self):
+        if self.from_cache:
+            return 'already configured (cache)'
+        if not self.ok():
+            return 'failed'
+        return 'wrote {}'.format(', '.join(self.written)) if self.written else 'already configured'
+
+
+def configure(engine, registers, writes, clock=time, verbose=True, cache=None, use_cache=True):
+    """ Bring one IBS to the configuration in writes, writing only what differs.
+
+    The sensor is identified by its serial number. When cache holds a verified
+    configuration for it that covers writes with the switch table off,
+    nothing else is sent (unless use_cache is False). Otherwise the current
+    values are read, the table is switched off if it is on and only the
+    differing parameters are written, saved and read back. cache is updated
+    with the verified configuration either way.
+    """
+    outcome = config_outcome()
+    target = target_configuration(writes)
+
+    # Wake up LIN Bus
+    if verbose:
+        print('0) Waking up LIN Bus...')
+    engine.wake_up()
+
+    result = engine.transact(registers.serial_number.read)
+    outcome.results.append(result)
+    serial = registers.serial_number.decode_result(result)
+    if serial is not None:
+        outcome.sensor_key = registers.sensor_key(serial['serial'])
+    entry = cache.get(outcome.sensor_key, {}) if use_cache and cache is not None and outcome.sensor_key else {}
+    cached = entry.get('parameters', {})
+    if target and entry.get('table_state') == 0 and all(cached.get(name) == values for name, values in target.items()):
+        if verbose:
+            print('{} already configured (cache)'.format(outcome.sensor_key))
+        outcome.from_cache = True
+        outcome.verified = target
+        return outcome
+
+    # Read-compare: only parameters that differ are written, a switch table left on is a difference too
+    reads = engine.run([registers.table_state] + [parameter.read for parameter, values in writes], stop_on_error=False)
+    outcome.results += reads
+    table_on = ibs_registers.decode_table_state(reads[0]) != 0
+    pending = [(parameter, values) for (parameter, values), result in zip(writes, reads[1:])
+               if parameter.decode_result(result) != target[parameter.name]]
+    outcome.written = (['Table OFF'] if table_on else []) + [parameter.name for parameter, values in pending]
+
+    if pending or table_on:
+        results = engine.run(configuration_transactions(registers, pending, table_on))
+        outcome.results += results
+        if not all(result.ok for result in results):
+            if verbose:
+                print('Configuration failed, parameters not verified.')
+            return outcome
+        wait_for_eeprom_save(clock, verbose)
+        results = engine.run(verification_transactions(registers, pending))
+        outcome.results += results
+        outcome.mismatches = readback_mismatches(pending, results)
+        if ibs_registers.decode_table_state(results[0]) != 0:
+            outcome.mismatches.append(registers.table_state.name)
+    elif verbose:
+        print('Configuration already matches, nothing written.')
+
+    if not outcome.failures():
+        outcome.verified = target
+        if cache is not None and outcome.sensor_key:
+            entry = cache.setdefault(outcome.sensor_key, {'parameters': {}})
+            entry['parameters'].update(target)
+            entry['table_state'] = 0
+            entry['verified'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    return outcome
+
+
+@contextmanager
+def diag_engine(registers, interface, sim=False, verbose=True):
+    """ lin_diag_engine on the diagnostic schedule of interface, or on a simulated IBS."""
+    if sim:
+        # One simulated IBS per interface, so it keeps its configuration between runs
+        if interface not in _sim_nodes:
+            clock = sim_backends.virtual_clock()
+            _sim_nodes[interface] = sim_backends.sim_ibs_diag_node(clock, serial=zlib.crc32(interface.encode()))
+        node = _sim_nodes[interface]
+        clock = node.clock
+        yield lin_diag_engine(node, node, registers.master_req_id, clock=clock, verbose=verbose)
+        return
+    if nixnet is None:
+        raise RuntimeError('nixnet is not installed, use --sim to run without LIN hardware')
+    # Setup LIN Sessions
+    with nixnet.FrameInQueuedSession(interface, registers.database, registers.cluster, registers.slave_resp_input_frames) as input_session:
+        with nixnet.FrameOutQueuedSession(interface, registers.database, registers.cluster, registers.master_req_output_frames) as output_session:
+
+            output_session.intf.lin_term = constants.LinTerm.ON
+            output_session.intf.lin_master = True
+
+            output_session.change_lin_schedule(registers.lin_diag_schedule)
+            input_session.flush()
+            yield lin_diag_engine(input_session, output_session, registers.master_req_id, verbose=verbose)
 
 
 def exit_signal_handler(signal, frame):
     print('Shutting Down...')
     sys.exit()
-signal.signal(signal.SIGINT, exit_signal_handler)
 
 def main():
-
-    #ibs = IBS200_GEN1('LIN2', 'hella_gen1_ibs')
-    ibs = IBS_GLOBAL_GEN2('LIN2', 'hella_gen2_ibs')
+    parser = argparse.ArgumentParser(description='Configure an IBS over LIN diagnostic frames')
+    parser.add_argument('--sim', help='Configure a simulated IBS instead of the LIN interface', action='store_true')
+    parser.add_argument('--cache', help='Configuration cache file (default {})'.format(CONFIG_CACHE_FILE), type=str, default=CONFIG_CACHE_FILE)
+    parser.add_argument('--no-cache', help='Read the sensor even if the cache says it is configured (the cache is still updated)', action='store_true')
+    args = parser.parse_args()
+    signal.signal(signal.SIGINT, exit_signal_handler)
+
+    interface = 'LIN2'
+    #registers = ibs_registers.register_map('IBS200_GEN1')
+    registers = ibs_registers.register_map('IBS_GLOBAL_GEN2')
     # User Defined Configuration
 
     C_NOMINAL = 30 #Ah
@@ -150,105 +218,21 @@ def main():
     ICHRG_MIN = 50 #mA (50mA Default)
     BATT_TECH = 'AGM'
 
-    # Set Master payloads
-
-    ibs.set_nominal_capacity(capacity_ah=C_NOMINAL)
-    ibs.set_u0_minmax(u0_min = U0_MIN, u0_max = U0_MAX)
-    #ibs.set_ibatt_quiescent(iqbatt = IQBATT, ichargemin = ICHRG_MIN)
-    #ibs.set_batt_tech(batt_tech = 'AGM')
-
-
-    # Setup LIN Sessions
-    with nixnet.FrameInSinglePointSession(ibs.interface, ibs.database, ibs.cluster, ibs.slave_resp_input_frames) as input_session:
-        with nixnet.FrameOutQueuedSession(ibs.interface, ibs.database, ibs.cluster, ibs.master_req_output_frames) as output_session:
-
-            output_session.intf.lin_term = constants.LinTerm.ON
-            output_session.intf.lin_master = True
-
-            output_session.change_lin_schedule(ibs.lin_diag_schedule)
-
-            def write_LIN(session, id, payload):
-                """ Write LIN Frame to XNET Session."""
-
-                print('Sending MasterReq Frame : ID:{} Payload:{}'.format(id,[hex(val) for val in payload]))
-                frame = types.LinFrame(id, type=constants.FrameType.LIN_DATA, payload=bytearray(payload))
-                output_session.frames.write([frame])
-
-
-            def read_LIN(session):
-                """ Read LIN Frame from XNET Session."""
-
-                slave_frame, = input_session.frames.read(frame_type=types.LinFrame)
-                print('Received SlaveResp Frame :{}'.format(slave_frame))
-                data =[int(struct.unpack('B',val)[0]) for val in slave_frame.payload]
-                print('SlaveResp Payload = {}'.format([hex(val) for val in data]))
-                return data
-
-            input_session.flush()
-            # Wake up LIN Bus
-            print('0) Waking up LIN Bus...')
-            write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['Empty_Frame'])
-            slave_frame, = input_session.frames.read(frame_type=types.LinFrame)
-            time.sleep(0.1)
-
-
-            # Configure IBS
-            print('Check Table State...')
-            write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['BattTable_State'])
-            time.sleep(0.35)
-            read_LIN(input_session)
-
-            print('Switch Table OFF...')
-            ibs.set_switch_table_OnOff(state='Off')
-            write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['BattTable_OnOff'])
-            time.sleep(0.35)
-            read_LIN(input_session)
-
-            print('Change C_NOMINAL...')
-            write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['BattCap_Write'])
-            time.sleep(0.35)
-            read_LIN(input_session)
-
-            print('Change U0 MIN/MAX...')
-            write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['U0_MinMax_Write'])
-            time.sleep(0.35)
-            read_LIN(input_session)
-
-            # print('Change Batt IQ/Icharge_min...')
-            # write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['IQbatt_Write'])
-            # time.sleep(0.25)
-            # read_LIN(input_session)
-
-            print('Allow IBS to save all parameters (10s wait)...')
-
-            print '['
-            for i in range(0,100):
-                print '#',
-                time.sleep(0.1)
-            print(']\n')
-
-            print('Check Table State...')
-            write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['BattTable_State'])
-            time.sleep(0.35)
-            read_LIN(input_session)
-
-            print('Check C_Nominal...')
-            write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['BattCap_Read'])
-            time.sleep(0.35)
-            read_LIN(input_session)
-
-            print('Check U0 MIN/MAX...')
-            write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['U0_MinMax_Read'])
-            time.sleep(0.35)
-            read_LIN(input_session)
-
-            # print('Check Batt IQ/Charge_min...')
-            # write_LIN(output_session, ibs.MasterReqId, ibs.master_payloads['IQbatt_Read'])
-            # time.sleep(0.25)
-            # read_LIN(input_session)
-
-            print('Done!')
-
+    writes = registers.parameter_values(c_nominal=C_NOMINAL, u0_min=U0_MIN, u0_max=U0_MAX)
+    #writes = registers.parameter_values(c_nominal=C_NOMINAL, u0_min=U0_MIN, u0_max=U0_MAX, batt_tech=BATT_TECH)
+
+    cache = load_config_cache(args.cache)
+    start = time.time()
+    with diag_engine(registers, interface, sim=args.sim) as engine:
+        outcome = configure(engine, registers, writes, clock=engine.clock, cache=cache, use_cache=not args.no_cache)
+    # Simulated sensors must not end up in the cache of the real ones
+    if not args.sim:
+        save_config_cache(cache, args.cache)
+
+    if outcome.ok():
+        print('Done! {} ({:.1f} s)'.format(outcome.summary(), time.time() - start))
+    else:
+        print('Failed: {}'.format(', '.join(outcome.failures())))
 
 if __name__ == '__main__':
     main()
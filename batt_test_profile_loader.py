@@ -1,57 +1,143 @@
 import csv
 import time
 import os
+import numpy as np
+
+# Profile commands, a step's command code indexes this list
+COMMANDS = ['timeout', 'end_current', 'output_state', 'float_voltage']
+COMMAND_CODES = {name: code for code, name in enumerate(COMMANDS)}
+
+
+PROFILE_COLUMNS = ['step', 'Vsp', 'Ilim_pos', 'Ilim_neg', 'command', 'value', 'message']
+NUMBER_COLUMNS = ['Vsp', 'Ilim_pos', 'Ilim_neg', 'value']
+
+
+def _row_problems(line_no, row, previous_step):
+    """ Problems of one profile row as messages, and its step number (None if unreadable)."""
+    problems = []
+    try:
+        step = int(row['step'])
+    except (TypeError, ValueError):
+        problems.append('Profile line {}: step {!r} is not an integer'.format(line_no, row['step']))
+        step = None
+    if step is not None and previous_step is not None and step != previous_step + 1:
+        problems.append('Profile line {}: step {} follows step {}, steps must count up by one'.format(line_no, step, previous_step))
+    values = {}
+    for name in NUMBER_COLUMNS:
+        try:
+            values[name] = float(row[name])
+        except (TypeError, ValueError):
+            problems.append('Profile line {}: {} {!r} is not a number'.format(line_no, name, row[name]))
+            continue
+        if not np.isfinite(values[name]):
+            problems.append('Profile line {}: {} {!r} is not finite'.format(line_no, name, row[name]))
+    # Ilim_neg is passed to CURR:LIM:NEG as written, chargers differ on its sign
+    if values.get('Ilim_pos', 0) < 0:
+        problems.append('Profile line {}: Ilim_pos must not be negative'.format(line_no))
+    command = row['command']
+    if command not in COMMAND_CODES:
+        problems.append('Profile line {}: unknown command {!r} (expected one of {})'.format(line_no, command, ', '.join(COMMANDS)))
+    elif command == 'output_state' and values.get('value', 0) not in (0, 1):
+        problems.append('Profile line {}: output_state value must be 0 or 1'.format(line_no))
+    elif command == 'timeout' and values.get('value', 0) < 0:
+        problems.append('Profile line {}: timeout must not be negative'.format(line_no))
+    return problems, step
+
+
+def validate_profile(file):
+    """ Check a whole profile CSV up front, returns every problem found (empty when the profile is good).
+
+    Catches missing columns, non-numeric or non-finite values, unknown
+    commands and steps that do not count up by one, which the state machine
+    would otherwise only hit when it reaches them.
+    """
+    reader = csv.DictReader(file)
+    missing = [name for name in PROFILE_COLUMNS if name not in (reader.fieldnames or [])]
+    if missing:
+        return ['Profile is missing column(s) {}'.format(', '.join(missing))]
+    problems = []
+    previous_step = None
+    rows = 0
+    for line_no, row in enumerate(reader, start=2):
+        row_problems, step = _row_problems(line_no, row, previous_step)
+        problems += row_problems
+        previous_step = step
+        rows += 1
+    if rows == 0:
+        problems.append('Profile has no steps')
+    return problems
+
+
+def compile_profile(file):
+    """ Read a profile CSV once into an immutable structured step array.
+
+    Fields are step, Vsp, Ilim_pos, Ilim_neg, command (code into COMMANDS),
+    value and message. Raises ValueError on the first bad row, see
+    validate_profile to get them all.
+    """
+    rows = []
+    previous_step = None
+    for line_no, row in enumerate(csv.DictReader(file), start=2):
+        problems, previous_step = _row_problems(line_no, row, previous_step)
+        if problems:
+            raise ValueError(problems[0])
+        rows.append((int(row['step']), float(row['Vsp']), float(row['Ilim_pos']), float(row['Ilim_neg']),
+                     COMMAND_CODES[row['command']], float(row['value']), row['message'] or ''))
+    if not rows:
+        raise ValueError('Profile has no steps')
+    message_len = max(len(r[6]) for r in rows) or 1
+    steps = np.array(rows, dtype=[('step', np.int32), ('Vsp', np.float64), ('Ilim_pos', np.float64),
+                                  ('Ilim_neg', np.float64), ('command', np.int8), ('value', np.float64),
+                                  ('message', 'U{}'.format(message_len))])
+    steps.flags.writeable = False
+    return steps
+
 
 class profile_state_machine():
     """ Run through profile defined in CSV file."""
 
-    def __init__(self, file):
-        self.reader = csv.DictReader(file)
+    def __init__(self, file, clock=time):
+        self.clock = clock
+        # Accept an already compiled step table as well as a CSV file
+        if isinstance(file, np.ndarray):
+            self.steps = file
+        else:
+            self.steps = compile_profile(file)
+        self.handlers = [self.timeout_event, self.end_current_event, self.output_state_event, self.float_voltage_event]
         self.get_number_of_steps()
         print('Profile has {} steps'.format(self.no_profile_steps))
-        file.seek(0)
-        self.reader = csv.DictReader(file)
-        self.row = next(self.reader)
-        self.new_step = 1
         self.output_status = 'OFF'
-        self.parse_row()
         self.done = False
+        self.goto_step(0)
 
 
 
     def get_number_of_steps(self):
-        row_list = []
-        for row in self.reader:
-            row_list.append(int(row['step']))
-        self.no_profile_steps = int(max(row_list))
+        self.no_profile_steps = int(self.steps['step'].max())
         return self.no_profile_steps
 
-    def next_step(self):
-        self.row = next(self.reader)
-        self.parse_row()
+    def goto_step(self, index):
+        """ Jump to the step at row index of the step table."""
+        row = self.steps[index]
+        self.index = index
+        self.step = int(row['step'])
+        self.vsp = float(row['Vsp'])
+        self.ilim_pos = float(row['Ilim_pos'])
+        self.ilim_neg = float(row['Ilim_neg'])
+        self.command_code = int(row['command'])
+        self.command = COMMANDS[self.command_code]
+        self.value = float(row['value'])
+        self.message = str(row['message'])
         self.new_step = 1
 
-
-    def parse_row(self):
-
-        self.step = int(self.row['step'])
-        self.vsp = float(self.row['Vsp'])
-        self.ilim_pos = float(self.row['Ilim_pos'])
-        self.ilim_neg = float(self.row['Ilim_neg'])
-        self.command = self.row['command']
-        self.value = float(self.row['value'])
-        self.message = self.row['message']
+    def next_step(self):
+        if self.index + 1 >= len(self.steps):
+            self.done = True
+        else:
+            self.goto_step(self.index + 1)
 
     def run_profile(self, battery):
-
-        if(self.command == 'timeout'):
-            return self.timeout_event()
-        if(self.command == 'end_current'):
-            return self.end_current_event(battery)
-        if(self.command == 'output_state'):
-            return self.output_state_event()
-        if(self.command == 'float_voltage'):
-            return self.float_voltage_event(battery)
+        return self.handlers[self.command_code](battery)
 
     def set_event_function(self, func):
         self.event_func = func
@@ -62,19 +148,19 @@ class profile_state_machine():
     def print_current_param(self, output_state = 'NA'):
         print('step = {}/{} | voltage = {}V / +ilim = {}A / -ilim = {}A / output state = {} : {}'.format(self.step,self.no_profile_steps, self.vsp, self.ilim_pos, self.ilim_neg, output_state,self.message))
 
-    def timeout_event(self):
+    def timeout_event(self, battery=None):
 
         if(self.new_step == 1):
 
             self.print_current_param(self.output_status)
             self.event_func(**self.get_step_params())
-            self.timer_start = time.time()
+            self.timer_start = self.clock.monotonic()
             self.new_step = 0
 
 
         if(self.new_step == 0):
             # Read time and trigger a step change when condition is met
-            self.current_time = time.time() - self.timer_start
+            self.current_time = self.clock.monotonic() - self.timer_start
             if(self.current_time > self.value):
                 print("{}s > {}s Timeout condition met.".format(self.current_time, self.value))
                 if(self.step == self.no_profile_steps):
@@ -116,7 +202,7 @@ class profile_state_machine():
                 else:
                     self.next_step()
 
-    def output_state_event(self):
+    def output_state_event(self, battery=None):
 
             if(self.new_step == 1):
                 if(self.value == 1):
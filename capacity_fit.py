@@ -0,0 +1,102 @@
+import numpy as np
+
+import json_files
+
+FIT_SUFFIX = '.fit.json'
+CONFIDENCE_Z = 1.96 # 95% two sided, normal approximation
+
+
+class soc_fit():
+    """ Least squares fit of the gauge SOC to the integrated current.
+
+    Model: soc = soc0 + 100 * charge / capacity, a straight line in charge.
+    Samples are folded in chunk by chunk as counts, means and centred sums
+    of squares (merged like parallel variances), so a log that does not fit
+    in memory is fitted in one streaming pass with the same numbers.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean_q = 0.0
+        self.mean_soc = 0.0
+        self.m2_q = 0.0
+        self.m2_soc = 0.0
+        self.c_qsoc = 0.0
+
+    def add(self, charge, soc):
+        """ Fold in charge [As] and gauge SOC [%] samples."""
+        n = len(charge)
+        if n == 0:
+            return
+        mean_q, mean_soc = charge.mean(), soc.mean()
+        dq, dsoc = charge - mean_q, soc - mean_soc
+        m2_q, m2_soc, c_qsoc = np.dot(dq, dq), np.dot(dsoc, dsoc), np.dot(dq, dsoc)
+        total = self.count + n
+        delta_q, delta_soc = mean_q - self.mean_q, mean_soc - self.mean_soc
+        weight = self.count * n / total
+        self.m2_q += m2_q + delta_q * delta_q * weight
+        self.m2_soc += m2_soc + delta_soc * delta_soc * weight
+        self.c_qsoc += c_qsoc + delta_q * delta_soc * weight
+        self.mean_q += delta_q * n / total
+        self.mean_soc += delta_soc * n / total
+        self.count = total
+
+    def result(self):
+        """ capacity_estimate of the samples added so far."""
+        if self.count < 3 or self.m2_q <= 0:
+            raise ValueError('charge does not change in the fit windows, capacity cannot be fitted')
+        slope = self.c_qsoc / self.m2_q
+        if slope <= 0:
+            raise ValueError('gauge SOC does not follow the integrated current, capacity cannot be fitted')
+        soc0 = self.mean_soc - slope * self.mean_q
+        residual_ss = max(self.m2_soc - slope * self.c_qsoc, 0.0)
+        variance = residual_ss / (self.count - 2)
+        slope_std = np.sqrt(variance / self.m2_q)
+        soc0_std = np.sqrt(variance * (1.0 / self.count + self.mean_q ** 2 / self.m2_q))
+        capacity_as = 100.0 / slope
+        return capacity_estimate(capacity_as, soc0, capacity_as * slope_std / slope, soc0_std,
+                                 np.sqrt(residual_ss / self.count), self.count)
+
+
+class capacity_estimate():
+    """ Fitted capacity [As] and SOC at the start of the window [%], with standard errors."""
+
+    def __init__(self, capacity_as, soc0, capacity_std, soc0_std, residual_rms, samples):
+        self.capacity_as = float(capacity_as)
+        self.soc0 = float(soc0)
+        self.capacity_std = float(capacity_std)
+        self.soc0_std = float(soc0_std)
+        self.residual_rms = float(residual_rms)
+        self.samples = int(samples)
+
+    def summary_lines(self):
+        return ['Fitted capacity = {:.2f} Ah +/- {:.2f} Ah (95%)'.format(
+                    self.capacity_as / 3600.0, CONFIDENCE_Z * self.capacity_std / 3600.0),
+                'Fitted initial SOC = {:.2f}% +/- {:.2f}% (95%)'.format(self.soc0, CONFIDENCE_Z * self.soc0_std),
+                'Fit residual rms = {:.3f}% over {} samples'.format(self.residual_rms, self.samples)]
+
+
+def load_fit(filename, settings):
+    """ Cached capacity_estimate of a log for these fit settings, None if missing, stale or unreadable."""
+    try:
+        cached = json_files.load_json(filename + FIT_SUFFIX)
+        signature = json_files.file_signature(filename)
+    except (OSError, ValueError):
+        return None
+    if cached.get('signature') != signature or cached.get('settings') != settings:
+        return None
+    return capacity_estimate(**cached['fit'])
+
+
+def save_fit(filename, settings, fit):
+    """ Cache a fit next to its log (<log>.fit.json), False when the directory is not writable.
+
+    The cache is only a shortcut, a read-only or shared log directory just
+    means the fit is computed again next time.
+    """
+    try:
+        json_files.save_json({'signature': json_files.file_signature(filename), 'settings': settings, 'fit': vars(fit)},
+                             filename + FIT_SUFFIX)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,73 @@
+QMAX_AS = 38.0 * 3600 # Estimated Capacity on H2P battery
+
+
+class coulomb_counter():
+    """ Streaming trapezoidal current integrator tracking a reference SOC against the gauge.
+
+    Each update is O(1): the charge, throughput and error statistics are kept as
+    running sums. The reference starts at the first gauge reading unless an
+    explicit soc_offset is given, reset() goes back to that choice.
+    """
+
+    def __init__(self, qmax_as=QMAX_AS, soc_offset=None, error_limit=None):
+        self.qmax_as = qmax_as
+        self.initial_soc_offset = soc_offset
+        self.error_limit = error_limit
+        self.reset()
+
+    def reset(self):
+        self.soc_offset = self.initial_soc_offset
+        self.last_time = None
+        self.last_current = 0.0
+        self.charge = 0.0
+        self.charge_in = 0.0
+        self.charge_out = 0.0
+        self.soc_ref = 0.0
+        self.error = 0.0
+        self.max_abs_error = 0.0
+        self.sum_sq_error = 0.0
+        self.samples = 0
+        self.flagged = False
+        self.flagged_time = None
+
+    def update(self, time, current, gauge_soc):
+        """ Integrate one sample [s, A, %] and return the gauge error against the reference."""
+        if self.last_time is None:
+            if self.soc_offset is None:
+                self.soc_offset = gauge_soc
+        else:
+            dq = 0.5 * (current + self.last_current) * (time - self.last_time)
+            self.charge += dq
+            if dq > 0:
+                self.charge_in += dq
+            else:
+                self.charge_out -= dq
+        self.last_time = time
+        self.last_current = current
+
+        self.soc_ref = self.soc_offset + 100.0 * self.charge / self.qmax_as
+        self.error = gauge_soc - self.soc_ref
+        abs_error = abs(self.error)
+        if abs_error > self.max_abs_error:
+            self.max_abs_error = abs_error
+        self.sum_sq_error += self.error * self.error
+        self.samples += 1
+
+        if self.error_limit is not None and abs_error > self.error_limit and not self.flagged:
+            self.flagged = True
+            self.flagged_time = time
+            print('{:2.2f}s SOC error {:2.2f}% exceeds {:2.2f}% limit'.format(time, self.error, self.error_limit))
+        return self.error
+
+    def rms_error(self):
+        return (self.sum_sq_error / self.samples) ** 0.5 if self.samples else 0.0
+
+    def summary_lines(self):
+        lines = ['qmax={:.1f}Ah soc_offset={}%'.format(self.qmax_as / 3600.0, self.soc_offset),
+                 'charge_in={:.3f}Ah charge_out={:.3f}Ah final_soc_ref={:.2f}%'.format(
+                     self.charge_in / 3600.0, self.charge_out / 3600.0, self.soc_ref),
+                 'soc_error max={:.2f}% rms={:.2f}% final={:.2f}%'.format(
+                     self.max_abs_error, self.rms_error(), self.error)]
+        if self.flagged:
+            lines.append('soc_error limit {}% exceeded at {:.1f}s'.format(self.error_limit, self.flagged_time))
+        return lines
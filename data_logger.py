@@ -0,0 +1,312 @@
+import argparse
+import itertools
+import json
+import os
+import struct
+import time
+import zlib
+import numpy as np
+
+# File layout:
+#   MAGIC, uint32 header length, JSON header {'channels': [...], 'block_size': n}
+#   then records of RECORD_HEADER (kind, sample count / byte count, crc32) + payload.
+#   'DATA' payload is float64 time[n] followed by float32 channel[n] per channel,
+#   'META' payload is a JSON object of metadata lines.
+MAGIC = b'BATTLOG1'
+RECORD_HEADER = struct.Struct('<4sII')
+LOG_EXTENSION = '.blog'
+
+
+class binary_logger():
+    """ Columnar binary logger buffering samples in preallocated blocks.
+
+    Samples are appended in place into a float64 time column and a float32
+    channel array. Full blocks are written and synced in one go, so a crash
+    loses at most the block being filled. With flush_interval set, a partial
+    block is also written once its oldest sample is that many seconds old, so
+    a viewer following the log is never further behind.
+    """
+
+    def __init__(self, filename, channels, block_size=1024, sync=True, flush_interval=None):
+        self.filename = filename
+        self.channels = list(channels)
+        self.block_size = block_size
+        self.sync = sync
+        self.flush_interval = flush_interval
+        self._block_started = None
+        self._time = np.empty(block_size, dtype=np.float64)
+        self._data = np.empty((len(self.channels), block_size), dtype=np.float32)
+        self._count = 0
+        self.samples = 0
+        self.file = open(filename, 'wb')
+        header = json.dumps({'channels': self.channels, 'block_size': block_size}).encode('utf-8')
+        self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._sync()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, time, *values):
+        """ Add one sample, time followed by one value per channel."""
+        i = self._count
+        self._time[i] = time
+        self._data[:, i] = values
+        self._count = i + 1
+        self.samples += 1
+        if self._count == self.block_size or self._flush_due():
+            self.flush()
+
+    def append_block(self, times, values):
+        """ Add many samples at once, values has one row per sample and one column per channel."""
+        n = len(times)
+        pos = 0
+        while pos < n:
+            i = self._count
+            take = min(n - pos, self.block_size - i)
+            self._time[i:i + take] = times[pos:pos + take]
+            self._data[:, i:i + take] = values[pos:pos + take].T
+            self._count = i + take
+            pos += take
+            if self._count == self.block_size:
+                self.flush()
+        self.samples += n
+        if self._flush_due():
+            self.flush()
+
+    def add_metadata(self, key, lines):
+        """ Store a list of text lines (settings, timing summary...) in the log."""
+        payload = json.dumps({key: list(lines)}).encode('utf-8')
+        self._write_record(b'META', len(payload), payload)
+
+    def _flush_due(self):
+        if self.flush_interval is None or self._count == 0:
+            return False
+        now = time.monotonic()
+        if self._block_started is None:
+            self._block_started = now
+        return now - self._block_started >= self.flush_interval
+
+    def flush(self):
+        """ Write the samples buffered so far as one block."""
+        n = self._count
+        if n == 0:
+            return
+        payload = self._time[:n].tobytes() + self._data[:, :n].tobytes()
+        self._write_record(b'DATA', n, payload)
+        self._count = 0
+        self._block_started = None
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+    def _write_record(self, kind, size, payload):
+        self.file.write(RECORD_HEADER.pack(kind, size, zlib.crc32(payload) & 0xFFFFFFFF) + payload)
+        self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+
+def read_header(raw):
+    """ (channels, offset of the first record) from the start of a memory-mapped log."""
+    if bytes(raw[:len(MAGIC)]) != MAGIC:
+        raise ValueError('not a binary test log')
+    offset = len(MAGIC)
+    header_len, = struct.unpack_from('<I', raw, offset)
+    offset += 4
+    header = json.loads(bytes(raw[offset:offset + header_len]).decode('utf-8'))
+    return header['channels'], offset + header_len
+
+
+def iter_records(raw, offset, channels):
+    """ Yield (kind, payload, end offset) for each complete record from offset on.
+
+    DATA payloads are (time, channel array) views on raw, META payloads are
+    dicts. Stops at the first torn or corrupt record.
+    """
+    while offset + RECORD_HEADER.size <= len(raw):
+        kind, size, crc = RECORD_HEADER.unpack_from(raw, offset)
+        start = offset + RECORD_HEADER.size
+        if kind == b'DATA':
+            end = start + size * (8 + 4 * len(channels))
+        else:
+            end = start + size
+        if end > len(raw) or zlib.crc32(raw[start:end]) & 0xFFFFFFFF != crc:
+            return
+        if kind == b'DATA':
+            yield kind, (raw[start:start + 8 * size].view(np.float64),
+                         raw[start + 8 * size:end].view(np.float32).reshape(len(channels), size)), end
+        elif kind == b'META':
+            yield kind, json.loads(bytes(raw[start:end]).decode('utf-8')), end
+        offset = end
+
+
+def read_log(filename):
+    """ Read a binary log into column arrays.
+
+    Returns (columns, metadata) where columns maps 'time' and each channel name
+    to a NumPy array. Blocks are views on a memory map of the file. A torn or
+    corrupt trailing block left by a crash is ignored.
+    """
+    raw = np.memmap(filename, dtype=np.uint8, mode='r')
+    try:
+        channels, offset = read_header(raw)
+    except ValueError:
+        raise ValueError('{} is not a binary test log'.format(filename))
+
+    time_blocks, channel_blocks, metadata = [], [], {}
+    for kind, payload, offset in iter_records(raw, offset, channels):
+        if kind == b'DATA':
+            time_blocks.append(payload[0])
+            channel_blocks.append(payload[1])
+        else:
+            metadata.update(payload)
+
+    columns = {}
+    if time_blocks:
+        columns['time'] = np.concatenate(time_blocks)
+        data = np.concatenate(channel_blocks, axis=1)
+    else:
+        columns['time'] = np.empty(0, dtype=np.float64)
+        data = np.empty((len(channels), 0), dtype=np.float32)
+    for i, name in enumerate(channels):
+        columns[name] = data[i]
+    return columns, metadata
+
+
+def iter_log_chunks(filename, chunk_size=65536):
+    """ Yield a binary or .csv log as float64 structured arrays of at most chunk_size samples.
+
+    Binary logs are walked block by block on a memory map, CSV files are parsed
+    chunk_size lines at a time, so memory stays bounded whatever the file size.
+    """
+    if filename.endswith(LOG_EXTENSION):
+        raw = np.memmap(filename, dtype=np.uint8, mode='r')
+        channels, offset = read_header(raw)
+        dtype = [(name, np.float64) for name in ['time'] + channels]
+        for kind, payload, offset in iter_records(raw, offset, channels):
+            if kind != b'DATA':
+                continue
+            times, values = payload
+            for start in range(0, len(times), chunk_size):
+                chunk = np.empty(min(chunk_size, len(times) - start), dtype=dtype)
+                chunk['time'] = times[start:start + chunk_size]
+                for i, name in enumerate(channels):
+                    chunk[name] = values[i, start:start + chunk_size]
+                yield chunk
+        return
+
+    with open(filename) as f:
+        header = f.readline()
+        while header.startswith('#'):
+            header = f.readline()
+        dtype = [(name, np.float64) for name in header.strip().split(',')]
+        while True:
+            lines = [line for line in itertools.islice(f, chunk_size) if not line.startswith('#')]
+            if not lines:
+                return
+            yield np.loadtxt(lines, delimiter=',', ndmin=1, dtype=dtype)
+
+
+def read_channels(filename):
+    """ Channel names of a binary log, or the columns after time of a .csv export."""
+    if filename.endswith(LOG_EXTENSION):
+        raw = np.memmap(filename, dtype=np.uint8, mode='r')
+        return read_header(raw)[0]
+    with open(filename) as f:
+        header = f.readline()
+        while header.startswith('#'):
+            header = f.readline()
+    return header.strip().split(',')[1:]
+
+
+def read_metadata(filename):
+    """ Metadata of a binary log, or the leading '#' lines of a .csv export as {'comments': lines}."""
+    if filename.endswith(LOG_EXTENSION):
+        return read_log(filename)[1]
+    lines = []
+    with open(filename) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            lines.append(line[1:].strip())
+    return {'comments': lines} if lines else {}
+
+
+class log_follower():
+    """ Read the blocks appended to a binary log that is still being written.
+
+    Each poll maps the file again and parses only the records after the last
+    complete one seen, so following a long test costs the new data only.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.channels = None
+        self.offset = None
+        self.metadata = {}
+        self.samples = 0
+
+    def poll(self):
+        """ New samples as (time, channel array [channels x n]), None when nothing new."""
+        if not os.path.exists(self.filename) or os.path.getsize(self.filename) <= (self.offset or 0):
+            return None
+        raw = np.memmap(self.filename, dtype=np.uint8, mode='r')
+        if self.channels is None:
+            try:
+                self.channels, self.offset = read_header(raw)
+            except (ValueError, struct.error):
+                # Header not completely written yet
+                return None
+        time_blocks, channel_blocks = [], []
+        for kind, payload, self.offset in iter_records(raw, self.offset, self.channels):
+            if kind == b'DATA':
+                time_blocks.append(np.array(payload[0]))
+                channel_blocks.append(np.array(payload[1]))
+            else:
+                self.metadata.update(payload)
+        del raw
+        if not time_blocks:
+            return None
+        times = np.concatenate(time_blocks)
+        self.samples += len(times)
+        return times, np.concatenate(channel_blocks, axis=1)
+
+
+def export_csv(log_filename, csv_filename):
+    """ Convert a binary log to the CSV layout display_data.py reads."""
+    columns, metadata = read_log(log_filename)
+    names = list(columns)
+    table = np.column_stack([columns[name].astype(np.float64) for name in names])
+    with open(csv_filename, 'w') as f:
+        for lines in metadata.values():
+            for line in lines:
+                f.write('# {}\n'.format(line))
+        f.write(','.join(names) + '\n')
+        np.savetxt(f, table, fmt=['%.6f'] + ['%.7g'] * (len(names) - 1), delimiter=',')
+    return len(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a binary test log to CSV')
+    parser.add_argument('log_file', help='Choose binary log [{}] to export'.format(LOG_EXTENSION), type=str)
+    parser.add_argument('csv_file', help='Output .csv file (default: same name)', type=str, nargs='?', default=None)
+    args = parser.parse_args()
+
+    csv_file = args.csv_file
+    if csv_file is None:
+        csv_file = os.path.splitext(args.log_file)[0] + '.csv'
+    rows = export_csv(args.log_file, csv_file)
+    print('Exported {} samples to {}'.format(rows, csv_file))
+
+
+if __name__ == '__main__':
+    main()
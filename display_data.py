@@ -1,65 +1,404 @@
 import argparse
-import csv
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import integrate
+
+import capacity_fit
+import data_logger
+import log_archive
+
+QMAX_AS = 38.0 * 3600 # Estimated Capacity on H2P battery, used when the fit is skipped or fails
+SOC_START = 100.0 # % assumed at the window start with QMAX_AS
+SOC_WINDOW_START = 50.0
+
 
 def find_local_min(value_list, min_val):
     """ Find minimum of values in range larger than min_val."""
-    return min([val for val in value_list if val >= min_val])
-
-parser = argparse.ArgumentParser(description='Script used to display SOC gauge Test Results')
-parser.add_argument('csv_file', help='Choose data [.csv] to display', type=str)
-args = parser.parse_args()
-
-
-filename = args.csv_file
-time, batt_volt, batt_curr, batt_soc, charger_volt, charger_curr = [],[],[],[],[],[]
-with open(filename) as f:
-    reader = csv.DictReader(f)
-
-    for row in reader:
-        time.append(float(row['time']))
-        batt_volt.append(float(row['batt_voltage']))
-        batt_curr.append(float(row['batt_current']))
-        batt_soc.append(float(row['batt_soc']))
-        charger_volt.append(float(row['charger_voltage']))
-        charger_curr.append(float(row['charger_current']))
-
-    # Convert data to numpy arrays
-    # time = np.array(time)
-    # batt_volt = np.array(batt_volt)
-    # batt_curr = np.array(batt_curr)
-    # batt_soc = np.array(batt_soc)
-    # charger_volt = np.array(charger_volt)
-    # charger_curr = np.array(charger_curr)
-
-    # Start data where 100% SOC was reached
-    window_l = min([i for i,v in enumerate(batt_soc) if v >= 50.0])
-    window_r = len(time)
-    print(window_l, window_r)
-    time = time[window_l:window_r]
-    batt_volt = batt_volt[window_l:window_r]
-    batt_curr = batt_curr[window_l:window_r]
-    batt_soc = batt_soc[window_l:window_r]
-    charger_volt = charger_volt[window_l:window_r]
-    charger_curr = charger_curr[window_l:window_r]
-    print('Test time = {:2.2f}s ({:2.2f}h)'.format(time[-1],time[-1]/3600.0))
-    print('Final Voltage = {:2.2f}V : Final SOC = {:2.2f}%'.format(batt_volt[-1], batt_soc[-1]))
-    qmax_as = 38.0 * 3600 # Estimated Capacity on H2P battery
-    q = integrate.cumtrapz(batt_curr, time, initial=0)
-    soc_calc = 100*(1-(qmax_as - q) / qmax_as) + 100
-
-    #ylim_min = find_local_min(batt_soc, 50.0)
-    ylim_min = min(batt_soc)
-
-    fig, axs = plt.subplots(3, 1)
-    axs[0].plot(time,batt_volt)
-    axs[1].plot(time,batt_curr)
-    axs[2].plot(time,batt_soc)
-    axs[2].plot(time,soc_calc+1)
-    axs[2].plot(time,soc_calc-1)
-    axs[2].set_ylim([ylim_min-5, 105])
+    values = np.asarray(value_list)
+    return values[values >= min_val].min()
+
+
+def load_log(filename, start=None, end=None):
+    """ Load a soc_gauge_test log (.csv, binary or archive) into a NumPy structured array.
+
+    The CSV is parsed in a single pass by np.loadtxt, '#' metadata lines are skipped.
+    start/end [s] keep only that time range, an archive then reads only the blocks involved.
+    """
+    if filename.endswith(log_archive.ARCHIVE_EXTENSION):
+        return log_archive.log_archive(filename).read(t0=start, t1=end)
+
+    if filename.endswith(data_logger.LOG_EXTENSION):
+        columns, _ = data_logger.read_log(filename)
+        data = np.empty(len(columns['time']), dtype=[(name, np.float64) for name in columns])
+        for name in columns:
+            data[name] = columns[name]
+    else:
+        with open(filename) as f:
+            header = f.readline()
+            while header.startswith('#'):
+                header = f.readline()
+            names = header.strip().split(',')
+            data = np.loadtxt(f, delimiter=',', comments='#', ndmin=1,
+                              dtype=[(name, np.float64) for name in names])
+    return data[_time_range(data['time'], start, end)]
+
+
+def _time_range(time, start, end):
+    keep = np.ones(len(time), dtype=bool)
+    if start is not None:
+        keep &= time >= start
+    if end is not None:
+        keep &= time <= end
+    return keep
+
+
+def find_window_start(batt_soc, threshold=SOC_WINDOW_START):
+    """ Index of the first sample where SOC reaches threshold."""
+    above = np.asarray(batt_soc) >= threshold
+    if not above.any():
+        raise ValueError('SOC never reaches {}%'.format(threshold))
+    return int(np.argmax(above))
+
+
+def integrate_current(time, current):
+    """ Cumulative trapezoidal integral of current over time [As], starting at 0."""
+    q = np.zeros(len(time))
+    np.cumsum(0.5 * (current[1:] + current[:-1]) * np.diff(time), out=q[1:])
+    return q
+
+
+def soc_reference(time, current, qmax_as=QMAX_AS, soc0=SOC_START):
+    """ Coulomb counted SOC reference [%] starting from soc0."""
+    q = integrate_current(time, current)
+    return soc0 + 100 * q / qmax_as
+
+
+def analyse(data, threshold=SOC_WINDOW_START, qmax_as=QMAX_AS, soc0=SOC_START):
+    """ Window the log on the SOC threshold and compute the coulomb counted reference.
+
+    Returns (windowed data, soc_calc).
+    """
+    # Start data where the SOC threshold was reached
+    window_l = find_window_start(data['batt_soc'], threshold)
+    data = data[window_l:]
+    return data, soc_reference(data['time'], data['batt_current'], qmax_as, soc0)
+
+
+def iter_log_chunks(filename, chunk_size=65536, start=None, end=None):
+    """ Yield a log (.csv, binary or archive) in [start, end] as structured arrays of at most chunk_size samples."""
+    if filename.endswith(log_archive.ARCHIVE_EXTENSION):
+        yield from log_archive.log_archive(filename).iter_chunks(chunk_size, t0=start, t1=end)
+        return
+    for chunk in data_logger.iter_log_chunks(filename, chunk_size):
+        if end is not None and len(chunk) and chunk['time'][0] > end:
+            # Logs are in time order, nothing further is in range
+            return
+        if start is not None or end is not None:
+            chunk = chunk[_time_range(chunk['time'], start, end)]
+        if len(chunk):
+            yield chunk
+
+
+def skip_to_window(filename, threshold=SOC_WINDOW_START):
+    """ (window start index, window start time) of an archive, or None for other logs.
+
+    Found from the per-block SOC maxima, the blocks before the window are never decompressed.
+    """
+    if not filename.endswith(log_archive.ARCHIVE_EXTENSION):
+        return None
+    found = log_archive.log_archive(filename).first_time('batt_soc', threshold)
+    if found is None:
+        raise ValueError('SOC never reaches {}%'.format(threshold))
+    return found
+
+
+class log_statistics():
+    """ Min/max/mean per channel and SOC error (gauge - reference) statistics, fed chunk by chunk."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.count = 0
+        self.sums = np.zeros(len(self.names))
+        self.mins = np.full(len(self.names), np.inf)
+        self.maxs = np.full(len(self.names), -np.inf)
+        self.error_square_sum = 0.0
+        self.error_max_abs = 0.0
+        self.last = None
+        self.last_soc_calc = np.nan
+
+    def add(self, data, soc_calc):
+        if len(data) == 0:
+            return
+        for i, name in enumerate(self.names):
+            values = data[name]
+            self.sums[i] += values.sum()
+            self.mins[i] = min(self.mins[i], values.min())
+            self.maxs[i] = max(self.maxs[i], values.max())
+        error = data['batt_soc'] - soc_calc
+        self.error_square_sum += np.dot(error, error)
+        self.error_max_abs = max(self.error_max_abs, np.abs(error).max())
+        self.count += len(data)
+        self.last = data[-1].copy()
+        self.last_soc_calc = soc_calc[-1]
+
+    def summary_lines(self):
+        if self.count == 0:
+            return ['No samples in window']
+        lines = ['Test time = {:2.2f}s ({:2.2f}h)'.format(self.last['time'], self.last['time'] / 3600.0),
+                 'Final Voltage = {:2.2f}V : Final SOC = {:2.2f}%'.format(self.last['batt_voltage'], self.last['batt_soc']),
+                 'SOC error: max = {:2.2f}% rms = {:2.2f}% final = {:2.2f}%'.format(
+                     self.error_max_abs, np.sqrt(self.error_square_sum / self.count), self.last['batt_soc'] - self.last_soc_calc)]
+        for i, name in enumerate(self.names):
+            lines.append('{}: min = {:.6g} max = {:.6g} mean = {:.6g}'.format(
+                name, self.mins[i], self.maxs[i], self.sums[i] / self.count))
+        return lines
+
+
+def iter_window_charge(filename, threshold=SOC_WINDOW_START, chunk_size=65536, start=None, end=None):
+    """ Yield (window start index, chunk, charge [As]) over the SOC window of a log, in chunks.
+
+    The charge integral is carried across chunks in the same summation order
+    as integrate_current, so it matches the in-memory path.
+    """
+    window_l = None
+    seen = 0
+    if start is None:
+        window = skip_to_window(filename, threshold)
+        if window is not None:
+            seen, start = window
+    q = 0.0
+    previous = None
+    for chunk in iter_log_chunks(filename, chunk_size, start, end):
+        if len(chunk) == 0:
+            continue
+        if window_l is None:
+            above = chunk['batt_soc'] >= threshold
+            if not above.any():
+                seen += len(chunk)
+                continue
+            start = int(np.argmax(above))
+            window_l = seen + start
+            chunk = chunk[start:]
+        time, current = chunk['time'], chunk['batt_current']
+        if previous is None:
+            steps = 0.5 * (current[1:] + current[:-1]) * np.diff(time)
+            charge = np.cumsum(np.concatenate(([q], steps)))
+        else:
+            steps = 0.5 * (current + np.concatenate(([previous[1]], current[:-1]))) * np.diff(time, prepend=previous[0])
+            charge = np.cumsum(np.concatenate(([q], steps)))[1:]
+        q = charge[-1]
+        previous = (time[-1], current[-1])
+        yield window_l, chunk, charge
+    if window_l is None:
+        raise ValueError('SOC never reaches {}%'.format(threshold))
+
+
+def analyse_chunked(filename, threshold=SOC_WINDOW_START, qmax_as=QMAX_AS, chunk_size=65536, start=None, end=None, soc0=SOC_START):
+    """ Same analysis as analyse() streamed over the log in chunks.
+
+    Returns (window start index, log_statistics).
+    """
+    stats = None
+    for window_l, chunk, charge in iter_window_charge(filename, threshold, chunk_size, start, end):
+        if stats is None:
+            stats = log_statistics(chunk.dtype.names)
+        stats.add(chunk, soc0 + 100 * charge / qmax_as)
+    return window_l, stats
+
+
+def _fit_mask(time, windows):
+    if not windows:
+        return slice(None)
+    keep = np.zeros(len(time), dtype=bool)
+    for t0, t1 in windows:
+        keep |= _time_range(time, t0, t1)
+    return keep
+
+
+def fit_log(filename, data=None, windows=None, threshold=SOC_WINDOW_START, start=None, end=None, chunk_size=65536):
+    """ Capacity and SOC at the window start fitted to the gauge SOC, cached next to the log when its directory is writable.
+
+    data is the windowed log (from analyse) when already loaded, otherwise the
+    log is streamed in chunks. windows [(t0, t1), ...] restricts the fit to
+    those time ranges, by default the whole window is used.
+    """
+    windows = [[t0, t1] for t0, t1 in windows or []]
+    settings = {'threshold': threshold, 'start': start, 'end': end, 'windows': windows}
+    fit = capacity_fit.load_fit(filename, settings)
+    if fit is not None:
+        return fit
+    fitter = capacity_fit.soc_fit()
+    if data is not None:
+        keep = _fit_mask(data['time'], windows)
+        fitter.add(integrate_current(data['time'], data['batt_current'])[keep], data['batt_soc'][keep])
+    else:
+        for window_l, chunk, charge in iter_window_charge(filename, threshold, chunk_size, start, end):
+            keep = _fit_mask(chunk['time'], windows)
+            fitter.add(charge[keep], chunk['batt_soc'][keep])
+    fit = fitter.result()
+    capacity_fit.save_fit(filename, settings, fit)
+    return fit
+
+
+def maximize_window():
+    """ Maximize the current figure window where the backend allows it."""
+    import matplotlib.pyplot as plt
     mng = plt.get_current_fig_manager()
-    mng.window.showMaximized()
+    window = getattr(mng, 'window', None)
+    if hasattr(window, 'showMaximized'):
+        # Qt
+        window.showMaximized()
+    elif hasattr(mng, 'resize') and hasattr(window, 'maxsize'):
+        # Tk
+        mng.resize(*window.maxsize())
+
+
+class plot_pyramid():
+    """ Min/max decimation levels of one trace for zoom-dependent drawing.
+
+    Level 0 is the raw trace, each next level folds factor buckets of the one
+    below into one bucket keeping its min and max, so a spike is still visible
+    at every level where plain subsampling would drop it.
+    """
+
+    def __init__(self, time, values, factor=4, min_points=1000):
+        self.factor = factor
+        self.levels = [(np.asarray(time), np.asarray(values), np.asarray(values))]
+        while len(self.levels[-1][0]) > min_points:
+            self.levels.append(self._decimate(*self.levels[-1]))
+
+    def _decimate(self, time, low, high):
+        full = len(time) // self.factor * self.factor
+        t = time[:full:self.factor]
+        lo = low[:full].reshape(-1, self.factor).min(axis=1)
+        hi = high[:full].reshape(-1, self.factor).max(axis=1)
+        if full < len(time):
+            t = np.append(t, time[full])
+            lo = np.append(lo, low[full:].min())
+            hi = np.append(hi, high[full:].max())
+        return t, lo, hi
+
+    def view(self, t0, t1, max_points=4000):
+        """ (time, min, max) over [t0, t1] from the finest level with at most max_points there."""
+        for time, low, high in self.levels:
+            first = max(int(np.searchsorted(time, t0, 'right')) - 1, 0)
+            last = min(int(np.searchsorted(time, t1, 'right')) + 1, len(time))
+            if last - first <= max_points:
+                break
+        return time[first:last], low[first:last], high[first:last]
+
+
+def plot_figure(data, soc_calc, max_points=4000):
+    """ Voltage, current and SOC panels drawn from plot pyramids, returns (fig, axs).
+
+    The whole test is drawn from a coarse level; zooming or panning redraws
+    the visible range from the finest level that fits max_points per trace.
+    """
+    import matplotlib.pyplot as plt
+
+    #ylim_min = find_local_min(data['batt_soc'], 50.0)
+    ylim_min = data['batt_soc'].min()
+
+    time = data['time']
+    traces = [(0, plot_pyramid(time, data['batt_voltage']), [0]),
+              (1, plot_pyramid(time, data['batt_current']), [0]),
+              (2, plot_pyramid(time, data['batt_soc']), [0]),
+              (2, plot_pyramid(time, soc_calc), [1, -1])]
+
+    fig, axs = plt.subplots(3, 1, sharex=True)
+    lines = []
+    for ax, pyramid, offsets in traces:
+        for offset in offsets:
+            low = ax.plot([], [])[0]
+            high = ax.plot([], [], color=low.get_color())[0]
+            lines.append((pyramid, offset, low, high))
+
+    def draw(ax=None):
+        t0, t1 = axs[0].get_xlim()
+        for pyramid, offset, low, high in lines:
+            t, lo, hi = pyramid.view(t0, t1, max_points)
+            low.set_data(t, lo + offset)
+            high.set_data(t, hi + offset)
+        fig.canvas.draw_idle()
+
+    for ax in axs:
+        ax.set_xlim(time[0], time[-1])
+    draw()
+    for ax in axs[:2]:
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+    axs[2].set_ylim([ylim_min-5, 105])
+    axs[0].callbacks.connect('xlim_changed', draw)
+    return fig, axs
+
+
+def plot(data, soc_calc, max_points=4000):
+    import matplotlib.pyplot as plt
+
+    plot_figure(data, soc_calc, max_points)
+    maximize_window()
     plt.show()
+
+
+def fitted_reference(filename, data, windows, start, end, chunk_size=65536):
+    """ fit_log for main(), prints the fit, None (and a note) when it fails."""
+    try:
+        fit = fit_log(filename, data, windows, start=start, end=end, chunk_size=chunk_size)
+    except ValueError as e:
+        print('Capacity fit failed ({}), using {:.1f} Ah from {:.0f}%'.format(e, QMAX_AS / 3600.0, SOC_START))
+        return None
+    for line in fit.summary_lines():
+        print(line)
+    return fit
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Script used to display SOC gauge Test Results')
+    parser.add_argument('csv_file', help='Choose data [.csv, {} or {}] to display'.format(data_logger.LOG_EXTENSION, log_archive.ARCHIVE_EXTENSION), type=str)
+    parser.add_argument('--chunked', help='Stream the log in chunks and print the analysis, for logs too big for memory (no plot)', action='store_true')
+    parser.add_argument('--chunk-size', help='Samples per chunk with --chunked (default 65536)', type=int, default=65536)
+    parser.add_argument('--no-plot', help='Only print the analysis', action='store_true')
+    parser.add_argument('--points', help='Points drawn per trace, finer detail is loaded on zoom (default 4000)', type=int, default=4000)
+    parser.add_argument('--start', help='Only analyse samples from this time [s]', type=float, default=None)
+    parser.add_argument('--end', help='Only analyse samples up to this time [s]', type=float, default=None)
+    parser.add_argument('--fit-window', help='Fit capacity and initial SOC over t0:t1 [s] only, can be repeated (default: whole window)', type=str, action='append', default=[])
+    parser.add_argument('--qmax-ah', help='Skip the fit, use this capacity [Ah] from {:.0f}% SOC'.format(SOC_START), type=float, default=None)
+    args = parser.parse_args()
+    windows = [[float(t) for t in window.split(':')] for window in args.fit_window]
+    qmax_as, soc0 = QMAX_AS, SOC_START
+    if args.qmax_ah is not None:
+        qmax_as = args.qmax_ah * 3600
+
+    if args.chunked:
+        if args.qmax_ah is None:
+            fit = fitted_reference(args.csv_file, None, windows, args.start, args.end, args.chunk_size)
+            if fit is not None:
+                qmax_as, soc0 = fit.capacity_as, fit.soc0
+        window_l, stats = analyse_chunked(args.csv_file, qmax_as=qmax_as, chunk_size=args.chunk_size, start=args.start, end=args.end, soc0=soc0)
+        print(window_l, window_l + stats.count)
+        for line in stats.summary_lines():
+            print(line)
+        return
+
+    window = skip_to_window(args.csv_file) if args.start is None else None
+    if window is not None:
+        # Archive: load from the window start only
+        window_l, start = window
+        data = load_log(args.csv_file, start, args.end)
+        print(window_l, window_l + len(data))
+    else:
+        data = load_log(args.csv_file, args.start, args.end)
+        window_l = find_window_start(data['batt_soc'])
+        print(window_l, len(data))
+    data, soc_calc = analyse(data, qmax_as=qmax_as)
+    if args.qmax_ah is None:
+        fit = fitted_reference(args.csv_file, data, windows, args.start, args.end)
+        if fit is not None:
+            soc_calc = soc_reference(data['time'], data['batt_current'], fit.capacity_as, fit.soc0)
+    stats = log_statistics(data.dtype.names)
+    stats.add(data, soc_calc)
+    for line in stats.summary_lines():
+        print(line)
+    if not args.no_plot:
+        plot(data, soc_calc, args.points)
+
+if __name__ == '__main__':
+    main()
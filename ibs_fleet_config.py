@@ -0,0 +1,125 @@
+import argparse
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import batt_ibs_config
+import ibs_registers
+
+# Columns of the fleet manifest .csv, one row per LIN interface. Leave a
+# parameter empty to keep the sensor's value.
+MANIFEST_COLUMNS = ['interface', 'generation', 'c_nominal', 'u0_min', 'u0_max', 'batt_tech', 'iqbatt']
+PARAMETER_TYPES = {'c_nominal': float, 'u0_min': int, 'u0_max': int, 'batt_tech': str, 'iqbatt': int}
+
+
+def load_manifest(file):
+    """ Read a fleet manifest into a list of sensor settings dicts."""
+    manifest = []
+    for line_no, row in enumerate(csv.DictReader(file), start=2):
+        sensor = {'interface': (row.get('interface') or '').strip(), 'generation': (row.get('generation') or '').strip()}
+        if not sensor['interface'] or sensor['generation'] not in ibs_registers.REGISTER_MAPS:
+            raise ValueError('Manifest line {}: need an interface and a generation ({})'.format(
+                line_no, ', '.join(ibs_registers.REGISTER_MAPS)))
+        for name, convert in PARAMETER_TYPES.items():
+            value = (row.get(name) or '').strip()
+            try:
+                sensor[name] = convert(value) if value else None
+            except ValueError:
+                raise ValueError('Manifest line {}: bad {} {!r}'.format(line_no, name, value))
+        try:
+            ibs_registers.register_map(sensor['generation']).parameter_values(**{name: sensor[name] for name in PARAMETER_TYPES})
+        except ValueError as e:
+            raise ValueError('Manifest line {}: {}'.format(line_no, e))
+        manifest.append(sensor)
+    interfaces = [sensor['interface'] for sensor in manifest]
+    if len(set(interfaces)) != len(interfaces):
+        raise ValueError('Manifest interfaces must be unique, one sensor per LIN interface')
+    return manifest
+
+
+class sensor_result():
+    """ Pass/fail outcome of one sensor configuration."""
+
+    def __init__(self, sensor):
+        self.interface = sensor['interface']
+        self.generation = sensor['generation']
+        self.passed = False
+        self.elapsed = 0.0
+        self.failures = []
+        self.transactions = 0
+        self.summary = ''
+
+    def line(self):
+        return '{} | {} | {} | {:.1f} s | {} transactions | {}{}'.format(
+            self.interface, self.generation, 'PASS' if self.passed else 'FAIL', self.elapsed,
+            self.transactions, self.summary, ' | ' + ', '.join(self.failures) if self.failures else '')
+
+
+def configure_sensor(sensor, sim=False, cache=None, use_cache=True):
+    """ Configure and verify one sensor of the manifest, never raises."""
+    result = sensor_result(sensor)
+    start = time.time()
+    try:
+        registers = ibs_registers.register_map(sensor['generation'])
+        writes = registers.parameter_values(**{name: sensor[name] for name in PARAMETER_TYPES})
+        with batt_ibs_config.diag_engine(registers, sensor['interface'], sim=sim, verbose=False) as engine:
+            outcome = batt_ibs_config.configure(engine, registers, writes, clock=engine.clock, verbose=False, cache=cache, use_cache=use_cache)
+        result.transactions = len(outcome.results)
+        result.summary = outcome.summary()
+        result.failures = outcome.failures()
+        result.passed = outcome.ok()
+    except Exception as e:
+        result.failures.append('error: {}'.format(e))
+    result.elapsed = time.time() - start
+    print(result.line())
+    return result
+
+
+def configure_fleet(manifest, sim=False, cache=None, use_cache=True):
+    """ Configure every sensor concurrently, one worker per LIN interface.
+
+    Workers update cache (one key per sensor), save it once they are all done.
+    """
+    with ThreadPoolExecutor(max_workers=max(len(manifest), 1)) as pool:
+        return list(pool.map(lambda sensor: configure_sensor(sensor, sim, cache, use_cache), manifest))
+
+
+def report_lines(results, elapsed):
+    passed = sum(result.passed for result in results)
+    lines = [result.line() for result in results]
+    lines.append('{}/{} sensors passed in {:.1f} s (slowest sensor {:.1f} s)'.format(
+        passed, len(results), elapsed, max([result.elapsed for result in results] or [0])))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Configure and verify a fleet of IBS sensors in parallel')
+    parser.add_argument('manifest', help='Fleet manifest .csv ({})'.format(','.join(MANIFEST_COLUMNS)), type=str)
+    parser.add_argument('--sim', help='Configure simulated sensors instead of the LIN interfaces', action='store_true')
+    parser.add_argument('--cache', help='Configuration cache file (default {})'.format(batt_ibs_config.CONFIG_CACHE_FILE), type=str, default=batt_ibs_config.CONFIG_CACHE_FILE)
+    parser.add_argument('--no-cache', help='Read every sensor even if the cache says it is configured (the cache is still updated)', action='store_true')
+    parser.add_argument('--report', help='Also write the report to this file', type=str, default=None)
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = load_manifest(f)
+    print('Configuring {} sensors: {}'.format(len(manifest), ', '.join(sensor['interface'] for sensor in manifest)))
+
+    cache = batt_ibs_config.load_config_cache(args.cache)
+    start = time.time()
+    results = configure_fleet(manifest, sim=args.sim, cache=cache, use_cache=not args.no_cache)
+    # Simulated sensors must not end up in the cache of the real ones
+    if not args.sim:
+        batt_ibs_config.save_config_cache(cache, args.cache)
+    lines = report_lines(results, time.time() - start)
+
+    print('\nFleet configuration report')
+    for line in lines:
+        print(line)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    main()
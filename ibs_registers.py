@@ -0,0 +1,186 @@
+from collections import namedtuple, OrderedDict
+
+from lin_diag import diag_transaction
+
+READ_BY_ID = 0xB2
+WRITE_BY_ID = 0xB5
+TABLE_STATE = 0x30
+TABLE_SWITCH = 0x31
+TABLE_SWITCH_KEY = [0x11, 0x22, 0x33, 0x44]
+
+# One value inside a parameter's data bytes, big-endian unsigned raw = value / scale.
+# Values must be a whole number of scale steps, the IBS could not store anything else.
+# choices maps names to raw values (e.g. battery tech), default is used when the value is not given.
+ibs_field = namedtuple('ibs_field', ['name', 'size', 'scale', 'choices', 'default'])
+
+
+def field(name, size=1, scale=1, choices=None, default=None):
+    return ibs_field(name, size, scale, choices, default)
+
+
+class ibs_parameter():
+    """ One IBS configuration parameter read and written by data id.
+
+    Frames are built once per value and kept as immutable diag_transactions,
+    so asking for the same write twice is a dict lookup. The Hella 0xB2
+    responses echo the data id before the data (echo_id), standard LIN
+    ReadByIdentifier responses do not.
+    """
+
+    def __init__(self, name, data_id, fields, nad=0x01, echo_id=True):
+        self.name = name
+        self.data_id = data_id
+        self.fields = fields
+        self.nad = nad
+        self.echo_id = echo_id
+        self.size = sum(f.size for f in fields)
+        self.read = diag_transaction('Check ' + name, [nad, 0x06, READ_BY_ID, data_id, 0xFF, 0x7F, 0xFF, 0xFF])
+        self._writes = {}
+
+    def values(self, given):
+        """ {field: value} for every field, from the given values and field defaults.
+
+        Raises ValueError when a value cannot be encoded, before anything is sent.
+        """
+        values = {}
+        for f in self.fields:
+            value = given.get(f.name)
+            if value is None:
+                value = f.default
+            if value is None:
+                raise ValueError('{}: {} is required'.format(self.name, f.name))
+            values[f.name] = value
+        self.encode(values)
+        return values
+
+    def encode(self, values):
+        data = bytearray()
+        for f in self.fields:
+            value = values[f.name]
+            if f.choices is not None:
+                if value not in f.choices:
+                    raise ValueError('{}: {} must be one of {}'.format(self.name, f.name, ', '.join(f.choices)))
+                raw = f.choices[value]
+            else:
+                raw = value / f.scale
+                if raw != int(raw):
+                    raise ValueError('{}: {} = {} is not a multiple of {}'.format(self.name, f.name, value, f.scale))
+                raw = int(raw)
+            if not 0 <= raw < 1 << (8 * f.size):
+                raise ValueError('{}: {} = {} out of range'.format(self.name, f.name, value))
+            data += raw.to_bytes(f.size, 'big')
+        return bytes(data)
+
+    def decode(self, data):
+        """ Typed {field: value} from the data bytes of a ReadById response (after the data id)."""
+        if len(data) < self.size:
+            raise ValueError('{}: expected {} data bytes, got {}'.format(self.name, self.size, len(data)))
+        values = {}
+        i = 0
+        for f in self.fields:
+            raw = int.from_bytes(bytes(data[i:i + f.size]), 'big')
+            i += f.size
+            if f.choices is not None:
+                names = [name for name, choice in f.choices.items() if choice == raw]
+                values[f.name] = names[0] if names else raw
+            else:
+                values[f.name] = raw * f.scale
+        return values
+
+    def decode_result(self, result):
+        """ Decode the diag_result of self.read, None when it failed or its length does not fit the fields."""
+        if not result.ok:
+            return None
+        # result.data is already cut to the length given by the response PCI
+        data = result.data
+        if self.echo_id:
+            if not data or data[0] != self.data_id:
+                return None
+            data = data[1:]
+            if len(data) < self.size:
+                return None
+        elif len(data) != self.size:
+            # Standard responses carry exactly the identifier's bytes (PCI = 1 + size)
+            return None
+        return self.decode(data)
+
+    def write(self, values):
+        """ diag_transaction writing values, encoded once per distinct value."""
+        key = tuple(values[f.name] for f in self.fields)
+        transaction = self._writes.get(key)
+        if transaction is None:
+            data = self.encode(values)
+            payload = [self.nad, 2 + len(data), WRITE_BY_ID, self.data_id] + list(data)
+            transaction = diag_transaction('Change ' + self.name, payload + [0xFF] * (8 - len(payload)))
+            self._writes[key] = transaction
+        return transaction
+
+
+class ibs_register_map():
+    """ Diagnostic parameters and schedules of one IBS generation."""
+
+    def __init__(self, generation, database, parameters, table_nad=0x01, lin_diag_schedule=0,
+                 lin_normal_schedule=1, cluster='Cluster'):
+        self.generation = generation
+        self.database = database
+        self.cluster = cluster
+        self.master_req_output_frames = ['MasterReq']
+        self.slave_resp_input_frames = ['SlaveResp']
+        self.master_req_id = 0x3C
+        self.lin_diag_schedule = lin_diag_schedule
+        self.lin_normal_schedule = lin_normal_schedule
+        self.parameters = OrderedDict((p.name, p) for p in parameters)
+        # LIN ReadByIdentifier 1, identifies the sensor for the configuration cache.
+        # Reply is [NAD, 0x05, 0xF2, S0..S3], no echoed identifier
+        self.serial_number = ibs_parameter('Serial Number', 0x01, [field('serial', 4)], echo_id=False)
+        self.table_state = diag_transaction('Check Table State', [0x01, 0x01, TABLE_STATE, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF])
+        self._table_switch = {state: diag_transaction('Switch Table {}'.format('ON' if state else 'OFF'),
+                                                      [table_nad, 0x06, TABLE_SWITCH, state] + TABLE_SWITCH_KEY)
+                              for state in (0, 1)}
+
+    def table_switch(self, on):
+        return self._table_switch[1 if on else 0]
+
+    def sensor_key(self, serial):
+        return '{}:{:08X}'.format(self.generation, serial)
+
+    def field_names(self):
+        return [f.name for p in self.parameters.values() for f in p.fields]
+
+    def parameter_values(self, **given):
+        """ [(parameter, values)] for the parameters with at least one given, non None field."""
+        unknown = [name for name, value in given.items() if value is not None and name not in self.field_names()]
+        if unknown:
+            raise ValueError('{} has no parameter {}'.format(self.generation, ', '.join(unknown)))
+        selected = []
+        for p in self.parameters.values():
+            if any(given.get(f.name) is not None for f in p.fields):
+                selected.append((p, p.values(given)))
+        return selected
+
+
+def decode_table_state(result):
+    """ 1 when the switch table is on, 0 when off, None when the request failed."""
+    return result.data[0] if result.ok and result.data else None
+
+
+REGISTER_MAPS = {
+    'IBS200_GEN1': ibs_register_map('IBS200_GEN1', 'hella_gen1_ibs', [
+        ibs_parameter('C_NOMINAL', 0x39, [field('c_nominal')]),
+        ibs_parameter('Batt Type', 0x3A, [field('batt_type')]),
+        ibs_parameter('U0 MIN/MAX', 0x30, [field('u0_min', 2), field('u0_max', 2)], nad=0x82),
+        ibs_parameter('Batt IQ', 0x3C, [field('iqbatt'), field('ichargemin', default=50)], nad=0x82),
+        ], table_nad=0x82, lin_normal_schedule=0),
+    'IBS_GLOBAL_GEN2': ibs_register_map('IBS_GLOBAL_GEN2', 'hella_gen2_ibs', [
+        ibs_parameter('C_NOMINAL', 0x39, [field('c_nominal', scale=2)]),
+        ibs_parameter('Batt Type', 0x3A, [field('batt_type')]),
+        ibs_parameter('U0 MIN/MAX', 0x30, [field('u0_min', 2), field('u0_max', 2)]),
+        ibs_parameter('Batt Tech', 0x32, [field('batt_tech', choices={'AGM': 0x01})]),
+        ]),
+    }
+
+
+def register_map(generation):
+    if generation not in REGISTER_MAPS:
+        raise ValueError('Unknown IBS generation {} (expected one of {})'.format(generation, ', '.join(REGISTER_MAPS)))
+    return REGISTER_MAPS[generation]
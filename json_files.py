@@ -0,0 +1,37 @@
+import json
+import os
+
+
+def file_signature(filename):
+    """ Size and modification time of filename, results cached for it are stale once this changes."""
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_json(filename):
+    """ Contents of a JSON file, empty if it does not exist yet."""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_json(data, filename):
+    """ Save data as JSON, replacing filename only once the whole file is written.
+
+    The data goes to <filename>.tmp and is renamed over filename, so an
+    interrupted save keeps the previous file. The .tmp is removed when the
+    save fails, and the error is raised.
+    """
+    tmp = filename + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        raise
@@ -0,0 +1,147 @@
+import time
+
+# XNET driver is only needed for bench runs, the simulated IBS works without it
+try:
+    from nixnet import constants
+    from nixnet import types
+except ImportError:
+    types = None
+
+MASTER_REQ_ID = 0x3C
+NEGATIVE_RESPONSE = 0x7F
+BROADCAST_NAD = 0x7F
+WAKE_UP_TIME = 0.1 # s, bus wake-up after the first frame
+
+
+class diag_transaction():
+    """ One MasterReq request and whether a SlaveResp has to answer it.
+
+    A response matches when it comes from the request NAD (any NAD for a
+    broadcast) and carries the positive RSID (SID + 0x40) or a negative
+    response to the request SID.
+    """
+
+    def __init__(self, name, request, expect_response=True):
+        self.name = name
+        self.request = bytes(bytearray(request))
+        if len(self.request) != 8:
+            raise ValueError('{}: MasterReq payload must be 8 bytes, got {}'.format(name, len(self.request)))
+        self.expect_response = expect_response
+        self.nad = self.request[0]
+        self.sid = self.request[2]
+
+    def matches(self, response):
+        if self.nad != BROADCAST_NAD and response[0] != self.nad:
+            return False
+        if response[2] == NEGATIVE_RESPONSE:
+            return response[3] == self.sid
+        return response[2] == (self.sid + 0x40) & 0xFF
+
+
+class diag_result():
+    """ Outcome of a transaction: the SlaveResp, its data bytes and how long the bus took."""
+
+    def __init__(self, transaction, response, attempts, elapsed):
+        self.name = transaction.name
+        self.request = transaction.request
+        self.response = response
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.data = b''
+        self.negative_code = None
+        if response is None:
+            self.ok = not transaction.expect_response
+        elif response[2] == NEGATIVE_RESPONSE:
+            self.ok = False
+            self.negative_code = response[4]
+        else:
+            self.ok = True
+            # PCI low nibble counts RSID + data bytes of a single frame
+            self.data = response[3:3 + max((response[1] & 0x0F) - 1, 0)]
+
+    def status(self):
+        if self.ok:
+            return 'ok'
+        if self.negative_code is not None:
+            return 'negative response 0x{:02X}'.format(self.negative_code)
+        return 'no response'
+
+    def __str__(self):
+        response = ' '.join('{:02X}'.format(b) for b in self.response) if self.response is not None else '-'
+        return '{}: {} after {} attempt(s) in {:.0f} ms, SlaveResp [{}]'.format(
+            self.name, self.status(), self.attempts, self.elapsed * 1000, response)
+
+
+class lin_diag_engine():
+    """ Send MasterReq transactions and wait for their SlaveResp.
+
+    input_session is a queued SlaveResp input session so no response is lost
+    between polls. Each transaction waits only until a matching response shows
+    up, polling every poll_time, and is repeated when none arrives before timeout.
+    """
+
+    def __init__(self, input_session, output_session, master_req_id=MASTER_REQ_ID,
+                 timeout=0.3, retries=2, poll_time=0.005, clock=time, verbose=True):
+        self.input_session = input_session
+        self.output_session = output_session
+        self.master_req_id = master_req_id
+        self.timeout = timeout
+        self.retries = retries
+        self.poll_time = poll_time
+        self.clock = clock
+        self.verbose = verbose
+
+    def send(self, payload):
+        if types is None:
+            frame = (self.master_req_id, payload)
+        else:
+            frame = types.LinFrame(self.master_req_id, type=constants.FrameType.LIN_DATA, payload=bytearray(payload))
+        self.output_session.frames.write([frame])
+
+    def responses(self):
+        """ SlaveResp payloads received since the last call."""
+        if types is None:
+            frames = self.input_session.frames.read(16, 0)
+        else:
+            frames = self.input_session.frames.read(16, 0, frame_type=types.LinFrame)
+        return [bytes(bytearray(frame.payload)) for frame in frames]
+
+    def wake_up(self):
+        """ Wake the bus with an empty MasterReq."""
+        self.send(bytes(8))
+        self.clock.sleep(WAKE_UP_TIME)
+        self.responses()
+
+    def transact(self, transaction):
+        start = self.clock.monotonic()
+        attempt = 0
+        while attempt <= self.retries:
+            attempt += 1
+            # Drop stale responses so only an answer to this request can match
+            self.responses()
+            self.send(transaction.request)
+            if not transaction.expect_response:
+                return diag_result(transaction, None, attempt, self.clock.monotonic() - start)
+            deadline = self.clock.monotonic() + self.timeout
+            while True:
+                for response in self.responses():
+                    if transaction.matches(response):
+                        return diag_result(transaction, response, attempt, self.clock.monotonic() - start)
+                if self.clock.monotonic() >= deadline:
+                    break
+                self.clock.sleep(self.poll_time)
+            if self.verbose and attempt <= self.retries:
+                print('{}: no response, retrying...'.format(transaction.name))
+        return diag_result(transaction, None, attempt, self.clock.monotonic() - start)
+
+    def run(self, transactions, stop_on_error=True):
+        """ Run a list of transactions in order, returns their diag_results."""
+        results = []
+        for transaction in transactions:
+            result = self.transact(transaction)
+            results.append(result)
+            if self.verbose:
+                print(result)
+            if stop_on_error and not result.ok:
+                break
+        return results
@@ -0,0 +1,173 @@
+import numpy as np
+
+try:
+    from nixnet import constants
+    from nixnet import database as xnet_database
+except ImportError:
+    xnet_database = None
+
+# XNET raw frame layout for payloads up to 8 bytes (all LIN frames), 24 bytes per frame
+RAW_FRAME_DTYPE = np.dtype([('timestamp', '<u8'), ('identifier', '<u4'), ('type', 'u1'),
+                            ('flags', 'u1'), ('info', 'u1'), ('payload_length', 'u1'), ('payload', 'u1', 8)])
+TIMESTAMP_TICK = 100e-9 # XNET timestamps count 100ns ticks
+LIN_DATA_FRAME_TYPE = 0x10
+
+# Local signal description of the IBS databases:
+#   {database: {frame name: (frame id, [(signal, start bit, length, byte order, scale, offset, signed)])}}
+# 'little' start bits count from bit 0 of payload byte 0 (LIN convention), 'big' start bits
+# count from the most significant bit of payload byte 0. Only used by --sim runs, hardware
+# runs decode from the XNET database. Check it with check_against_database() whenever
+# the XNET database is updated.
+SIGNAL_DESCRIPTIONS = {
+    'hella_gen1_ibs': {
+        'IBS_FRM2': (0x28, [('BatteryCurrent', 0, 24, 'little', 0.001, -2000.0, False),
+                            ('BatteryVoltage', 24, 16, 'little', 0.001, 0.0, False),
+                            ('BatteryTemperature', 40, 8, 'little', 0.5, -40.0, False)]),
+        'IBS_FRM5': (0x2B, [('StateOfCharge', 0, 8, 'little', 0.5, 0.0, False),
+                            ('StateOfHealth', 8, 8, 'little', 0.5, 0.0, False)]),
+        'IBS_FRM6': (0x2C, [('NominalCapacity', 0, 8, 'little', 1.0, 0.0, False),
+                            ('Recalibrated', 8, 1, 'little', 1.0, 0.0, False)]),
+        },
+    'hella_gen2_ibs': {
+        'IBS_UIT': (0x25, [('BatteryCurrent', 0, 24, 'little', 0.001, -2000.0, False),
+                           ('BatteryVoltage', 24, 16, 'little', 0.001, 0.0, False),
+                           ('BatteryTemperature', 40, 8, 'little', 0.5, -40.0, False)]),
+        'IBS_BZE1': (0x26, [('StateOfCharge', 0, 8, 'little', 0.5, 0.0, False),
+                            ('StateOfHealth', 8, 8, 'little', 0.5, 0.0, False)]),
+        'IBS_BZE2': (0x27, [('NominalCapacity', 0, 8, 'little', 1.0, 0.0, False),
+                            ('Recalibrated', 8, 1, 'little', 1.0, 0.0, False)]),
+        },
+    }
+
+
+def description_from_database(database, cluster):
+    """ Build a signal description like SIGNAL_DESCRIPTIONS entries from the XNET database."""
+    if xnet_database is None:
+        raise RuntimeError('nixnet is required to read the XNET database')
+    description = {}
+    with xnet_database.Database(database) as db:
+        for frame in db.clusters[cluster].frames:
+            signals = []
+            for sig in frame.mux_static_signals:
+                big = sig.byte_ordr == constants.SigByteOrdr.BIG_ENDIAN
+                signals.append((sig.name, sig.start_bit, sig.num_bits, 'big' if big else 'little',
+                                sig.scale_fac, sig.scale_off, sig.data_type == constants.SigDataType.SIGNED))
+            description[frame.name] = (frame.identifier, signals)
+    return description
+
+
+def check_against_database(database, cluster='Cluster'):
+    """ List the differences between the local description and the XNET database."""
+    local = SIGNAL_DESCRIPTIONS[database]
+    xnet = description_from_database(database, cluster)
+    differences = []
+    for frame_name, (frame_id, signals) in local.items():
+        if frame_name not in xnet:
+            differences.append('{}: missing from XNET database'.format(frame_name))
+            continue
+        xnet_id, xnet_signals = xnet[frame_name]
+        if xnet_id != frame_id:
+            differences.append('{}: id 0x{:02X} != 0x{:02X}'.format(frame_name, frame_id, xnet_id))
+        xnet_by_name = {sig[0]: sig for sig in xnet_signals}
+        for sig in signals:
+            if sig[0] in xnet_by_name and tuple(xnet_by_name[sig[0]]) != tuple(sig):
+                differences.append('{}.{}: {} != {}'.format(frame_name, sig[0], sig[1:], xnet_by_name[sig[0]][1:]))
+    return differences
+
+
+class lin_signal_decoder():
+    """ Decode batches of LIN payloads into signal arrays.
+
+    The description is compiled once into per-frame shift, mask, scale and
+    offset arrays, so N payloads of a frame decode into all its signals with a
+    few vectorized NumPy operations. Only the signals in signal_names are kept,
+    in that column order.
+    """
+
+    def __init__(self, description, signal_names):
+        self.signal_names = list(signal_names)
+        self.frame_ids = {}
+        self.frames = {}
+        self.layouts = {}
+        for frame_name, (frame_id, signals) in description.items():
+            self.frame_ids[frame_name] = frame_id
+            self.layouts[frame_id] = signals
+            wanted = [sig for sig in signals if sig[0] in self.signal_names]
+            if not wanted:
+                continue
+            columns = np.array([self.signal_names.index(sig[0]) for sig in wanted])
+            shifts = np.array([start if order == 'little' else 64 - start - length
+                               for _, start, length, order, _, _, _ in wanted], dtype=np.uint64)
+            masks = np.array([(1 << sig[2]) - 1 for sig in wanted], dtype=np.uint64)
+            big = np.array([sig[3] == 'big' for sig in wanted])
+            sign_bits = np.array([1 << (sig[2] - 1) if sig[6] else 0 for sig in wanted], dtype=np.int64)
+            spans = np.array([1 << sig[2] for sig in wanted], dtype=np.int64)
+            scales = np.array([sig[4] for sig in wanted])
+            offsets = np.array([sig[5] for sig in wanted])
+            self.frames[frame_id] = (columns, shifts, masks, big, sign_bits, spans, scales, offsets)
+        missing = [name for name in self.signal_names
+                   if not any(name in [sig[0] for sig in signals] for _, signals in description.values())]
+        if missing:
+            raise ValueError('Signals not described: {}'.format(', '.join(missing)))
+
+    def decode(self, identifiers, payloads):
+        """ Decode N payloads (N x 8 bytes) with their frame ids.
+
+        Returns an N x len(signal_names) float array, NaN where a frame does not carry a signal.
+        """
+        identifiers = np.asarray(identifiers)
+        if not isinstance(payloads, np.ndarray):
+            # Sequence of payload bytes, e.g. LinFrame.payload from a single-point read
+            payloads = np.frombuffer(b''.join(bytes(p).ljust(8, b'\0') for p in payloads), dtype=np.uint8)
+        payloads = np.ascontiguousarray(payloads, dtype=np.uint8).reshape(-1, 8)
+        values = np.full((len(payloads), len(self.signal_names)), np.nan)
+        if len(payloads) == 0:
+            return values
+        words_le = payloads.view('<u8')[:, 0]
+        words_be = payloads.view('>u8')[:, 0].astype(np.uint64)
+        for frame_id, (columns, shifts, masks, big, sign_bits, spans, scales, offsets) in self.frames.items():
+            rows = np.flatnonzero(identifiers == frame_id)
+            if len(rows) == 0:
+                continue
+            words = np.where(big[None, :], words_be[rows, None], words_le[rows, None])
+            raw = ((words >> shifts) & masks).astype(np.int64)
+            raw = np.where((sign_bits > 0) & (raw >= sign_bits), raw - spans, raw)
+            values[rows[:, None], columns[None, :]] = raw * scales + offsets
+        return values
+
+    def decode_frames(self, frames):
+        """ Decode raw XNET frames (RAW_FRAME_DTYPE), returns (timestamps [s], values)."""
+        return frames['timestamp'] * TIMESTAMP_TICK, self.decode(frames['identifier'], frames['payload'])
+
+    def encode(self, frame_name, values):
+        """ Build the payload of frame_name from a {signal: physical value} dict, for simulation and tests."""
+        frame_id = self.frame_ids[frame_name]
+        word_le = 0
+        word_be = 0
+        for name, start, length, order, scale, offset, signed in self.layouts[frame_id]:
+            raw = int(round((values.get(name, offset) - offset) / scale))
+            raw = max(min(raw, (1 << (length - 1 if signed else length)) - 1), -(1 << (length - 1)) if signed else 0)
+            raw &= (1 << length) - 1
+            if order == 'little':
+                word_le |= raw << start
+            else:
+                word_be |= raw << (64 - start - length)
+        payload = bytearray(word_le.to_bytes(8, 'little'))
+        for i, b in enumerate(word_be.to_bytes(8, 'big')):
+            payload[i] |= b
+        return frame_id, bytes(payload)
+
+
+def compile_decoder(database, signal_names, cluster='Cluster', sim=False):
+    """ Decoder for an IBS database.
+
+    Hardware runs decode from the XNET database, the local description is
+    only used for simulated runs (or when nixnet is not installed).
+    """
+    if not sim and xnet_database is not None:
+        description = description_from_database(database, cluster)
+    elif database in SIGNAL_DESCRIPTIONS:
+        description = SIGNAL_DESCRIPTIONS[database]
+    else:
+        raise ValueError('No local signal description for {}, nixnet is needed to read it'.format(database))
+    return lin_signal_decoder(description, signal_names)
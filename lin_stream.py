@@ -0,0 +1,87 @@
+from collections import deque
+import numpy as np
+
+from lin_signals import RAW_FRAME_DTYPE
+
+
+class frame_ring_buffer():
+    """ Preallocated ring of raw frames, written in bulk by the capture.
+
+    sequence counts every frame ever written so readers can ask for what
+    arrived since their last read and tell when the ring overran them.
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.frames = np.zeros(capacity, dtype=RAW_FRAME_DTYPE)
+        self.sequence = 0
+
+    def extend(self, frames):
+        n = len(frames)
+        if n == 0:
+            return
+        if n > self.capacity:
+            frames = frames[-self.capacity:]
+        start = (self.sequence + n - len(frames)) % self.capacity
+        first = min(len(frames), self.capacity - start)
+        self.frames[start:start + first] = frames[:first]
+        self.frames[:len(frames) - first] = frames[first:]
+        self.sequence += n
+
+    def since(self, sequence):
+        """ Copy of the frames written after sequence, and how many were lost to overrun."""
+        lost = max(self.sequence - sequence - self.capacity, 0)
+        n = self.sequence - sequence - lost
+        idx = (np.arange(self.sequence - n, self.sequence)) % self.capacity
+        return self.frames[idx], lost
+
+    def latest(self, n):
+        n = min(n, self.sequence, self.capacity)
+        return self.since(self.sequence - n)[0]
+
+
+class lin_stream_capture():
+    """ Drain every frame received by a stream input session in bulk each tick.
+
+    Frames go into a ring buffer with their hardware timestamp and are decoded
+    in batches by a lin_signals.lin_signal_decoder. read_signals returns the latest value of each signal as
+    (timestamp, value) pairs, like the XNET signal converter, and queues every
+    decoded batch (frame ids, timestamps, values) in batches for trace logging.
+    """
+
+    def __init__(self, session, decoder, ring=None, max_frames=4096):
+        self.session = session
+        self.decoder = decoder
+        self.signal_names = decoder.signal_names
+        self.ring = ring if ring is not None else frame_ring_buffer()
+        self.max_bytes = max_frames * RAW_FRAME_DTYPE.itemsize
+        self.latest_times = np.zeros(len(self.signal_names))
+        self.latest_values = np.full(len(self.signal_names), np.nan)
+        self.batches = deque()
+        self.frames_read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def drain(self):
+        """ Read every pending frame without blocking."""
+        raw = self.session.frames.read_bytes(self.max_bytes, 0)
+        frames = np.frombuffer(raw, dtype=RAW_FRAME_DTYPE, count=len(raw) // RAW_FRAME_DTYPE.itemsize)
+        self.ring.extend(frames)
+        self.frames_read += len(frames)
+        return frames
+
+    def read_signals(self):
+        frames = self.drain()
+        times, values = self.decoder.decode_frames(frames)
+        if len(frames):
+            self.batches.append((frames['identifier'], times, values))
+        for i in range(len(self.signal_names)):
+            seen = np.flatnonzero(~np.isnan(values[:, i]))
+            if len(seen):
+                self.latest_times[i] = times[seen[-1]]
+                self.latest_values[i] = values[seen[-1], i]
+        return list(zip(self.latest_times, self.latest_values))
@@ -0,0 +1,165 @@
+import argparse
+import glob
+import os
+import numpy as np
+
+import data_logger
+from display_data import maximize_window
+
+# Panels like display_data.plot: (title, channels)
+PANELS = [('Voltage [V]', ['batt_voltage']), ('Current [A]', ['batt_current']), ('SOC [%]', ['batt_soc', 'soc_ref'])]
+
+
+class minmax_envelope():
+    """ Min/max envelope of every channel in at most max_buckets time buckets.
+
+    Samples are folded into buckets of bucket_size samples. When all buckets
+    are used, neighbours are merged two by two and bucket_size doubles, so
+    memory and drawing cost stay bounded however long the test runs while
+    every spike still shows up in its bucket's min or max.
+    """
+
+    def __init__(self, channels, max_buckets=2048):
+        if max_buckets % 2:
+            raise ValueError('max_buckets must be even')
+        self.channels = list(channels)
+        self.max_buckets = max_buckets
+        self.bucket_size = 1
+        self.buckets = 0
+        self.samples = 0
+        self.time = np.zeros(max_buckets)
+        self.low = np.zeros((len(self.channels), max_buckets))
+        self.high = np.zeros((len(self.channels), max_buckets))
+        self._filled = 0 # samples already folded into the last, partial bucket
+
+    def _merge(self):
+        """ Halve the number of buckets, each new bucket covers two old full ones."""
+        n = self.buckets
+        self.time[:n // 2] = self.time[:n:2]
+        self.low[:, :n // 2] = np.minimum(self.low[:, :n:2], self.low[:, 1:n:2])
+        self.high[:, :n // 2] = np.maximum(self.high[:, :n:2], self.high[:, 1:n:2])
+        self.buckets = n // 2
+        self.bucket_size *= 2
+
+    def add(self, times, values):
+        """ Fold new samples in, values is [channels x n]."""
+        n = len(times)
+        pos = 0
+        while pos < n:
+            if self._filled:
+                # Complete the partial last bucket
+                take = min(n - pos, self.bucket_size - self._filled)
+                i = self.buckets - 1
+                self.low[:, i] = np.minimum(self.low[:, i], values[:, pos:pos + take].min(axis=1))
+                self.high[:, i] = np.maximum(self.high[:, i], values[:, pos:pos + take].max(axis=1))
+                self._filled = (self._filled + take) % self.bucket_size
+                pos += take
+                continue
+            if self.buckets == self.max_buckets:
+                # Only reached with every bucket full
+                self._merge()
+                continue
+            # Whole buckets at once, the remainder opens a partial bucket
+            free = self.max_buckets - self.buckets
+            count = min((n - pos) // self.bucket_size, free)
+            if count:
+                end = pos + count * self.bucket_size
+                chunk = values[:, pos:end].reshape(len(self.channels), count, self.bucket_size)
+                i = self.buckets
+                self.time[i:i + count] = times[pos:end:self.bucket_size]
+                self.low[:, i:i + count] = chunk.min(axis=2)
+                self.high[:, i:i + count] = chunk.max(axis=2)
+                self.buckets += count
+                pos = end
+            elif pos < n:
+                take = n - pos
+                i = self.buckets
+                self.time[i] = times[pos]
+                self.low[:, i] = values[:, pos:].min(axis=1)
+                self.high[:, i] = values[:, pos:].max(axis=1)
+                self.buckets += 1
+                self._filled = take
+                pos = n
+        self.samples += n
+
+    def channel(self, name):
+        """ (bucket start times, min, max) of one channel."""
+        i = self.channels.index(name)
+        n = self.buckets
+        return self.time[:n], self.low[i, :n], self.high[i, :n]
+
+
+def latest_log(pattern):
+    """ Most recently modified binary log matching pattern."""
+    logs = glob.glob(pattern)
+    if not logs:
+        return None
+    return max(logs, key=os.path.getmtime)
+
+
+class live_viewer():
+    """ Follow a running test's binary log and redraw its envelope panels."""
+
+    def __init__(self, filename, max_buckets=2048):
+        self.follower = data_logger.log_follower(filename)
+        self.max_buckets = max_buckets
+        self.envelope = None
+
+    def update(self):
+        """ Fold newly written samples into the envelope, True when something changed."""
+        new = self.follower.poll()
+        if new is None:
+            return False
+        if self.envelope is None:
+            self.envelope = minmax_envelope(self.follower.channels, self.max_buckets)
+        times, values = new
+        self.envelope.add(times, values)
+        return True
+
+    def show(self, interval=1.0):
+        import matplotlib.pyplot as plt
+
+        fig, axs = plt.subplots(len(PANELS), 1, sharex=True)
+        fig.canvas.manager.set_window_title(os.path.basename(self.follower.filename))
+        lines = {}
+        maximize_window()
+        plt.ion()
+        plt.show()
+        while plt.fignum_exists(fig.number):
+            if self.update():
+                envelope = self.envelope
+                for ax, (title, channels) in zip(axs, PANELS):
+                    for name in channels:
+                        if name not in envelope.channels:
+                            continue
+                        t, low, high = envelope.channel(name)
+                        if name not in lines:
+                            lines[name] = (ax.plot(t, low, label=name)[0],)
+                            lines[name] += (ax.plot(t, high, color=lines[name][0].get_color())[0],)
+                            ax.set_ylabel(title)
+                        lines[name][0].set_data(t, low)
+                        lines[name][1].set_data(t, high)
+                    ax.relim()
+                    ax.autoscale_view()
+                axs[0].set_title('{} samples, {} per point'.format(envelope.samples, envelope.bucket_size))
+            plt.pause(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Live view of a running SOC gauge test')
+    parser.add_argument('log_file', help='Binary log [{}] of the running test, or a glob pattern to follow the newest one'.format(data_logger.LOG_EXTENSION), type=str)
+    parser.add_argument('--interval', help='Redraw period in seconds (default 1)', type=float, default=1.0)
+    parser.add_argument('--points', help='Envelope points per channel (default 2048)', type=int, default=2048)
+    args = parser.parse_args()
+
+    filename = args.log_file
+    if not os.path.exists(filename):
+        filename = latest_log(args.log_file)
+        if filename is None:
+            parser.error('No log matches {}'.format(args.log_file))
+    print('Following {}'.format(filename))
+    live_viewer(filename, max_buckets=args.points).show(args.interval)
+
+
+if __name__ == '__main__':
+    main()
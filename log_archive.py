@@ -0,0 +1,255 @@
+import argparse
+import io
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+import data_logger
+
+# File layout:
+#   MAGIC, then one compressed record per column per block,
+#   then the index: uint32 JSON length, JSON {'channels', 'dtypes', 'block_size', 'metadata'},
+#   an .npz of per-block arrays (offsets, sizes, counts, mins, maxs, means),
+#   and FOOTER (index offset, index length) + MAGIC at the very end.
+# Columns are byte-shuffled before zlib so the slowly varying high bytes of
+# consecutive samples compress together.
+MAGIC = b'BATTARC1'
+FOOTER = struct.Struct('<QQ')
+ARCHIVE_EXTENSION = '.barc'
+
+
+def _pack(values):
+    values = np.ascontiguousarray(values)
+    shuffled = values.view(np.uint8).reshape(len(values), values.itemsize).T
+    return zlib.compress(shuffled.tobytes(), 6)
+
+
+def _unpack(payload, dtype, count):
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(dtype.itemsize, count)
+    return np.ascontiguousarray(shuffled.T).view(dtype).ravel()
+
+
+def convert(log_filename, archive_filename, block_size=8192):
+    """ Convert a soc_gauge_test log (.csv or binary) to an archive, returns the sample count.
+
+    The log is read in block_size chunks, so memory stays bounded. Channels
+    keep the float32 of binary logs, CSV values are stored as float64.
+    """
+    metadata = data_logger.read_metadata(log_filename)
+    channel_dtype = np.float32 if log_filename.endswith(data_logger.LOG_EXTENSION) else np.float64
+    offsets, sizes, counts, mins, maxs, means = [], [], [], [], [], []
+    columns = None
+    tmp_filename = archive_filename + '.tmp'
+    try:
+        with open(tmp_filename, 'wb') as f:
+            f.write(MAGIC)
+            for chunk in data_logger.iter_log_chunks(log_filename, block_size):
+                if columns is None:
+                    columns = list(chunk.dtype.names)
+                    dtypes = [np.float64] + [channel_dtype] * (len(columns) - 1)
+                if len(chunk) == 0:
+                    continue
+                block_offsets, block_sizes = [], []
+                for name, dtype in zip(columns, dtypes):
+                    payload = _pack(chunk[name].astype(dtype))
+                    block_offsets.append(f.tell())
+                    block_sizes.append(len(payload))
+                    f.write(payload)
+                offsets.append(block_offsets)
+                sizes.append(block_sizes)
+                counts.append(len(chunk))
+                # Summaries on the stored values so queries agree with read()
+                stored = [chunk[name].astype(dtype) for name, dtype in zip(columns, dtypes)]
+                mins.append([values.min() for values in stored])
+                maxs.append([values.max() for values in stored])
+                means.append([values.mean(dtype=np.float64) for values in stored])
+            if columns is None:
+                raise ValueError('{} holds no samples'.format(log_filename))
+
+            index_offset = f.tell()
+            header = json.dumps({'channels': columns[1:], 'dtypes': [np.dtype(d).str for d in dtypes],
+                                 'block_size': block_size, 'metadata': metadata}).encode('utf-8')
+            arrays = io.BytesIO()
+            ncols = len(columns)
+            np.savez(arrays, offsets=np.array(offsets, dtype=np.uint64).reshape(-1, ncols),
+                     sizes=np.array(sizes, dtype=np.uint64).reshape(-1, ncols),
+                     counts=np.array(counts, dtype=np.int64),
+                     mins=np.array(mins).reshape(-1, ncols), maxs=np.array(maxs).reshape(-1, ncols),
+                     means=np.array(means).reshape(-1, ncols))
+            f.write(struct.pack('<I', len(header)) + header + arrays.getvalue())
+            f.write(FOOTER.pack(index_offset, f.tell() - index_offset) + MAGIC)
+        # Write then rename so readers never see a half written archive
+        os.replace(tmp_filename, archive_filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    return int(np.sum(counts))
+
+
+class log_archive():
+    """ Read a log archive one block at a time.
+
+    The index holds, per block of samples, where each compressed column is and
+    the first/last time and min/max/mean of every column. Time-range reads
+    and threshold searches use it to decompress only the blocks involved.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        raw = np.memmap(filename, dtype=np.uint8, mode='r')
+        tail = len(MAGIC) + FOOTER.size
+        if len(raw) < len(MAGIC) + tail or bytes(raw[:len(MAGIC)]) != MAGIC or bytes(raw[-len(MAGIC):]) != MAGIC:
+            raise ValueError('{} is not a log archive'.format(filename))
+        index_offset, index_len = FOOTER.unpack_from(raw, len(raw) - tail)
+        header_len, = struct.unpack_from('<I', raw, index_offset)
+        start = index_offset + 4
+        header = json.loads(bytes(raw[start:start + header_len]).decode('utf-8'))
+        index = np.load(io.BytesIO(bytes(raw[start + header_len:index_offset + index_len])))
+        self._raw = raw
+        self.channels = header['channels']
+        self.columns = ['time'] + self.channels
+        self.dtypes = [np.dtype(d) for d in header['dtypes']]
+        self.block_size = header['block_size']
+        self.metadata = header['metadata']
+        self.offsets = index['offsets']
+        self.sizes = index['sizes']
+        self.counts = index['counts']
+        self.mins = index['mins']
+        self.maxs = index['maxs']
+        self.means = index['means']
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        self.samples = int(self.counts.sum())
+        self.t_first = self.mins[:, 0]
+        self.t_last = self.maxs[:, 0]
+
+    def blocks(self, t0=None, t1=None):
+        """ Indices of the blocks holding samples with t0 <= time <= t1."""
+        first = 0 if t0 is None else int(np.searchsorted(self.t_last, t0, 'left'))
+        last = len(self.counts) if t1 is None else int(np.searchsorted(self.t_first, t1, 'right'))
+        return range(first, max(first, last))
+
+    def column(self, block, name):
+        """ Decompressed values of one column of one block."""
+        i = self.columns.index(name)
+        offset, size = int(self.offsets[block, i]), int(self.sizes[block, i])
+        return _unpack(bytes(self._raw[offset:offset + size]), self.dtypes[i], int(self.counts[block]))
+
+    def _block(self, block, names, t0, t1):
+        time = self.column(block, 'time')
+        data = np.empty(len(time), dtype=[(name, np.float64) for name in names])
+        for name in names:
+            data[name] = time if name == 'time' else self.column(block, name)
+        if (t0 is not None and time[0] < t0) or (t1 is not None and time[-1] > t1):
+            keep = np.ones(len(time), dtype=bool)
+            if t0 is not None:
+                keep &= time >= t0
+            if t1 is not None:
+                keep &= time <= t1
+            data = data[keep]
+        return data
+
+    def iter_chunks(self, chunk_size=65536, channels=None, t0=None, t1=None):
+        """ Yield the samples in [t0, t1] as float64 structured arrays of at most chunk_size samples."""
+        names = ['time'] + list(self.channels if channels is None else channels)
+        for block in self.blocks(t0, t1):
+            data = self._block(block, names, t0, t1)
+            for start in range(0, len(data), chunk_size):
+                yield data[start:start + chunk_size]
+
+    def read(self, channels=None, t0=None, t1=None):
+        """ Samples with t0 <= time <= t1 as one float64 structured array, like display_data.load_log."""
+        names = ['time'] + list(self.channels if channels is None else channels)
+        blocks = [self._block(block, names, t0, t1) for block in self.blocks(t0, t1)]
+        if not blocks:
+            return np.empty(0, dtype=[(name, np.float64) for name in names])
+        return np.concatenate(blocks)
+
+    def first_time(self, channel, threshold):
+        """ (sample index, time) of the first sample where channel >= threshold, None if never.
+
+        Blocks whose maximum stays below threshold are skipped without reading them.
+        """
+        i = self.columns.index(channel)
+        candidates = np.flatnonzero(self.maxs[:, i] >= threshold)
+        if len(candidates) == 0:
+            return None
+        block = int(candidates[0])
+        j = int(np.argmax(self.column(block, channel) >= threshold))
+        return int(self.starts[block]) + j, float(self.column(block, 'time')[j])
+
+    def summary(self, channel, t0=None, t1=None):
+        """ (count, min, max, mean) of channel over [t0, t1].
+
+        Blocks fully inside the range are answered from the index, only the
+        partial blocks at the edges are decompressed.
+        """
+        i = self.columns.index(channel)
+        count, low, high, total = 0, np.inf, -np.inf, 0.0
+        for block in self.blocks(t0, t1):
+            inside = (t0 is None or self.t_first[block] >= t0) and (t1 is None or self.t_last[block] <= t1)
+            if inside:
+                n = int(self.counts[block])
+                count += n
+                low = min(low, self.mins[block, i])
+                high = max(high, self.maxs[block, i])
+                total += self.means[block, i] * n
+                continue
+            values = self._block(block, ['time', channel], t0, t1)[channel]
+            if len(values):
+                count += len(values)
+                low = min(low, values.min())
+                high = max(high, values.max())
+                total += values.sum()
+        if count == 0:
+            return 0, np.nan, np.nan, np.nan
+        return count, float(low), float(high), total / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert SOC gauge test logs to indexed archives and query them')
+    actions = parser.add_subparsers(dest='action')
+    actions.required = True
+    parser_convert = actions.add_parser('convert', help='Convert a .csv or {} log'.format(data_logger.LOG_EXTENSION))
+    parser_convert.add_argument('log_file', type=str)
+    parser_convert.add_argument('archive_file', help='Output archive (default: same name, {})'.format(ARCHIVE_EXTENSION), type=str, nargs='?', default=None)
+    parser_convert.add_argument('--block-size', help='Samples per block (default 8192)', type=int, default=8192)
+    parser_query = actions.add_parser('query', help='Summary of channels over a time range')
+    parser_query.add_argument('archive_file', type=str)
+    parser_query.add_argument('channels', help='Channel names (default: all)', type=str, nargs='*')
+    parser_query.add_argument('--start', help='Range start time [s]', type=float, default=None)
+    parser_query.add_argument('--end', help='Range end time [s]', type=float, default=None)
+    parser_first = actions.add_parser('first', help='First time a channel reaches a value')
+    parser_first.add_argument('archive_file', type=str)
+    parser_first.add_argument('channel', type=str)
+    parser_first.add_argument('value', type=float)
+    args = parser.parse_args()
+
+    if args.action == 'convert':
+        archive_file = args.archive_file
+        if archive_file is None:
+            archive_file = os.path.splitext(args.log_file)[0] + ARCHIVE_EXTENSION
+        samples = convert(args.log_file, archive_file, args.block_size)
+        print('Archived {} samples to {} ({:.1f} kB)'.format(samples, archive_file, os.path.getsize(archive_file) / 1e3))
+        return
+
+    archive = log_archive(args.archive_file)
+    if args.action == 'query':
+        blocks = archive.blocks(args.start, args.end)
+        print('{} of {} blocks in range'.format(len(blocks), len(archive.counts)))
+        for name in args.channels or archive.channels:
+            count, low, high, mean = archive.summary(name, args.start, args.end)
+            print('{}: {} samples min = {:.6g} max = {:.6g} mean = {:.6g}'.format(name, count, low, high, mean))
+    else:
+        found = archive.first_time(args.channel, args.value)
+        if found is None:
+            print('{} never reaches {}'.format(args.channel, args.value))
+        else:
+            print('{} >= {} first at sample {}, t = {:.3f}s'.format(args.channel, args.value, found[0], found[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class periodic_task():
+    """ Handle on a task registered with a periodic_scheduler."""
+
+    def __init__(self, scheduler, period, target, args, name):
+        self.scheduler = scheduler
+        self.period = period
+        self.target = target
+        self.args = args
+        self.name = name
+        self.runs = 0
+        self.overruns = 0
+        self.cancelled = False
+
+    def cancel(self):
+        """ Stop the task, it will not be started again once this returns."""
+        self.scheduler.cancel(self)
+
+
+class periodic_scheduler():
+    """ Run many periodic tasks on one persistent worker thread.
+
+    Deadlines live in a heap ordered by monotonic time, so the worker only
+    wakes when the earliest task is due. Deadlines are absolute; a task that
+    runs past its next deadline skips the missed runs and counts them in its
+    overruns instead of piling up.
+    """
+
+    def __init__(self, name='periodic_scheduler'):
+        self.name = name
+        self.tasks = []
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def add_task(self, period, target, args=(), name=None, delay=None):
+        """ Call target(*args) every period seconds, first after delay (default: one period)."""
+        if period <= 0:
+            raise ValueError('Task period must be positive, got {}'.format(period))
+        task = periodic_task(self, period, target, tuple(args), name or getattr(target, '__name__', 'task'))
+        first = time.monotonic() + (period if delay is None else delay)
+        with self._cond:
+            self.tasks.append(task)
+            heapq.heappush(self._heap, (first, next(self._counter), task))
+            self._cond.notify()
+        return task
+
+    def cancel(self, task):
+        with self._cond:
+            task.cancelled = True
+            self._cond.notify()
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """ Stop the worker, waiting for a running task to return unless called from it."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def overrun_lines(self):
+        return ['task {} runs={} overruns={}'.format(task.name, task.runs, task.overruns) for task in self.tasks]
+
+    def _run(self):
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, task = self._heap[0]
+                if task.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.monotonic()
+                if now < deadline:
+                    self._cond.wait(deadline - now)
+                    continue
+                heapq.heappop(self._heap)
+
+                self._cond.release()
+                try:
+                    task.target(*task.args)
+                except Exception as e:
+                    print('Periodic task {} failed: {}'.format(task.name, e))
+                finally:
+                    self._cond.acquire()
+                task.runs += 1
+
+                if task.cancelled:
+                    continue
+                next_deadline = deadline + task.period
+                now = time.monotonic()
+                if now >= next_deadline:
+                    missed = int((now - next_deadline) // task.period) + 1
+                    task.overruns += missed
+                    next_deadline += missed * task.period
+                heapq.heappush(self._heap, (next_deadline, next(self._counter), task))
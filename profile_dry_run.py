@@ -0,0 +1,150 @@
+import argparse
+import sys
+import time
+import numpy as np
+
+import sim_backends
+from batt_test_profile_loader import COMMANDS, compile_profile, validate_profile
+
+MAX_SOC_STEP = 0.25 # % of SOC per integration step
+MAX_STEP_TIME = 7 * 24 * 3600 # s, a condition step not met by then never will be
+
+
+class step_estimate():
+    """ Expected timing and charge of one profile step."""
+
+    def __init__(self, row, start):
+        self.step = int(row['step'])
+        self.command = COMMANDS[int(row['command'])]
+        self.message = str(row['message'])
+        self.start = start
+        self.duration = 0.0
+        self.charge_in_ah = 0.0
+        self.charge_out_ah = 0.0
+        self.soc = None
+        self.voltage = None
+        self.ends = True
+
+    def line(self):
+        return '{:>4} | {:<13} | {:8.2f} h | {:8.2f} h | {:6.2f}% | {:6.2f} V | +{:.2f}/-{:.2f} Ah | {}{}'.format(
+            self.step, self.command, self.start / 3600.0, self.duration / 3600.0, self.soc, self.voltage,
+            self.charge_in_ah, self.charge_out_ah, self.message, '' if self.ends else ' | NEVER ENDS')
+
+
+def _advance(model, clock, estimate, until, condition=None):
+    """ Run the model until condition(model) holds or until seconds have passed, True if condition held.
+
+    Steps are sized so SOC moves at most MAX_SOC_STEP and, while the charger
+    regulates voltage, stay within the time constant of the current tapering
+    off (explicit steps beyond it oscillate). A model that does not change
+    (output off, current limits at 0) jumps straight to until, or gives up
+    on its condition.
+    """
+    elapsed = 0.0
+    rate_scale = 100.0 / (model.capacity_ah * 3600.0)
+    while True:
+        current = model.current()
+        if condition is not None and condition(model, current):
+            return True
+        if elapsed >= until:
+            return condition is None
+        rate = abs(current) * rate_scale
+        if rate == 0:
+            if condition is not None:
+                # Nothing moves, the condition can no longer become true
+                return False
+            clock.sleep(until - elapsed)
+            return True
+        dt = min(MAX_SOC_STEP / rate, until - elapsed)
+        if model.output and -abs(model.ilim_neg) < current < abs(model.ilim_pos):
+            # Voltage regulated: d(current)/d(soc) = -ocv'(soc) / r_internal
+            slope = (model.ocv(model.soc + 0.01) - model.ocv(model.soc)) / 0.01
+            if slope > 0:
+                dt = min(dt, model.r_internal / (slope * rate_scale))
+        if current > 0:
+            estimate.charge_in_ah += current * dt / 3600.0
+        else:
+            estimate.charge_out_ah -= current * dt / 3600.0
+        # The model integrates the step on its next reading
+        clock.sleep(dt)
+        elapsed += dt
+
+
+def dry_run(steps, capacity_ah=30.0, soc=50.0, r_internal=0.02, max_step_time=MAX_STEP_TIME):
+    """ Fast forward a compiled profile on sim_backends.battery_model, returns a step_estimate per step.
+
+    Conditions follow profile_state_machine: timeout waits value seconds,
+    end_current waits for current < value, float_voltage for voltage >= value,
+    output_state switches the charger. Condition steps not met within
+    max_step_time are marked as never ending and the run stops there.
+    """
+    clock = sim_backends.virtual_clock(start_time=0.0)
+    model = sim_backends.battery_model(clock, capacity_ah=capacity_ah, soc=soc, r_internal=r_internal, max_step=np.inf)
+    conditions = {'end_current': lambda model, current, value: current < value,
+                  'float_voltage': lambda model, current, value: model.voltage() >= value}
+    estimates = []
+    for row in steps:
+        estimate = step_estimate(row, clock.monotonic())
+        model.vsp, model.ilim_pos, model.ilim_neg = float(row['Vsp']), float(row['Ilim_pos']), float(row['Ilim_neg'])
+        value = float(row['value'])
+        if estimate.command == 'output_state':
+            model.output = value == 1
+        elif estimate.command == 'timeout':
+            _advance(model, clock, estimate, value)
+        else:
+            condition = conditions[estimate.command]
+            estimate.ends = _advance(model, clock, estimate, max_step_time, lambda model, current: condition(model, current, value))
+        estimate.duration = clock.monotonic() - estimate.start
+        estimate.soc = model.soc
+        estimate.voltage = model.voltage()
+        estimates.append(estimate)
+        if not estimate.ends:
+            break
+    return estimates
+
+
+def summary_lines(estimates, steps):
+    duration = sum(estimate.duration for estimate in estimates)
+    charge_in = sum(estimate.charge_in_ah for estimate in estimates)
+    charge_out = sum(estimate.charge_out_ah for estimate in estimates)
+    lines = ['Total duration = {:.2f} h, charge in = {:.2f} Ah, charge out = {:.2f} Ah, final SOC = {:.2f}%'.format(
+        duration / 3600.0, charge_in, charge_out, estimates[-1].soc)]
+    if not estimates[-1].ends:
+        lines.append('Step {} never ends, {} step(s) after it not reached'.format(estimates[-1].step, len(steps) - len(estimates)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate a test profile and estimate its timeline on a simulated battery')
+    parser.add_argument('profile_file', help='Test profile .csv file', type=str)
+    parser.add_argument('--capacity-ah', help='Simulated battery capacity (default 30)', type=float, default=30.0)
+    parser.add_argument('--soc', help='Initial SOC [%%] (default 50)', type=float, default=50.0)
+    parser.add_argument('--r-internal', help='Battery internal resistance [Ohm] (default 0.02)', type=float, default=0.02)
+    parser.add_argument('--quiet', help='Only print the totals', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.profile_file) as f:
+        problems = validate_profile(f)
+    if problems:
+        for problem in problems:
+            print(problem)
+        print('{} problem(s) in {}'.format(len(problems), args.profile_file))
+        sys.exit(1)
+    with open(args.profile_file) as f:
+        steps = compile_profile(f)
+    print('Profile is valid, {} steps'.format(len(steps)))
+
+    start = time.time()
+    estimates = dry_run(steps, capacity_ah=args.capacity_ah, soc=args.soc, r_internal=args.r_internal)
+    if not args.quiet:
+        for estimate in estimates:
+            print(estimate.line())
+    for line in summary_lines(estimates, steps):
+        print(line)
+    print('Dry run took {:.3f}s'.format(time.time() - start))
+    if not estimates[-1].ends:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
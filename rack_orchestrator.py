@@ -0,0 +1,157 @@
+import argparse
+import csv
+import signal
+import sys
+import threading
+import time
+
+import soc_gauge_test
+from soc_gauge_test import test_channel
+from periodic_scheduler import periodic_scheduler
+from sample_scheduler import sample_scheduler
+from coulomb_counter import QMAX_AS
+
+# Columns of the rack description .csv, one row per battery under test
+RACK_COLUMNS = ['test_name', 'interface', 'database', 'charger_visa', 'profile_file']
+
+
+def load_rack(file):
+    """ Read a rack description into a list of channel settings dicts."""
+    rack = []
+    for line_no, row in enumerate(csv.DictReader(file), start=2):
+        missing = [col for col in RACK_COLUMNS if not row.get(col)]
+        if missing:
+            raise ValueError('Rack line {}: missing {}'.format(line_no, ', '.join(missing)))
+        rack.append({col: row[col].strip() for col in RACK_COLUMNS})
+    names = [row['test_name'] for row in rack]
+    if len(set(names)) != len(names):
+        raise ValueError('Rack test names must be unique')
+    return rack
+
+
+class rack_orchestrator():
+    """ Run one test_channel per battery in its own thread, with an aggregated status view."""
+
+    def __init__(self, rack, sim=False, export_csv=True, **channel_options):
+        self.export_csv = export_csv
+        self.channels = []
+        self.profiles = {}
+        for row in rack:
+            channel = test_channel(row['test_name'], interface=row['interface'], database=row['database'],
+                                   charger_visa_name=row['charger_visa'], sim=sim, **channel_options)
+            self.channels.append(channel)
+            self.profiles[channel.name] = row['profile_file']
+        self.results = {}
+        self.threads = []
+        # Status display and every channel's watchdog share one worker thread
+        self.tasks = periodic_scheduler('rack_tasks')
+
+    def _run_channel(self, channel):
+        try:
+            self.results[channel.name] = channel.run_logged(self.profiles[channel.name], channel.name,
+                                                            export_csv=self.export_csv, display=False,
+                                                            tasks=self.tasks)
+        except Exception as e:
+            channel.status = 'error: {}'.format(e)
+            print('{}: {}'.format(channel.name, channel.status))
+
+    def start(self):
+        self.tasks.add_task(soc_gauge_test.DISPLAY_RATE, self.display_status_task)
+        self.tasks.start()
+        for channel in self.channels:
+            thread = threading.Thread(target=self._run_channel, args=(channel,), name=channel.name)
+            thread.start()
+            self.threads.append(thread)
+
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def join(self, poll=0.5):
+        # Poll so the main thread stays responsive to SIGINT
+        while self.running():
+            time.sleep(poll)
+        self.tasks.stop()
+
+    def stop(self, name=None):
+        """ Emergency stop one channel by name, or every channel."""
+        for channel in self.channels:
+            if name is None or channel.name == name:
+                channel.stop()
+                if name is not None:
+                    return True
+        return name is None
+
+    def display_status_task(self):
+        """Display latest data of every channel on console."""
+        print('\n'.join(channel.status_line() for channel in self.channels))
+
+    def summary_lines(self):
+        lines = []
+        for channel in self.channels:
+            samples, wall_time, log_name = self.results.get(channel.name, (channel.samples, 0, '-'))
+            lines.append('{} | {} | {} samples | max SOC error {:2.2f}% | log {}'.format(
+                channel.name, channel.status, samples, channel.soc_tracker.max_abs_error, log_name))
+        return lines
+
+
+def command_task(orchestrator):
+    """ Read 'stop <test_name>' / 'stop all' commands from the console."""
+    for line in sys.stdin:
+        words = line.split()
+        if len(words) == 2 and words[0] == 'stop':
+            if words[1] == 'all':
+                orchestrator.stop()
+            elif not orchestrator.stop(words[1]):
+                print('Unknown channel {}'.format(words[1]))
+        elif words:
+            print("Commands: 'stop <test_name>' or 'stop all'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run SOC gauge tests on a rack of batteries in parallel')
+    parser.add_argument('rack_file', help='Rack description .csv ({})'.format(','.join(RACK_COLUMNS)), type=str)
+    parser.add_argument('--sim', help='Run every channel against a simulated IBS and charger', action='store_true')
+    parser.add_argument('--sample-rate', help='Sample period in seconds (default {})'.format(soc_gauge_test.SAMPLE_RATE), type=float, default=soc_gauge_test.SAMPLE_RATE)
+    parser.add_argument('--late-policy', help='What to do with missed sample ticks', choices=sample_scheduler.policies, default='skip')
+    parser.add_argument('--capacity-ah', help='Capacity of the batteries under test for the live coulomb counted SOC (required with --soc-error-limit, default {} otherwise)'.format(QMAX_AS / 3600), type=float, default=None)
+    parser.add_argument('--soc-error-limit', help='Flag a channel when |gauge SOC - reference SOC| exceeds this [%%]', type=float, default=None)
+    parser.add_argument('--abort-on-soc-error', help='Stop a channel when its SOC error limit is exceeded (needs --soc-error-limit)', action='store_true')
+    parser.add_argument('--no-csv', help='Only keep the binary logs, skip the .csv exports at the end', action='store_true')
+    args = parser.parse_args()
+    if args.abort_on_soc_error and args.soc_error_limit is None:
+        parser.error('--abort-on-soc-error needs --soc-error-limit')
+    if args.soc_error_limit is not None and args.capacity_ah is None:
+        parser.error('--soc-error-limit needs --capacity-ah of the batteries under test')
+
+    with open(args.rack_file) as f:
+        rack = load_rack(f)
+    print('Rack has {} channels: {}'.format(len(rack), ', '.join(row['test_name'] for row in rack)))
+    problems = ['{}: {}'.format(row['test_name'], problem) for row in rack for problem in soc_gauge_test.profile_problems(row['profile_file'])]
+    if problems:
+        print('\n'.join(problems))
+        parser.error('{} problem(s) in the rack profiles'.format(len(problems)))
+
+    orchestrator = rack_orchestrator(rack, sim=args.sim, export_csv=not args.no_csv,
+                                     sample_rate=args.sample_rate, late_policy=args.late_policy,
+                                     capacity_ah=args.capacity_ah, soc_error_limit=args.soc_error_limit,
+                                     abort_on_soc_error=args.abort_on_soc_error)
+
+    def exit_signal_handler(signal, frame):
+        print('Stopping all channels...')
+        orchestrator.stop()
+    signal.signal(signal.SIGINT, exit_signal_handler)
+
+    commands = threading.Thread(target=command_task, args=(orchestrator,))
+    commands.daemon = True
+    commands.start()
+
+    orchestrator.start()
+    orchestrator.join()
+
+    print('Rack test finished.')
+    for line in orchestrator.summary_lines():
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
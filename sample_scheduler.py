@@ -0,0 +1,75 @@
+import time
+from bisect import bisect_left
+
+# Upper edges of the lateness histogram bins in ms, the last bin catches everything above
+LATENESS_BINS_MS = [0.1, 0.5, 1, 2, 5, 10, 20, 50, 100]
+
+
+class sample_scheduler():
+    """ Periodic sample scheduler planned on absolute deadlines of a monotonic clock.
+
+    Deadlines are start + n * period so timing errors never accumulate. When a
+    tick is missed the 'catch_up' policy runs the late ticks back to back while
+    'skip' drops them and realigns on the next future deadline.
+    """
+
+    policies = ('skip', 'catch_up')
+
+    def __init__(self, period, clock=time, policy='skip'):
+        if period <= 0:
+            raise ValueError('Sample period must be positive, got {}'.format(period))
+        if policy not in self.policies:
+            raise ValueError('Unknown late tick policy {!r}, use one of {}'.format(policy, self.policies))
+        self.period = period
+        self.clock = clock
+        self.policy = policy
+        self.start_time = None
+        self.tick_index = 0
+        self.ticks = 0
+        self.skipped = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+        self.histogram = [0] * (len(LATENESS_BINS_MS) + 1)
+
+    def start(self):
+        self.start_time = self.clock.monotonic()
+        self.tick_index = 0
+
+    def wait(self):
+        """ Sleep until the next deadline and return the elapsed time since start."""
+        if self.start_time is None:
+            self.start()
+        deadline = self.start_time + self.tick_index * self.period
+        now = self.clock.monotonic()
+        if now < deadline:
+            self.clock.sleep(deadline - now)
+            now = self.clock.monotonic()
+
+        lateness = max(now - deadline, 0.0)
+        self.ticks += 1
+        self.total_lateness += lateness
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        self.histogram[bisect_left(LATENESS_BINS_MS, lateness * 1000.0)] += 1
+
+        # Plan the next deadline
+        self.tick_index += 1
+        next_deadline = self.start_time + self.tick_index * self.period
+        if self.policy == 'skip' and now >= next_deadline:
+            missed = int((now - next_deadline) // self.period) + 1
+            self.tick_index += missed
+            self.skipped += missed
+        return now - self.start_time
+
+    def header_lines(self):
+        """ Scheduler settings, for the top of a log file."""
+        return ['sample_period={}s late_policy={}'.format(self.period, self.policy),
+                'lateness_bins_ms={}'.format(','.join(str(b) for b in LATENESS_BINS_MS))]
+
+    def summary_lines(self):
+        """ Lateness statistics gathered so far."""
+        mean = self.total_lateness / self.ticks if self.ticks else 0.0
+        labels = ['<={}'.format(b) for b in LATENESS_BINS_MS] + ['>{}'.format(LATENESS_BINS_MS[-1])]
+        return ['ticks={} skipped={} mean_lateness={:.3f}ms max_lateness={:.3f}ms'.format(
+                    self.ticks, self.skipped, mean * 1000.0, self.max_lateness * 1000.0),
+                'lateness_histogram_ms: ' + ' '.join('{}:{}'.format(l, c) for l, c in zip(labels, self.histogram))]
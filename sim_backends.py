@@ -0,0 +1,332 @@
+import time
+import re
+from collections import namedtuple
+import numpy as np
+
+from lin_signals import RAW_FRAME_DTYPE, TIMESTAMP_TICK, LIN_DATA_FRAME_TYPE
+
+
+class virtual_clock():
+    """ Clock that only advances when slept on, so long profiles run as fast as the loop."""
+
+    def __init__(self, start_time=None):
+        if start_time is None:
+            start_time = time.time()
+        self.start_time = start_time
+        self.elapsed = 0.0
+
+    def time(self):
+        return self.start_time + self.elapsed
+
+    def monotonic(self):
+        return self.elapsed
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.elapsed += seconds
+
+
+class battery_model():
+    """ Simple lead-acid battery wired to a CV/CC charger, evaluated lazily on the clock."""
+
+    def __init__(self, clock, capacity_ah=30.0, soc=50.0, r_internal=0.02, temp=25.0, max_step=1.0):
+        self.clock = clock
+        self.capacity_ah = capacity_ah
+        self.soc = soc
+        self.r_internal = r_internal
+        self.temp = temp
+        self.max_step = max_step
+        self.recalibrated = 0
+        # Charger state, driven through the simulated SCPI interface
+        self.vsp = 0.0
+        self.ilim_pos = 0.0
+        self.ilim_neg = 0.0
+        self.output = False
+        self.last_update = clock.monotonic()
+
+    def ocv(self, soc=None):
+        """ Open circuit voltage, steep near full so CV charging tapers off."""
+        if soc is None:
+            soc = self.soc
+        x = min(max(soc, 0.0), 100.0) / 100.0
+        return 11.8 + 1.2 * x + 1.8 * x ** 8
+
+    def _current(self, soc):
+        if not self.output:
+            return 0.0
+        current = (self.vsp - self.ocv(soc)) / self.r_internal
+        return min(max(current, -abs(self.ilim_neg)), abs(self.ilim_pos))
+
+    def update(self):
+        """ Integrate SOC up to the current clock time."""
+        now = self.clock.monotonic()
+        dt = now - self.last_update
+        while dt > 0:
+            step = min(dt, self.max_step)
+            self.soc += 100.0 * self._current(self.soc) * step / (self.capacity_ah * 3600.0)
+            self.soc = min(max(self.soc, 0.0), 100.0)
+            dt -= step
+        self.last_update = now
+
+    def current(self):
+        self.update()
+        return self._current(self.soc)
+
+    def voltage(self):
+        self.update()
+        return self.ocv() + self._current(self.soc) * self.r_internal
+
+    def signals(self):
+        """ Snapshot of the signals the IBS publishes on the LIN bus."""
+        self.update()
+        current = self._current(self.soc)
+        return {
+            'BatteryVoltage': self.ocv() + current * self.r_internal,
+            'BatteryCurrent': current,
+            'BatteryTemperature': self.temp,
+            'StateOfCharge': self.soc,
+            'NominalCapacity': self.capacity_ah,
+            'Recalibrated': self.recalibrated,
+            }
+
+
+class sim_charger_visa():
+    """ Stand-in for the charger VISA resource, understands the SCPI used by psu."""
+
+    def __init__(self, model, idn='SIMULATED,CHARGER,0,1.0', compound=True):
+        self.model = model
+        self.idn = idn
+        # Set compound=False to act like an instrument rejecting ';' separated commands
+        self.compound = compound
+
+    def _split(self, command):
+        commands = [cmd.strip().lstrip(':') for cmd in command.split(';')]
+        if len(commands) > 1 and not self.compound:
+            raise ValueError('Simulated charger: compound command rejected {!r}'.format(command))
+        return commands
+
+    def write(self, command):
+        for cmd in self._split(command):
+            self._execute(cmd)
+
+    def query(self, command):
+        return ';'.join(self._execute(cmd) for cmd in self._split(command))
+
+    def _execute(self, cmd):
+        model = self.model
+        # Bring the model up to date before any setpoint change
+        model.update()
+        upper = cmd.upper()
+        if upper == '*IDN?':
+            return self.idn
+        if upper == 'MEAS:VOLT?':
+            return '{:.6f}'.format(model.voltage())
+        if upper == 'MEAS:CURR?':
+            return '{:.6f}'.format(model.current())
+        match = re.match(r'^(OUTPUT|CURR:LIM:NEG|CURR:LIM|VOLT)\s+(\S+)$', upper)
+        if match is None:
+            raise ValueError('Simulated charger: unsupported command {!r}'.format(cmd))
+        header, value = match.groups()
+        if header == 'OUTPUT':
+            model.output = value in ('ON', '1')
+        elif header == 'CURR:LIM:NEG':
+            model.ilim_neg = float(value)
+        elif header == 'CURR:LIM':
+            model.ilim_pos = float(value)
+        elif header == 'VOLT':
+            model.vsp = float(value)
+        return ''
+
+    def close(self):
+        pass
+
+
+sim_frame = namedtuple('sim_frame', ['name', 'timestamp', 'signals'])
+
+
+class _sim_frames():
+
+    def __init__(self, session):
+        self._session = session
+
+    def read(self, frame_type=None):
+        session = self._session
+        snapshot = session.model.signals()
+        timestamp = session.model.clock.time()
+        return [sim_frame(name, timestamp, snapshot) for name in session.frame_names]
+
+
+class _sim_intf():
+    lin_term = None
+    lin_master = False
+
+
+class sim_lin_session():
+    """ Stand-in for nixnet.FrameInSinglePointSession backed by a battery_model."""
+
+    def __init__(self, model, frame_names):
+        self.model = model
+        self.frame_names = list(frame_names)
+        self.frames = _sim_frames(self)
+        self.intf = _sim_intf()
+        self.lin_schedule = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def change_lin_schedule(self, sched_index):
+        self.lin_schedule = sched_index
+
+    def close(self):
+        pass
+
+
+class sim_signal_converter():
+    """ Stand-in for convert.SignalConversionSinglePointSession."""
+
+    def __init__(self, signal_names):
+        self.signal_names = list(signal_names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def convert_frames_to_signals(self, frames):
+        # Same (timestamp, value) pairs as the XNET converter
+        values = {}
+        timestamp = 0
+        for frame in frames:
+            values.update(frame.signals)
+            timestamp = max(timestamp, frame.timestamp)
+        return [(timestamp, values[name]) for name in self.signal_names]
+
+    def close(self):
+        pass
+
+
+class _sim_stream_frames():
+
+    def __init__(self, session):
+        self._session = session
+
+    def read_bytes(self, num_bytes, timeout=0):
+        return self._session.read_raw(num_bytes // RAW_FRAME_DTYPE.itemsize).tobytes()
+
+
+class sim_stream_session(sim_lin_session):
+    """ Stand-in for nixnet.FrameInStreamSession, the IBS publishes one frame per schedule slot.
+
+    Payloads are encoded with a lin_signals.lin_signal_decoder so the stream path
+    decodes the same bytes it would get from the bus.
+    """
+
+    def __init__(self, model, decoder, frame_names, slot_time=0.01):
+        sim_lin_session.__init__(self, model, frame_names)
+        self.frames = _sim_stream_frames(self)
+        self.decoder = decoder
+        self.slot_time = slot_time
+        self.slots_sent = 0
+
+    def read_raw(self, max_frames):
+        """ Frames published since the last read, at most max_frames."""
+        now = self.model.clock.monotonic()
+        due = int(now / self.slot_time) - self.slots_sent
+        n = max(min(due, max_frames), 0)
+        frames = np.zeros(n, dtype=RAW_FRAME_DTYPE)
+        if n == 0:
+            return frames
+        snapshot = self.model.signals()
+        slots = self.slots_sent + np.arange(n)
+        encoded = [self.decoder.encode(name, snapshot) for name in self.frame_names]
+        ids = np.array([frame_id for frame_id, _ in encoded])
+        payloads = np.frombuffer(b''.join(payload for _, payload in encoded), dtype=np.uint8).reshape(-1, 8)
+        which = slots % len(self.frame_names)
+        frames['timestamp'] = ((self.model.clock.start_time + slots * self.slot_time) / TIMESTAMP_TICK).astype(np.uint64)
+        frames['identifier'] = ids[which]
+        frames['type'] = LIN_DATA_FRAME_TYPE
+        frames['payload_length'] = 8
+        frames['payload'] = payloads[which]
+        self.slots_sent += n
+        return frames
+
+
+sim_lin_frame = namedtuple('sim_lin_frame', ['identifier', 'timestamp', 'payload'])
+
+
+class _sim_diag_frames():
+
+    def __init__(self, node):
+        self._node = node
+
+    def write(self, frames):
+        for frame in frames:
+            payload = frame[1] if isinstance(frame, tuple) else frame.payload
+            self._node.request(bytes(bytearray(payload)))
+
+    def read(self, num_frames, timeout=0, frame_type=None):
+        return self._node.read_responses(num_frames)
+
+
+class sim_ibs_diag_node(sim_lin_session):
+    """ Stand-in for the MasterReq output and SlaveResp input sessions of an IBS.
+
+    Answers ReadById (0xB2), WriteById (0xB5), table state (0x30) and table
+    on/off (0x31) requests after response_delay, from a dict of data id ->
+    data bytes (id 0x01 holds the serial number, answered without the
+    echoed id like a standard LIN ReadByIdentifier 1). One object serves as both sessions.
+    """
+
+    def __init__(self, clock, nads=(0x01, 0x82), registers=None, response_delay=0.02, serial=0x12345678):
+        sim_lin_session.__init__(self, None, [])
+        self.clock = clock
+        self.nads = nads
+        self.registers = {0x01: serial.to_bytes(4, 'big')}
+        self.registers.update(registers or {})
+        self.table_state = 1
+        self.response_delay = response_delay
+        self.frames = _sim_diag_frames(self)
+        self.pending = []
+        self.requests = 0
+        self.writes = 0
+
+    def request(self, payload):
+        self.requests += 1
+        nad, pci, sid = payload[0], payload[1], payload[2]
+        if nad not in self.nads and nad != 0x7F:
+            return
+        if sid == 0xB2 and payload[3] == 0x01:
+            # Standard LIN ReadByIdentifier 1 (serial number), no echoed identifier
+            response = [nad, 0x05, 0xF2] + list(self.registers[0x01][:4]) + [0xFF]
+        elif sid == 0xB2:
+            data = self.registers.get(payload[3], b'\xFF\xFF\xFF\xFF')
+            response = [nad, 0x06, 0xF2, payload[3]] + list(data[:4].ljust(4, b'\xFF'))
+        elif sid == 0xB5:
+            self.registers[payload[3]] = payload[4:4 + (pci & 0x0F) - 2].ljust(4, b'\xFF')
+            self.writes += 1
+            response = [nad, 0x02, 0xF5, payload[3], 0xFF, 0xFF, 0xFF, 0xFF]
+        elif sid == 0x30:
+            response = [nad, 0x02, 0x70, self.table_state, 0xFF, 0xFF, 0xFF, 0xFF]
+        elif sid == 0x31:
+            self.table_state = payload[3]
+            self.writes += 1
+            response = [nad, 0x01, 0x71, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
+        else:
+            response = [nad, 0x03, 0x7F, sid, 0x11, 0xFF, 0xFF, 0xFF]
+        self.pending.append((self.clock.monotonic() + self.response_delay, bytes(response)))
+
+    def read_responses(self, num_frames):
+        now = self.clock.monotonic()
+        due = [item for item in self.pending if item[0] <= now][:num_frames]
+        self.pending = [item for item in self.pending if item not in due]
+        return [sim_lin_frame(0x3D, self.clock.time(), payload) for _, payload in due]
@@ -1,48 +1,79 @@
 import argparse
 import time
-import six
-import pyvisa as pyvisa
 
-import nixnet
-from nixnet import constants
-from nixnet import types
-from nixnet import convert
+# Hardware drivers are only needed for bench runs, --sim works without them
+try:
+    import pyvisa as pyvisa
+    VISA_ERRORS = (ValueError, pyvisa.errors.VisaIOError)
+except ImportError:
+    pyvisa = None
+    VISA_ERRORS = (ValueError,)
+try:
+    import nixnet
+    from nixnet import constants
+    from nixnet import types
+    from nixnet import convert
+except ImportError:
+    nixnet = None
 
 import os
+import re
 import signal
-import sys
-from threading import Timer
+import threading
 from datetime import datetime
-import csv
-from batt_test_profile_loader import profile_state_machine
+from batt_test_profile_loader import profile_state_machine, validate_profile
+from sample_scheduler import sample_scheduler
+from periodic_scheduler import periodic_scheduler
+import data_logger
+from coulomb_counter import coulomb_counter, QMAX_AS
+import sim_backends
+from async_acquisition import async_acquisition, acquisition_source
+import lin_stream
+import lin_signals
+from telemetry_store import telemetry_store
+import numpy as np
 
 class battery:
-    voltage = 0
-    current = 0
-    soc = 0
-    temp = 0
-    cell_volts = [0,0,0,0]
-    data = []
+    """ Latest IBS sample, filled in place every tick."""
+    __slots__ = ('name', 'time', 'voltage', 'current', 'soc')
+
     def __init__(self, name):
         self.name = name
+        self.time = 0.0
+        self.voltage = 0.0
+        self.current = 0.0
+        self.soc = 0.0
+
     def pack_data(self, time, voltage, current, soc):
         self.time = time
         self.voltage = voltage
         self.current = current
         self.soc = soc
 
-    def list_data(self):
-        return [self.voltage, self.current, self.soc]
+    def pack_signals(self, time, converted_signals):
+        """ Fill from the converter's (timestamp, value) pairs, in signals order."""
+        (_, voltage), (_, current), (_, soc) = converted_signals
+        self.time = time
+        self.voltage = float(voltage)
+        self.current = float(current)
+        self.soc = float(soc)
 
 class psu:
+    """ Charger on a VISA resource, holds its latest measurement."""
+    __slots__ = ('name', 'visa', 'compound', 'latency', 'voltage', 'current', 'voltage_setpoint', 'lock')
 
-    voltage = 0
-    current = 0
-    voltage_setpoint = 0
-
-    def __init__(self, name, visa_resource):
+    def __init__(self, name, visa_resource, compound=True):
         self.name = name
         self.visa = visa_resource
+        # Send several SCPI commands per message, dropped if the instrument rejects it
+        self.compound = compound
+        self.latency = {}
+        self.voltage = 0.0
+        self.current = 0.0
+        self.voltage_setpoint = 0.0
+        # VISA sessions are not thread safe: a measurement still running on the
+        # acquisition thread must finish before a setpoint write goes out
+        self.lock = threading.Lock()
 
 
     def pack_data(self, voltage, current):
@@ -50,81 +81,94 @@ class psu:
         self.current = current
 
 
-    def list_data(self):
-        return [self.voltage, self.current]
+    def _timed(self, name, func, message):
+        with self.lock:
+            start = time.perf_counter()
+            result = func(message)
+            elapsed = time.perf_counter() - start
+            stats = self.latency.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+        return result
+
+    def write(self, commands):
+        """Send SCPI commands, coalesced into one message when compound commands are allowed."""
+        if self.compound:
+            try:
+                self._timed('write', self.visa.write, ';:'.join(commands))
+                return
+            except VISA_ERRORS:
+                # Setpoint commands are idempotent, resend them all one by one
+                self._compound_rejected()
+        for command in commands:
+            self._timed('write', self.visa.write, command)
+
+    def _compound_rejected(self):
+        print('{}: compound SCPI not supported, falling back to single commands'.format(self.name))
+        self.compound = False
+
+    def query_values(self, queries):
+        """Query SCPI values, in one round trip when compound commands are allowed."""
+        if self.compound:
+            try:
+                reply = self._timed('query', self.visa.query, ';:'.join(queries))
+                values = [float(v) for v in re.split('[;,]', reply.strip())]
+                if len(values) == len(queries):
+                    return values
+            except VISA_ERRORS:
+                pass
+            self._compound_rejected()
+        return [float(self._timed('query', self.visa.query, query)) for query in queries]
+
+    def latency_lines(self):
+        """Per call SCPI latency statistics."""
+        return ['scpi_{} calls={} mean={:.3f}ms max={:.3f}ms compound={}'.format(
+                    name, count, 1000.0 * total / count, 1000.0 * worst, self.compound)
+                for name, (count, total, worst) in sorted(self.latency.items())]
 
 
     def idn(self):
-        return self.visa.query('*IDN?')
+        with self.lock:
+            return self.visa.query('*IDN?')
 
 
     def init(self):
-        self.visa.write('OUTPUT OFF')
-        self.visa.write('CURR:LIM 0')
-        self.visa.write('CURR:LIM:NEG 0')
-        self.visa.write('VOLT 0')
+        if self.compound:
+            # Probe once so an instrument without compound support, which may drop a
+            # compound write without raising, falls back before the first setpoint
+            self.query_values(['MEAS:VOLT?', 'MEAS:CURR?'])
+        self.write(['OUTPUT OFF', 'CURR:LIM 0', 'CURR:LIM:NEG 0', 'VOLT 0'])
 
 
     def set_curr_lim(self, pos_lim, neg_lim):
-        self.visa.write('CURR:LIM {}'.format(pos_lim))
-        self.visa.write('CURR:LIM:NEG {}'.format(neg_lim))
+        self.write(['CURR:LIM {}'.format(pos_lim), 'CURR:LIM:NEG {}'.format(neg_lim)])
 
 
     def set_voltage(self, volt):
-        self.visa.write('VOLT {}'.format(volt))
+        self.write(['VOLT {}'.format(volt)])
 
 
     def set_output(self, state):
         if(state == 'ON'):
-            self.visa.write('OUTPUT ON')
+            self.write(['OUTPUT ON'])
         elif(state == 'OFF'):
-            self.visa.write('OUTPUT OFF')
+            self.write(['OUTPUT OFF'])
 
     def set_charger_setpoints(self,voltage=0,ilim_pos=0, ilim_neg=0, output_state='OFF'):
-        self.set_voltage(voltage)
-        self.set_curr_lim(ilim_pos, ilim_neg)
-        self.set_output(output_state)
+        commands = ['VOLT {}'.format(voltage), 'CURR:LIM {}'.format(ilim_pos), 'CURR:LIM:NEG {}'.format(ilim_neg)]
+        if output_state in ('ON', 'OFF'):
+            commands.append('OUTPUT {}'.format(output_state))
+        self.write(commands)
+
 
+    def measure(self):
+        """Measured (voltage, current), without updating the held values."""
+        return self.query_values(['MEAS:VOLT?', 'MEAS:CURR?'])
 
     def read_data(self):
-        self.voltage = float(self.visa.query('MEAS:VOLT?'))
-        self.current = float(self.visa.query('MEAS:CURR?'))
-
-class InfiniteTimer():
-    """A Timer class that does not stop, unless you want it to."""
-
-    def __init__(self, seconds, target):
-        self._should_continue = False
-        self.is_running = False
-        self.seconds = seconds
-        self.target = target
-        self.thread = None
-
-
-    def _handle_target(self):
-        self.is_running = True
-        self.target()
-        self.is_running = False
-        self._start_timer()
-
-    def _start_timer(self):
-        if self._should_continue: # Code could have been running when cancel was called.
-            self.thread = Timer(self.seconds, self._handle_target)
-            self.thread.start()
-
-    def start(self):
-        if not self._should_continue and not self.is_running:
-            self._should_continue = True
-            self._start_timer()
-        else:
-            print("Timer already started or running, please wait if you're restarting.")
-
-    def cancel(self):
-        if self.thread is not None:
-            self._should_continue = False # Just in case thread is running and cancel fails.
-            self.thread.cancel()
-        else:
-            print("Timer never started or failed to initialize.")
+        self.voltage, self.current = self.measure()
 
 # Global Variables
 # interface = 'LIN1'
@@ -158,139 +202,369 @@ schedule_index = 3
 #             ]
 # schedule_index = 1
 
+# LIN settings per IBS database, used when a channel picks another database
+IBS_DATABASES = {
+    'hella_gen1_ibs': {'cluster': 'Cluster', 'frames': ['IBS_FRM2','IBS_FRM5'], 'schedule_index': 3},
+    'hella_gen2_ibs': {'cluster': 'Cluster', 'frames': ['IBS_UIT','IBS_BZE1'], 'schedule_index': 1},
+    }
+
 DISPLAY_RATE = 1 # every 1 second
+WATCHDOG_RATE = 5 # every 5 seconds
+LOG_FLUSH_INTERVAL = 5 # s, longest delay before samples reach the log file (live_viewer follows it)
 SAMPLE_RATE = 0.2 # every 200ms
-# Create Objects
-batt = battery('YUASA_30_GEN1_IBS')
-charger = psu('Keysight', None)
+BATTERY_NAME = 'YUASA_30_GEN1_IBS'
+LOG_CHANNELS = ['batt_voltage', 'batt_current', 'batt_soc', 'charger_voltage', 'charger_current', 'charge_as', 'soc_ref', 'soc_error']
 today = datetime.now().timetuple()
 
 
-# Functions
-def display_data_task():
-    """Display latest data on console."""
-    print('{:2.2f}s | Charger Voltage = {:2.2f}V | Charger Current = {:2.2f}A | Batt. Voltage = {:2.2f}V | Batt. Current = {:2.2f}A | Batt. SOC = {:2.2f}'.format(batt.time,*(charger.list_data() + batt.list_data())))
-    #print('Charger Voltage = {}V / Charger Current = {}A'.format(*charger.list_data()))
-
-
-def log_data():
-    """Log line of data in session's .csv file."""
-
-
-def main():
+def log_file_name(test_name):
+    """Session log name, <test>_<month>_<day>_<hourmin> without extension."""
+    return test_name + '_' + str(today[1]) + '_' + str(today[2]) + '_' + str(today[3]) + str(today[4])
 
-    parser = argparse.ArgumentParser(description='Script used to test SOC gauge performance')
-    #parser.add_argument('pos_current_lim', help="Choose the charger's positive current limit", type=float)
-    ##parser.add_argument('neg_curr_lim', help="Choose the charger's negative current limit", type=float)
-    #parser.add_argument('voltage_high', help='Choose what the high level charger voltage is', type=float)
-    #parser.add_argument('voltage_low', help='Choose what the low level charger voltage is', type=float)
-    parser.add_argument('profile_file', help='Choose Test profile .csv file', type=str)
-    parser.add_argument('test_name', help='Choose name of the test', type=str)
-    parser.add_argument('charger_visa_name', help='Type in the charger VISA alias',type=str)
-
-    args = parser.parse_args()
-    print('Profile chosen : {}'.format(args.profile_file))
 
+def profile_path(profile_file):
+    local_path =  os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(local_path, profile_file)
 
 
-    # Open Charger VISA open_resource
-    rm = pyvisa.ResourceManager()
-    charger_visa = rm.open_resource(args.charger_visa_name)
-    # Open log file
-    filename = args.test_name + '_' + str(today[1]) + '_' + str(today[2]) + '_' + str(today[3]) + str(today[4]) + '.csv'
-    print("Opening log file as {}".format(filename))
-    log_file = open(filename,'w')
-    header = "time,batt_voltage,batt_current,batt_soc,charger_voltage,charger_current\n"
-    log_file.write(header)
+def profile_problems(profile_file):
+    """Every problem in a profile, checked before the test starts rather than when the bad step is reached."""
+    with open(profile_path(profile_file)) as profile:
+        return validate_profile(profile)
 
-    charger.visa = charger_visa
-    print(charger.idn())
-    charger.init()
 
-    # Set up Profile State Machine
-    local_path =  os.path.dirname(os.path.abspath(__file__))
-    filename = os.path.join(local_path, args.profile_file)
+class test_channel():
+    """One battery under test: IBS, charger, profile, log and SOC tracking with their own state."""
 
-    with open(filename) as profile:
-        test_profile = profile_state_machine(profile)
+    def __init__(self, name, interface=interface, database=database, charger_visa_name=None, sim=False,
+                 battery_name=BATTERY_NAME, sample_rate=SAMPLE_RATE, late_policy='skip',
+                 capacity_ah=None, soc_error_limit=None, abort_on_soc_error=False,
+                 concurrent_acquisition=None, stream_capture=False):
+        self.name = name
+        self.interface = interface
+        self.database = database
+        lin = IBS_DATABASES.get(database, {'cluster': cluster, 'frames': frames, 'schedule_index': schedule_index})
+        self.cluster, self.frames, self.schedule_index = lin['cluster'], lin['frames'], lin['schedule_index']
+        self.signals = signals
+        self.charger_visa_name = charger_visa_name
+        self.sim = sim
+        self.sample_rate = sample_rate
+        self.late_policy = late_policy
+        if abort_on_soc_error and soc_error_limit is None:
+            raise ValueError('abort_on_soc_error needs a soc_error_limit')
+        # The reference SOC is only as good as its capacity, a default one would flag good gauges
+        if soc_error_limit is not None and capacity_ah is None:
+            raise ValueError('soc_error_limit needs the capacity_ah of the battery under test')
+        if capacity_ah is None:
+            capacity_ah = QMAX_AS / 3600
+        self.abort_on_soc_error = abort_on_soc_error
+        # Concurrent reads pay off on real buses, simulated sources answer instantly
+        if concurrent_acquisition is None:
+            concurrent_acquisition = not sim
+        self.concurrent_acquisition = concurrent_acquisition
+        self.acquisition = None
+        # Capture every IBS frame through a stream session instead of polling the latest values
+        self.stream_capture = stream_capture
+        # Create Objects
+        self.batt = battery(battery_name)
+        self.charger = psu('Keysight', None)
+        self.soc_tracker = coulomb_counter(capacity_ah * 3600.0, error_limit=soc_error_limit)
+        # Every sample goes through the store, display and logging read consistent rows from it
+        self.telemetry = telemetry_store(LOG_CHANNELS)
+        self._logged = 0
+        self.scheduler = None
+        self.stop_event = threading.Event()
+        self.status = 'idle'
+        self.samples = 0
+        self._watchdog_samples = 0
+
+    def status_line(self):
+        """Latest data of this channel on one line."""
+        row = self.telemetry.latest()
+        if row is None:
+            return '{} | {}'.format(self.name, self.status)
+        sample_time, batt_voltage, batt_current, batt_soc, charger_voltage, charger_current, charge_as, soc_ref, soc_error = row
+        return '{} | {} | {:2.2f}s | Charger Voltage = {:2.2f}V | Charger Current = {:2.2f}A | Batt. Voltage = {:2.2f}V | Batt. Current = {:2.2f}A | Batt. SOC = {:2.2f} | Ref. SOC = {:2.2f} | SOC Error = {:2.2f} | Q = {:2.3f}Ah'.format(
+            self.name, self.status, sample_time, charger_voltage, charger_current, batt_voltage, batt_current, batt_soc,
+            soc_ref, soc_error, charge_as / 3600.0)
+
+    def display_data_task(self):
+        """Display latest data on console."""
+        print(self.status_line())
+
+    def watchdog_task(self):
+        """Warn when the acquisition loop stops producing samples."""
+        samples = self.telemetry.count
+        if self.status == 'running' and samples == self._watchdog_samples:
+            print('{}: no new sample for {}s, acquisition stalled?'.format(self.name, WATCHDOG_RATE))
+        self._watchdog_samples = samples
+
+    def store_sample(self, sample_time):
+        """Publish the latest sample to the telemetry store."""
+        batt, charger, soc_tracker = self.batt, self.charger, self.soc_tracker
+        self.telemetry.append(sample_time, batt.voltage, batt.current, batt.soc, charger.voltage, charger.current,
+                              soc_tracker.charge, soc_tracker.soc_ref, soc_tracker.error)
+
+    def log_data(self, logger):
+        """Log the samples stored since the last call in session's binary log."""
+        rows, self._logged = self.telemetry.since(self._logged)
+        if len(rows):
+            logger.append_block(rows[:, 0], rows[:, 1:])
+
+    def open_backends(self):
+        """Open charger VISA resource and LIN sessions, real or simulated.
+
+        Returns (clock, charger_visa, lin_session, signal_converter). With stream_capture
+        the converter is a lin_stream.lin_stream_capture draining the stream session.
+        """
+        if self.sim:
+            clock = sim_backends.virtual_clock()
+            model = sim_backends.battery_model(clock)
+            if self.stream_capture:
+                decoder = lin_signals.compile_decoder(self.database, self.signals, self.cluster, sim=True)
+                session = sim_backends.sim_stream_session(model, decoder, self.frames)
+                return (clock, sim_backends.sim_charger_visa(model), session, lin_stream.lin_stream_capture(session, decoder))
+            return (clock,
+                    sim_backends.sim_charger_visa(model),
+                    sim_backends.sim_lin_session(model, self.frames),
+                    sim_backends.sim_signal_converter(self.signals))
+
+        if pyvisa is None or nixnet is None:
+            raise RuntimeError('pyvisa and nixnet are required for hardware runs, use --sim otherwise')
+        rm = pyvisa.ResourceManager()
+        charger_visa = rm.open_resource(self.charger_visa_name)
+        if self.stream_capture:
+            session = nixnet.FrameInStreamSession(self.interface, self.database, self.cluster)
+            decoder = lin_signals.compile_decoder(self.database, self.signals, self.cluster)
+            return (time, charger_visa, session, lin_stream.lin_stream_capture(session, decoder))
+        return (time,
+                charger_visa,
+                nixnet.FrameInSinglePointSession(self.interface, self.database, self.cluster, self.frames),
+                convert.SignalConversionSinglePointSession(self.database, self.cluster, self.signals))
+
+    def stop(self):
+        """Emergency stop, the acquisition loop turns the charger off on its next tick."""
+        self.stop_event.set()
+
+    def log_trace(self, trace_logger, capture, sample_time):
+        """Log every frame captured since the last tick in the full-rate trace log."""
+        while capture.batches:
+            ids, times, values = capture.batches.popleft()
+            if self._trace_offset is None:
+                # Align hardware timestamps on the sample clock, the newest frame is about now
+                self._trace_offset = sample_time - times[-1]
+            trace_logger.append_block(times + self._trace_offset, np.column_stack((ids, values)))
+
+    def run(self, profile, logger, display=True, tasks=None, trace_logger=None):
+        """Run a test profile until it is done or stopped, logging every sample on the scheduler's ticks.
+
+        Display and watchdog run on tasks, a shared periodic_scheduler, or a private one if None.
+        With stream capture every decoded IBS frame also goes to trace_logger.
+
+        Returns the number of samples taken and the wall time it took.
+        """
+        batt, charger, soc_tracker = self.batt, self.charger, self.soc_tracker
+        clock, charger_visa, lin_session, signal_converter = self.open_backends()
+        self.scheduler = scheduler = sample_scheduler(self.sample_rate, clock=clock, policy=self.late_policy)
+        logger.add_metadata('scheduler', scheduler.header_lines())
+
+        charger.visa = charger_visa
+        print(charger.idn())
+        charger.init()
+
+        test_profile = profile_state_machine(profile, clock=clock)
         test_profile.set_event_function(charger.set_charger_setpoints)
 
-
         # Setup LIN Sessions
-        with nixnet.FrameInSinglePointSession(interface, database, cluster, frames) as session:
-            with convert.SignalConversionSinglePointSession(database, cluster, signals) as converter:
+        with lin_session as session:
+            with signal_converter as converter:
 
-                session.intf.lin_term = constants.LinTerm.ON
+                if nixnet is not None:
+                    session.intf.lin_term = constants.LinTerm.ON
                 session.intf.lin_master = True
 
+                if self.stream_capture:
+                    def read_lin():
+                        return converter.read_signals()
+                    self._trace_offset = None
+                else:
+                    def read_lin():
+                        frame = session.frames.read(frame_type=types.LinFrame if nixnet is not None else None)
+                        return converter.convert_frames_to_signals(frame)
+
+                if self.concurrent_acquisition:
+                    # Charger and LIN reads overlap, a source missing its timeout keeps its last values
+                    timeout = 0.75 * self.sample_rate
+                    self.acquisition = async_acquisition([acquisition_source('charger', charger.measure, timeout),
+                                                          acquisition_source('lin', read_lin, timeout)])
+
                 def read_data_task(time):
-                    """Aquires and Converts Telemetry data on the SCPI and LIN buses."""
+                    """Aquires and Converts Telemetry data on the SCPI and LIN buses, True if batt got an IBS sample."""
                     # Read Telemetry
-                    charger.read_data()
-                    frame = session.frames.read(frame_type=types.LinFrame)
-
-                    # Format Data
-                    converted_signals = converter.convert_frames_to_signals(frame)
-                    batt.pack_data(time, *[float(v) for (_, v) in converted_signals])
+                    if self.acquisition is not None:
+                        results = self.acquisition.acquire()
+                        if results['charger'] is not None:
+                            charger.voltage, charger.current = results['charger']
+                        converted_signals = results['lin']
+                    else:
+                        charger.read_data()
+                        converted_signals = read_lin()
+
+                    # Format Data, a timed out read or a signal not received yet is no sample
+                    if converted_signals is None or any(np.isnan(value) for _, value in converted_signals):
+                        return False
+                    batt.pack_signals(time, converted_signals)
+                    return True
 
                 # Set the schedule. This will also automatically enable master mode.
                 session.start()
-                session.change_lin_schedule(schedule_index)
-                time.sleep(1)
+                session.change_lin_schedule(self.schedule_index)
+                clock.sleep(1)
+
+                own_tasks = tasks is None
+                if own_tasks:
+                    tasks = periodic_scheduler(self.name)
+                task_handles = [tasks.add_task(WATCHDOG_RATE, self.watchdog_task)]
+                if display:
+                    task_handles.append(tasks.add_task(DISPLAY_RATE, self.display_data_task))
+                if own_tasks:
+                    tasks.start()
+
+                self.samples = 0
+                self._logged = self.telemetry.count
+                self.status = 'running'
+                wall_start = time.time()
+                scheduler.start()
+                soc_tracker.reset()
+                # batt holds defaults until the first IBS sample, which must not seed the SOC reference
+                have_sample = False
+
+                try:
+                    while(1):
+                        sample_time = scheduler.wait()
+                        if read_data_task(sample_time):
+                            have_sample = True
+                        if have_sample:
+                            soc_tracker.update(sample_time, batt.current, batt.soc)
+                            self.store_sample(sample_time)
+                            self.samples += 1
+                            if trace_logger is not None:
+                                self.log_trace(trace_logger, converter, sample_time)
+
+                            # Logging data
+                            self.log_data(logger)
+
+                            #Feed profile state machine
+                            test_profile.run_profile(batt)
+                            if(test_profile.done):
+                                print('{}: Profile ended.'.format(self.name))
+                                self.status = 'done'
+                                break
+                            if(self.abort_on_soc_error and soc_tracker.flagged):
+                                print('{}: Test aborted on SOC error.'.format(self.name))
+                                self.status = 'aborted'
+                                break
+                        if(self.stop_event.is_set()):
+                            print('{}: Emergency stop.'.format(self.name))
+                            self.status = 'stopped'
+                            break
+                finally:
+                    print('{}: Shutting Down...'.format(self.name))
+                    charger.set_output('OFF')
+                    for task in task_handles:
+                        task.cancel()
+                    if own_tasks:
+                        tasks.stop()
+                    logger.add_metadata('timing', scheduler.summary_lines())
+                    logger.add_metadata('soc_tracking', soc_tracker.summary_lines())
+                    logger.add_metadata('charger_latency', charger.latency_lines())
+                    if self.stream_capture:
+                        logger.add_metadata('stream_capture', ['frames={} ring_capacity={}'.format(
+                            converter.frames_read, converter.ring.capacity)])
+                    if self.acquisition is not None:
+                        logger.add_metadata('acquisition', self.acquisition.latency_lines())
+                        self.acquisition.close()
+
+        return self.samples, time.time() - wall_start
+
+    def run_logged(self, profile_file, test_name, export_csv=True, display=True, tasks=None):
+        """Open the session log, run the profile, then close and optionally export the log.
+
+        Returns (samples, wall_time, log_name).
+        """
+        log_name = log_file_name(test_name)
+        print("{}: Opening log file as {}".format(self.name, log_name + data_logger.LOG_EXTENSION))
+        trace_logger = None
+        if self.stream_capture:
+            trace_logger = data_logger.binary_logger(log_name + '_trace' + data_logger.LOG_EXTENSION, ['frame_id'] + self.signals)
+        try:
+            with data_logger.binary_logger(log_name + data_logger.LOG_EXTENSION, LOG_CHANNELS,
+                                           flush_interval=LOG_FLUSH_INTERVAL) as logger:
+                with open(profile_path(profile_file)) as profile:
+                    samples, wall_time = self.run(profile, logger, display=display, tasks=tasks, trace_logger=trace_logger)
+        finally:
+            if trace_logger is not None:
+                trace_logger.close()
+
+        if export_csv:
+            data_logger.export_csv(log_name + data_logger.LOG_EXTENSION, log_name + '.csv')
+            print('{}: Exported log to {}'.format(self.name, log_name + '.csv'))
+        return samples, wall_time, log_name
 
-                # Setup charger
-                # charger.set_curr_lim(0, 0)
-                # charger.set_voltage(0)
-                # charger.set_output('OFF')
 
+def main():
 
-                display_task = InfiniteTimer(DISPLAY_RATE, display_data_task)
-                #daq_task = InfiniteTimer(SAMPLE_RATE, read_data_task)
+    parser = argparse.ArgumentParser(description='Script used to test SOC gauge performance')
+    #parser.add_argument('pos_current_lim', help="Choose the charger's positive current limit", type=float)
+    ##parser.add_argument('neg_curr_lim', help="Choose the charger's negative current limit", type=float)
+    #parser.add_argument('voltage_high', help='Choose what the high level charger voltage is', type=float)
+    #parser.add_argument('voltage_low', help='Choose what the low level charger voltage is', type=float)
+    parser.add_argument('profile_file', help='Choose Test profile .csv file', type=str)
+    parser.add_argument('test_name', help='Choose name of the test', type=str)
+    parser.add_argument('charger_visa_name', help='Type in the charger VISA alias (not needed with --sim)', type=str, nargs='?', default=None)
+    parser.add_argument('--sim', help='Run against a simulated IBS and charger on a virtual clock', action='store_true')
+    parser.add_argument('--sample-rate', help='Sample period in seconds (default {})'.format(SAMPLE_RATE), type=float, default=SAMPLE_RATE)
+    parser.add_argument('--late-policy', help='What to do with missed sample ticks', choices=sample_scheduler.policies, default='skip')
+    parser.add_argument('--capacity-ah', help='Capacity of the battery under test for the live coulomb counted SOC (required with --soc-error-limit, default {} otherwise)'.format(QMAX_AS / 3600), type=float, default=None)
+    parser.add_argument('--soc-error-limit', help='Flag the test when |gauge SOC - reference SOC| exceeds this [%%]', type=float, default=None)
+    parser.add_argument('--abort-on-soc-error', help='Stop the test when the SOC error limit is exceeded (needs --soc-error-limit)', action='store_true')
+    parser.add_argument('--no-csv', help='Only keep the binary log, skip the .csv export at the end', action='store_true')
+    parser.add_argument('--stream', help='Capture every IBS frame at bus rate into a _trace log', action='store_true')
+    parser.add_argument('--acquisition', help='Read charger and LIN concurrently or one after the other (default: concurrent on hardware, sequential with --sim)', choices=['concurrent', 'sequential'], default=None)
 
-                def exit_signal_handler(signal, frame):
-                    print('Shutting Down...')
-                    charger.set_output('OFF')
-                    display_task.cancel()
-                    #daq_task.cancel()
-                    sys.exit()
-                signal.signal(signal.SIGINT, exit_signal_handler)
-
-                display_task.start()
-                #daq_task.start()
-
-                loop_count = 0;
-                start_time = time.time()
-                next_step = 0
-
-
-                while(1):
-                    loop_start = time.time()
-                    sample_time = loop_start - start_time
-                    read_data_task(sample_time)
-
-
-                    # Logging data
-                    data_row = "{},{},{},{},{},{}\n".format(sample_time, batt.voltage, batt.current, batt.soc, charger.voltage, charger.current)
-                    log_file.write(data_row)
-
-                    #Feed profile state machine
-                    test_profile.run_profile(batt)
-                    if(test_profile.done):
-                        print('Profile ended.')
-                        print('Data acquisition stopped.')
-                        log_file.close()
-                        print('Shutting Down...')
-                        charger.set_output('OFF')
-                        display_task.cancel()
-                        sys.exit()
-
-                    loop_time = time.time() - loop_start
-                    loop_wait = SAMPLE_RATE - loop_time
-                    if(loop_wait < 0):
-                        loop_wait = 0
-                    time.sleep(loop_wait)
+    args = parser.parse_args()
+    print('Profile chosen : {}'.format(args.profile_file))
+    if args.charger_visa_name is None and not args.sim:
+        parser.error('charger_visa_name is required unless --sim is used')
+    if args.abort_on_soc_error and args.soc_error_limit is None:
+        parser.error('--abort-on-soc-error needs --soc-error-limit')
+    if args.soc_error_limit is not None and args.capacity_ah is None:
+        parser.error('--soc-error-limit needs --capacity-ah of the battery under test')
+    problems = profile_problems(args.profile_file)
+    if problems:
+        print('\n'.join(problems))
+        parser.error('{} problem(s) in {}'.format(len(problems), args.profile_file))
+
+    channel = test_channel(args.test_name, charger_visa_name=args.charger_visa_name, sim=args.sim,
+                           sample_rate=args.sample_rate, late_policy=args.late_policy,
+                           capacity_ah=args.capacity_ah, soc_error_limit=args.soc_error_limit,
+                           abort_on_soc_error=args.abort_on_soc_error,
+                           concurrent_acquisition=None if args.acquisition is None else args.acquisition == 'concurrent',
+                           stream_capture=args.stream)
+
+    def exit_signal_handler(signal, frame):
+        channel.stop()
+    signal.signal(signal.SIGINT, exit_signal_handler)
+
+    samples, wall_time, log_name = channel.run_logged(args.profile_file, args.test_name, export_csv=not args.no_csv)
 
     print('Data acquisition stopped.')
+    for line in channel.scheduler.summary_lines() + channel.soc_tracker.summary_lines() + channel.charger.latency_lines():
+        print(line)
+    if channel.acquisition is not None:
+        for line in channel.acquisition.latency_lines():
+            print(line)
+    print('{} samples in {:2.2f}s ({:2.0f} samples/s)'.format(samples, wall_time, samples / max(wall_time, 1e-9)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+from time import sleep
+
+import numpy as np
+
+
+class telemetry_store():
+    """ Preallocated ring of timestamped samples, one writer thread, any number of readers.
+
+    Each row holds the sample time followed by one value per channel. The
+    writer never blocks: it marks the store busy by making the sequence odd,
+    writes the row, then makes it even again. Readers copy what they need and
+    retry if the sequence was odd or moved while they copied (seqlock), so a
+    snapshot never mixes values from two samples.
+    """
+
+    def __init__(self, channels, capacity=4096):
+        self.channels = list(channels)
+        self.index = {name: i for i, name in enumerate(self.channels)}
+        self.capacity = capacity
+        self.rows = np.full((capacity, 1 + len(self.channels)), np.nan)
+        self.count = 0
+        self._sequence = 0
+
+    def append(self, time, *values):
+        """ Write one sample, only ever called from the acquisition thread."""
+        self._sequence += 1
+        row = self.rows[self.count % self.capacity]
+        row[0] = time
+        row[1:] = values
+        self.count += 1
+        self._sequence += 1
+
+    def _read(self, copy):
+        while True:
+            sequence = self._sequence
+            if not sequence & 1:
+                result = copy(self.count)
+                if self._sequence == sequence:
+                    return result
+            # Writer is mid-row, let it finish
+            sleep(0)
+
+    def latest(self):
+        """ Copy of the newest row (time, channels...), None before the first sample."""
+        return self._read(lambda count: self.rows[(count - 1) % self.capacity].copy() if count else None)
+
+    def window(self, n):
+        """ Copy of the newest n rows (fewer if not written yet), oldest first."""
+        return self.since(self.count - n)[0]
+
+    def since(self, count):
+        """ Rows written after count, oldest first, and the new count to pass next time.
+
+        Rows overwritten before they were read are dropped from the start.
+        """
+        def copy(total):
+            first = max(count, total - self.capacity, 0)
+            start = first % self.capacity
+            end = start + total - first
+            if end <= self.capacity:
+                return self.rows[start:end].copy(), total
+            return np.concatenate((self.rows[start:], self.rows[:end - self.capacity])), total
+        return self._read(copy)
+
+    def value(self, row, channel):
+        return row[1 + self.index[channel]]
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+import batch_report
+import data_logger
+import log_archive
+
+LOG_CHANNELS = ['batt_voltage', 'batt_current', 'batt_soc']
+
+
+def write_log(filename, channels):
+    with data_logger.binary_logger(filename, channels, sync=False) as logger:
+        logger.append_block(np.arange(3.0), np.ones((3, len(channels))))
+
+
+def test_find_logs_skips_trace_logs_and_other_files(tmp_path):
+    directory = str(tmp_path)
+    write_log(os.path.join(directory, 'run1.blog'), LOG_CHANNELS)
+    # --stream capture next to it, raw LIN signals without batt_soc
+    write_log(os.path.join(directory, 'run1_trace.blog'), ['frame_id', 'BatteryVoltage', 'BatteryCurrent', 'StateOfCharge'])
+    log_archive.convert(os.path.join(directory, 'run1_trace.blog'), os.path.join(directory, 'run1_trace.barc'))
+    write_log(os.path.join(directory, 'run2.blog'), LOG_CHANNELS)
+    log_archive.convert(os.path.join(directory, 'run2.blog'), os.path.join(directory, 'run2.barc'))
+    (tmp_path / 'run3.csv').write_text('# started\ntime,batt_voltage,batt_current,batt_soc\n0,12,1,50\n')
+    (tmp_path / 'profile.csv').write_text('step,Vsp,Ilim_pos,Ilim_neg,command,value,message\n')
+    (tmp_path / 'notes.txt').write_text('')
+
+    assert batch_report.find_logs(directory) == [os.path.join(directory, name) for name in ['run1.blog', 'run2.barc', 'run3.csv']]
+
+
+def test_unreadable_logs_are_kept_for_the_report(tmp_path):
+    (tmp_path / 'broken.blog').write_bytes(b'not a log')
+    (tmp_path / 'report.csv').write_text('')
+    assert batch_report.find_logs(str(tmp_path), exclude=[str(tmp_path / 'report.csv')]) == [str(tmp_path / 'broken.blog')]
@@ -0,0 +1,113 @@
+import batt_ibs_config
+import ibs_registers
+import sim_backends
+from lin_diag import lin_diag_engine
+
+REGISTERS = ibs_registers.register_map('IBS_GLOBAL_GEN2')
+SERIAL = 0x12345678
+KEY = REGISTERS.sensor_key(SERIAL)
+TARGET = {'C_NOMINAL': {'c_nominal': 30}, 'U0 MIN/MAX': {'u0_min': 11200, 'u0_max': 12650}}
+# Stored data bytes of the target values (C_NOMINAL is in 2 Ah steps on gen2)
+MATCHING = {0x39: b'\x0F\xFF\xFF\xFF', 0x30: b'\x2B\xC0\x31\x6A'}
+
+
+def sim_ibs(**kwargs):
+    return sim_backends.sim_ibs_diag_node(sim_backends.virtual_clock(), serial=SERIAL, **kwargs)
+
+
+def configure(node, cache=None, use_cache=True):
+    """ Configure node to TARGET, returns the outcome and the virtual seconds it took."""
+    engine = lin_diag_engine(node, node, REGISTERS.master_req_id, clock=node.clock, verbose=False)
+    writes = REGISTERS.parameter_values(c_nominal=30, u0_min=11200, u0_max=12650)
+    start = node.clock.monotonic()
+    outcome = batt_ibs_config.configure(engine, REGISTERS, writes, clock=node.clock, verbose=False,
+                                        cache=cache, use_cache=use_cache)
+    return outcome, node.clock.monotonic() - start
+
+
+def test_first_run_writes_saves_and_verifies():
+    node = sim_ibs()
+    cache = {}
+    outcome, elapsed = configure(node, cache)
+
+    assert outcome.ok()
+    assert outcome.written == ['Table OFF', 'C_NOMINAL', 'U0 MIN/MAX']
+    assert outcome.verified == TARGET
+    assert node.table_state == 0
+    assert node.registers[0x39][0] == 0x0F
+    assert elapsed >= batt_ibs_config.EEPROM_SAVE_TIME
+    assert cache[KEY]['parameters'] == TARGET
+    assert cache[KEY]['table_state'] == 0
+
+
+def test_cache_hit_sends_nothing_but_the_serial_read():
+    node = sim_ibs()
+    cache = {}
+    configure(node, cache)
+    requests, writes = node.requests, node.writes
+
+    outcome, elapsed = configure(node, cache)
+
+    assert outcome.ok() and outcome.from_cache
+    assert outcome.verified == TARGET
+    assert [result.name for result in outcome.results] == ['Check Serial Number']
+    # The wake up frame and the serial number read
+    assert node.requests == requests + 2
+    assert node.writes == writes
+    assert elapsed < batt_ibs_config.EEPROM_SAVE_TIME
+
+
+def test_cache_of_another_sensor_is_not_used():
+    cache = {REGISTERS.sensor_key(0x0BADCAFE): {'parameters': TARGET, 'table_state': 0}}
+    outcome, elapsed = configure(sim_ibs(), cache)
+    assert not outcome.from_cache
+    assert outcome.written == ['Table OFF', 'C_NOMINAL', 'U0 MIN/MAX']
+
+
+def test_table_on_with_matching_values_only_switches_the_table_off():
+    node = sim_ibs(registers=MATCHING)
+    assert node.table_state == 1
+    outcome, elapsed = configure(node)
+
+    assert outcome.ok()
+    assert outcome.written == ['Table OFF']
+    assert node.table_state == 0
+    # Only the table switch was written, the parameters were left alone
+    assert node.writes == 1
+    assert elapsed >= batt_ibs_config.EEPROM_SAVE_TIME
+
+
+def test_matching_sensor_is_not_written_and_does_not_wait_for_the_eeprom():
+    node = sim_ibs(registers=MATCHING)
+    node.table_state = 0
+    cache = {}
+    outcome, elapsed = configure(node, cache)
+
+    assert outcome.ok() and not outcome.from_cache
+    assert outcome.written == []
+    assert node.writes == 0
+    assert elapsed < batt_ibs_config.EEPROM_SAVE_TIME
+    assert cache[KEY]['parameters'] == TARGET
+
+
+def test_no_cache_reads_the_sensor_and_merges_into_the_cache():
+    node = sim_ibs(registers=MATCHING)
+    node.table_state = 0
+    cache = {KEY: {'parameters': dict(TARGET, **{'Batt Tech': {'batt_tech': 'AGM'}}), 'table_state': 0, 'verified': 'earlier'}}
+    outcome, elapsed = configure(node, cache, use_cache=False)
+
+    assert not outcome.from_cache
+    # The sensor was read even though the cache covered the target
+    assert 'Check C_NOMINAL' in [result.name for result in outcome.results]
+    assert outcome.written == []
+    # Parameters not in this run's target stay in the entry
+    assert cache[KEY]['parameters'] == dict(TARGET, **{'Batt Tech': {'batt_tech': 'AGM'}})
+    assert cache[KEY]['verified'] != 'earlier'
+
+
+def test_config_cache_round_trip(tmp_path):
+    filename = str(tmp_path / 'cache.json')
+    assert batt_ibs_config.load_config_cache(filename) == {}
+    cache = {KEY: {'parameters': TARGET, 'table_state': 0}}
+    batt_ibs_config.save_config_cache(cache, filename)
+    assert batt_ibs_config.load_config_cache(filename) == cache
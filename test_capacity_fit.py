@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import capacity_fit
+
+
+def noisy_line(samples=2000, capacity_as=30 * 3600.0, soc0=45.0, seed=0):
+    rng = np.random.default_rng(seed)
+    charge = np.cumsum(rng.uniform(5.0, 15.0, samples))
+    soc = soc0 + 100.0 * charge / capacity_as + rng.normal(0, 0.3, samples)
+    return charge, soc
+
+
+@pytest.mark.parametrize('chunk_size', [3, 100, 2000])
+def test_streamed_fit_matches_polyfit(chunk_size):
+    charge, soc = noisy_line()
+    fitter = capacity_fit.soc_fit()
+    for start in range(0, len(charge), chunk_size):
+        fitter.add(charge[start:start + chunk_size], soc[start:start + chunk_size])
+    fit = fitter.result()
+
+    (slope, intercept), cov = np.polyfit(charge, soc, 1, cov=True)
+    assert fit.capacity_as == pytest.approx(100.0 / slope, rel=1e-9)
+    assert fit.soc0 == pytest.approx(intercept, rel=1e-9)
+    assert fit.soc0_std == pytest.approx(np.sqrt(cov[1, 1]), rel=1e-6)
+    assert fit.capacity_std == pytest.approx(100.0 / slope * np.sqrt(cov[0, 0]) / slope, rel=1e-6)
+    residuals = soc - np.polyval([slope, intercept], charge)
+    assert fit.residual_rms == pytest.approx(np.sqrt(np.mean(residuals ** 2)), rel=1e-6)
+    assert fit.samples == len(charge)
+
+
+def test_empty_chunks_are_ignored():
+    charge, soc = noisy_line(100)
+    whole = capacity_fit.soc_fit()
+    whole.add(charge, soc)
+    split = capacity_fit.soc_fit()
+    split.add(charge[:0], soc[:0])
+    split.add(charge[:50], soc[:50])
+    split.add(charge[50:50], soc[50:50])
+    split.add(charge[50:], soc[50:])
+    assert vars(split.result()) == pytest.approx(vars(whole.result()))
+
+
+def test_unfittable_logs_raise():
+    flat = capacity_fit.soc_fit()
+    flat.add(np.zeros(10), np.linspace(50, 60, 10))
+    with pytest.raises(ValueError):
+        flat.result()
+    falling = capacity_fit.soc_fit()
+    falling.add(np.arange(10.0), np.linspace(60, 50, 10))
+    with pytest.raises(ValueError):
+        falling.result()
+
+
+def test_cache_round_trip_and_staleness(tmp_path):
+    log = tmp_path / 'test.csv'
+    log.write_text('time,batt_soc\n')
+    charge, soc = noisy_line(100)
+    fitter = capacity_fit.soc_fit()
+    fitter.add(charge, soc)
+    fit = fitter.result()
+    settings = {'threshold': 50.0, 'start': None, 'end': None, 'windows': []}
+
+    assert capacity_fit.load_fit(str(log), settings) is None
+    assert capacity_fit.save_fit(str(log), settings, fit)
+    assert vars(capacity_fit.load_fit(str(log), settings)) == vars(fit)
+    assert capacity_fit.load_fit(str(log), dict(settings, threshold=60.0)) is None
+    # A log that changed since the fit invalidates it
+    log.write_text('time,batt_soc\n0,50\n')
+    assert capacity_fit.load_fit(str(log), settings) is None
+
+
+def test_unwritable_cache_is_skipped(tmp_path):
+    log = tmp_path / 'test.csv'
+    log.write_text('time,batt_soc\n')
+    fitter = capacity_fit.soc_fit()
+    fitter.add(*noisy_line(100))
+    # A directory in the way fails the write even when running as root
+    (tmp_path / ('test.csv' + capacity_fit.FIT_SUFFIX + '.tmp')).mkdir()
+    assert not capacity_fit.save_fit(str(log), {}, fitter.result())
+    assert capacity_fit.load_fit(str(log), {}) is None
+    assert capacity_fit.load_fit(str(tmp_path / 'missing.csv'), {}) is None
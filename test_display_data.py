@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pytest
+
+import data_logger
+import display_data
+import log_archive
+
+CHANNELS = ['batt_voltage', 'batt_current', 'batt_soc']
+SAMPLES = 5000
+CAPACITY_AS = 20 * 3600.0
+
+
+def synthetic_log(seed=0):
+    """ time, voltage, current and a gauge SOC that crosses the 50% window start."""
+    rng = np.random.default_rng(seed)
+    time = np.cumsum(rng.uniform(0.5, 1.5, SAMPLES))
+    current = 15.0 + 5.0 * np.sin(time / 300.0) + rng.normal(0, 0.5, SAMPLES)
+    charge = np.concatenate(([0.0], np.cumsum(0.5 * (current[1:] + current[:-1]) * np.diff(time))))
+    soc = 40.0 + 100.0 * charge / CAPACITY_AS + rng.normal(0, 0.1, SAMPLES)
+    voltage = 12.0 + soc / 50.0
+    return time, np.column_stack((voltage, current, soc))
+
+
+@pytest.fixture(params=['.csv', data_logger.LOG_EXTENSION, log_archive.ARCHIVE_EXTENSION])
+def log_file(request, tmp_path):
+    time, values = synthetic_log()
+    filename = str(tmp_path / ('test' + request.param))
+    if request.param == '.csv':
+        with open(filename, 'w') as f:
+            f.write(','.join(['time'] + CHANNELS) + '\n')
+            np.savetxt(f, np.column_stack((time, values)), delimiter=',')
+    else:
+        blog = str(tmp_path / ('test' + data_logger.LOG_EXTENSION))
+        with data_logger.binary_logger(blog, CHANNELS, block_size=700, sync=False) as logger:
+            logger.append_block(time, values)
+        if request.param == log_archive.ARCHIVE_EXTENSION:
+            log_archive.convert(blog, filename, block_size=900)
+    return filename
+
+
+def in_memory(filename, qmax_as, soc0, start=None, end=None):
+    """ The analysis main() runs on a log loaded whole."""
+    data = display_data.load_log(filename, start, end)
+    window_l = display_data.find_window_start(data['batt_soc'])
+    window, soc_calc = display_data.analyse(data, qmax_as=qmax_as, soc0=soc0)
+    stats = display_data.log_statistics(window.dtype.names)
+    stats.add(window, soc_calc)
+    return window_l, stats
+
+
+def assert_same_statistics(chunked, loaded):
+    assert chunked.count == loaded.count
+    assert chunked.names == loaded.names
+    np.testing.assert_array_equal(chunked.mins, loaded.mins)
+    np.testing.assert_array_equal(chunked.maxs, loaded.maxs)
+    np.testing.assert_allclose(chunked.sums, loaded.sums, rtol=1e-12)
+    assert chunked.error_max_abs == loaded.error_max_abs
+    assert chunked.error_square_sum == pytest.approx(loaded.error_square_sum, rel=1e-12)
+    assert chunked.last == loaded.last
+    assert chunked.last_soc_calc == loaded.last_soc_calc
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000, 65536])
+def test_chunked_matches_in_memory(log_file, chunk_size):
+    window_l, chunked = display_data.analyse_chunked(log_file, qmax_as=CAPACITY_AS, chunk_size=chunk_size, soc0=50.0)
+    expected_l, loaded = in_memory(log_file, CAPACITY_AS, 50.0)
+    if not log_file.endswith(log_archive.ARCHIVE_EXTENSION):
+        # Archives skip the blocks before the window and count from there
+        assert window_l == expected_l
+    assert_same_statistics(chunked, loaded)
+
+
+@pytest.mark.parametrize('start, end', [(None, 1000.0), (3000.5, None), (2500.0, 4200.0)])
+def test_chunked_time_range_matches_in_memory(log_file, start, end):
+    # Chunks of 500 samples, so whole chunks fall outside the range
+    _, chunked = display_data.analyse_chunked(log_file, qmax_as=CAPACITY_AS, chunk_size=500, start=start, end=end)
+    _, loaded = in_memory(log_file, CAPACITY_AS, display_data.SOC_START, start, end)
+    assert_same_statistics(chunked, loaded)
+
+
+def test_streamed_fit_matches_loaded_fit(log_file):
+    data = display_data.load_log(log_file)
+    window, _ = display_data.analyse(data)
+    loaded = display_data.fit_log(log_file, window)
+    os.remove(log_file + '.fit.json')
+    streamed = display_data.fit_log(log_file, chunk_size=333)
+    assert streamed.capacity_as == pytest.approx(loaded.capacity_as, rel=1e-9)
+    assert streamed.soc0 == pytest.approx(loaded.soc0, rel=1e-9)
+    assert streamed.capacity_as == pytest.approx(CAPACITY_AS, rel=0.01)
+
+
+def test_window_never_reached(log_file):
+    with pytest.raises(ValueError):
+        display_data.analyse_chunked(log_file, threshold=200.0, chunk_size=1000)
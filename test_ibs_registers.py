@@ -0,0 +1,89 @@
+import pytest
+
+import ibs_registers
+from lin_diag import diag_result
+
+# MasterReq payloads the original per-generation classes sent (master_payloads with
+# C_NOMINAL 30 Ah, U0 11200/12650 mV, IQ 250 mA, Icharge min 50 mA, AGM filled in)
+GEN1_FRAMES = {
+    'Change C_NOMINAL': [0x01, 0x03, 0xB5, 0x39, 0x1E, 0xFF, 0xFF, 0xFF],
+    'Check C_NOMINAL': [0x01, 0x06, 0xB2, 0x39, 0xFF, 0x7F, 0xFF, 0xFF],
+    'Change Batt Type': [0x01, 0x03, 0xB5, 0x3A, 0x1E, 0xFF, 0xFF, 0xFF],
+    'Check Batt Type': [0x01, 0x06, 0xB2, 0x3A, 0xFF, 0x7F, 0xFF, 0xFF],
+    'Change U0 MIN/MAX': [0x82, 0x06, 0xB5, 0x30, 0x2B, 0xC0, 0x31, 0x6A],
+    'Check U0 MIN/MAX': [0x82, 0x06, 0xB2, 0x30, 0xFF, 0x7F, 0xFF, 0xFF],
+    'Change Batt IQ': [0x82, 0x04, 0xB5, 0x3C, 0xFA, 0x32, 0xFF, 0xFF],
+    'Check Batt IQ': [0x82, 0x06, 0xB2, 0x3C, 0xFF, 0x7F, 0xFF, 0xFF],
+    'Check Table State': [0x01, 0x01, 0x30, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF],
+    'Switch Table OFF': [0x82, 0x06, 0x31, 0x00, 0x11, 0x22, 0x33, 0x44],
+    'Switch Table ON': [0x82, 0x06, 0x31, 0x01, 0x11, 0x22, 0x33, 0x44],
+    }
+GEN2_FRAMES = {
+    'Change C_NOMINAL': [0x01, 0x03, 0xB5, 0x39, 0x0F, 0xFF, 0xFF, 0xFF],
+    'Check C_NOMINAL': [0x01, 0x06, 0xB2, 0x39, 0xFF, 0x7F, 0xFF, 0xFF],
+    'Change Batt Type': [0x01, 0x03, 0xB5, 0x3A, 0x1E, 0xFF, 0xFF, 0xFF],
+    'Check Batt Type': [0x01, 0x06, 0xB2, 0x3A, 0xFF, 0x7F, 0xFF, 0xFF],
+    'Change U0 MIN/MAX': [0x01, 0x06, 0xB5, 0x30, 0x2B, 0xC0, 0x31, 0x6A],
+    'Check U0 MIN/MAX': [0x01, 0x06, 0xB2, 0x30, 0xFF, 0x7F, 0xFF, 0xFF],
+    # The original template left 0x7F in byte 5, past the PCI length, unused bytes are 0xFF
+    'Change Batt Tech': [0x01, 0x03, 0xB5, 0x32, 0x01, 0xFF, 0xFF, 0xFF],
+    'Check Batt Tech': [0x01, 0x06, 0xB2, 0x32, 0xFF, 0x7F, 0xFF, 0xFF],
+    'Check Table State': [0x01, 0x01, 0x30, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF],
+    'Switch Table OFF': [0x01, 0x06, 0x31, 0x00, 0x11, 0x22, 0x33, 0x44],
+    'Switch Table ON': [0x01, 0x06, 0x31, 0x01, 0x11, 0x22, 0x33, 0x44],
+    }
+GEN1_VALUES = {'c_nominal': 30, 'batt_type': 30, 'u0_min': 11200, 'u0_max': 12650, 'iqbatt': 250, 'ichargemin': 50}
+GEN2_VALUES = {'c_nominal': 30, 'batt_type': 30, 'u0_min': 11200, 'u0_max': 12650, 'batt_tech': 'AGM'}
+# LIN ReadByIdentifier 1 request, [NAD, PCI, SID, id, supplier id, function id]
+SERIAL_REQUEST = [0x01, 0x06, 0xB2, 0x01, 0xFF, 0x7F, 0xFF, 0xFF]
+
+
+def frames(registers, values):
+    transactions = [registers.table_state, registers.table_switch(on=False), registers.table_switch(on=True)]
+    for parameter, parameter_values in registers.parameter_values(**values):
+        transactions += [parameter.write(parameter_values), parameter.read]
+    return {transaction.name: list(transaction.request) for transaction in transactions}
+
+
+@pytest.mark.parametrize('generation, values, expected', [
+    ('IBS200_GEN1', GEN1_VALUES, GEN1_FRAMES),
+    ('IBS_GLOBAL_GEN2', GEN2_VALUES, GEN2_FRAMES),
+    ])
+def test_master_req_frames(generation, values, expected):
+    assert frames(ibs_registers.register_map(generation), values) == expected
+
+
+def result(transaction, response):
+    return diag_result(transaction, bytes(bytearray(response)), 1, 0.0)
+
+
+@pytest.mark.parametrize('generation', list(ibs_registers.REGISTER_MAPS))
+def test_serial_number(generation):
+    serial = ibs_registers.register_map(generation).serial_number
+    assert list(serial.read.request) == SERIAL_REQUEST
+    assert serial.decode_result(result(serial.read, [0x01, 0x05, 0xF2, 0x12, 0x34, 0x56, 0x78, 0xFF])) == {'serial': 0x12345678}
+    # Short reply, or the Hella layout with an echoed id
+    assert serial.decode_result(result(serial.read, [0x01, 0x04, 0xF2, 0x12, 0x34, 0x56, 0xFF, 0xFF])) is None
+    assert serial.decode_result(result(serial.read, [0x01, 0x06, 0xF2, 0x01, 0x12, 0x34, 0x56, 0x78])) is None
+
+
+def test_parameter_read_back():
+    c_nominal = ibs_registers.register_map('IBS_GLOBAL_GEN2').parameters['C_NOMINAL']
+    assert c_nominal.decode_result(result(c_nominal.read, [0x01, 0x03, 0xF2, 0x39, 0x0F, 0xFF, 0xFF, 0xFF])) == {'c_nominal': 30}
+    # Reply for another data id
+    assert c_nominal.decode_result(result(c_nominal.read, [0x01, 0x03, 0xF2, 0x3A, 0x0F, 0xFF, 0xFF, 0xFF])) is None
+    assert c_nominal.decode_result(result(c_nominal.read, [0x01, 0x03, 0x7F, 0xB2, 0x12, 0xFF, 0xFF, 0xFF])) is None
+
+
+@pytest.mark.parametrize('c_nominal', [29, 31, 33, 30.5])
+def test_values_the_sensor_cannot_store_are_rejected(c_nominal):
+    with pytest.raises(ValueError, match='not a multiple of 2'):
+        ibs_registers.register_map('IBS_GLOBAL_GEN2').parameter_values(c_nominal=c_nominal)
+
+
+def test_out_of_range_and_unknown_choices_are_rejected():
+    gen1 = ibs_registers.register_map('IBS200_GEN1')
+    with pytest.raises(ValueError, match='out of range'):
+        gen1.parameter_values(c_nominal=256)
+    with pytest.raises(ValueError, match='must be one of'):
+        ibs_registers.register_map('IBS_GLOBAL_GEN2').parameter_values(batt_tech='GEL')
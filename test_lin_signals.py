@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from lin_signals import SIGNAL_DESCRIPTIONS, lin_signal_decoder
+
+# Both byte orders and a signed signal, which the IBS databases do not use
+MIXED_DESCRIPTION = {
+    'MIXED': (0x10, [('Small', 0, 4, 'little', 1.0, 0.0, False),
+                     ('Signed', 4, 12, 'little', 0.5, 0.0, True),
+                     ('BigWord', 16, 16, 'big', 0.01, -100.0, False),
+                     ('BigSigned', 40, 8, 'big', 1.0, 10.0, True)]),
+    'OTHER': (0x11, [('Other', 0, 16, 'little', 0.1, 0.0, False)]),
+    }
+
+
+def random_frames(description, count, seed=0):
+    """ count payloads per frame from random raw values, with the physical values they encode."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for frame_name, (frame_id, signals) in description.items():
+        for _ in range(count):
+            values = {}
+            for name, start, length, order, scale, offset, signed in signals:
+                low, high = (-(1 << (length - 1)), 1 << (length - 1)) if signed else (0, 1 << length)
+                values[name] = int(rng.integers(low, high)) * scale + offset
+            frames.append((frame_name, values))
+    return frames
+
+
+@pytest.mark.parametrize('description', list(SIGNAL_DESCRIPTIONS.values()) + [MIXED_DESCRIPTION])
+def test_encode_decode_round_trip(description):
+    names = [sig[0] for _, signals in description.values() for sig in signals]
+    names = list(dict.fromkeys(names))
+    decoder = lin_signal_decoder(description, names)
+    frames = random_frames(description, 50)
+    encoded = [decoder.encode(frame_name, values) for frame_name, values in frames]
+    identifiers = [frame_id for frame_id, _ in encoded]
+    payloads = np.frombuffer(b''.join(payload for _, payload in encoded), dtype=np.uint8).reshape(-1, 8)
+
+    decoded = decoder.decode(identifiers, payloads)
+
+    for row, (frame_name, values) in zip(decoded, frames):
+        carried = [sig[0] for sig in description[frame_name][1]]
+        for name in names:
+            if name in carried:
+                assert row[names.index(name)] == pytest.approx(values[name])
+            else:
+                assert np.isnan(row[names.index(name)])
+
+
+def test_decode_payload_sequence_matches_array():
+    decoder = lin_signal_decoder(MIXED_DESCRIPTION, ['Signed', 'BigWord', 'Other'])
+    encoded = [decoder.encode(frame_name, values) for frame_name, values in random_frames(MIXED_DESCRIPTION, 5)]
+    identifiers = [frame_id for frame_id, _ in encoded]
+    # Single-point reads hand over payloads of their own length
+    short = [payload.rstrip(b'\0') for _, payload in encoded]
+    full = np.frombuffer(b''.join(payload for _, payload in encoded), dtype=np.uint8).reshape(-1, 8)
+    np.testing.assert_array_equal(decoder.decode(identifiers, short), decoder.decode(identifiers, full))
+
+
+def test_encode_clamps_to_signal_range():
+    decoder = lin_signal_decoder(MIXED_DESCRIPTION, ['Small', 'Signed'])
+    frame_id, payload = decoder.encode('MIXED', {'Small': 100.0, 'Signed': -5000.0})
+    small, signed = decoder.decode([frame_id], [payload])[0]
+    assert small == 15.0
+    assert signed == -2048 * 0.5
+
+
+def test_unknown_signal_is_rejected():
+    with pytest.raises(ValueError):
+        lin_signal_decoder(MIXED_DESCRIPTION, ['Small', 'Missing'])
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from live_viewer import minmax_envelope
+
+
+def brute_force(times, values, bucket_size):
+    """ (times, min, max) of consecutive bucket_size sample buckets, the last one may be partial."""
+    starts = np.arange(0, len(times), bucket_size)
+    low = np.array([values[:, i:i + bucket_size].min(axis=1) for i in starts]).T
+    high = np.array([values[:, i:i + bucket_size].max(axis=1) for i in starts]).T
+    return times[starts], low, high
+
+
+@pytest.mark.parametrize('samples', [1, 7, 64, 1000, 12345])
+@pytest.mark.parametrize('max_buckets', [2, 16, 64])
+def test_envelope_matches_brute_force(samples, max_buckets):
+    rng = np.random.default_rng(samples + max_buckets)
+    channels = ['voltage', 'current']
+    times = np.cumsum(rng.uniform(0.5, 1.5, samples))
+    values = rng.normal(size=(len(channels), samples))
+    envelope = minmax_envelope(channels, max_buckets)
+    # Uneven batches, as the log follower hands them over
+    pos = 0
+    while pos < samples:
+        n = int(rng.integers(1, 300))
+        envelope.add(times[pos:pos + n], values[:, pos:pos + n])
+        pos += n
+
+    assert envelope.samples == samples
+    assert envelope.buckets <= max_buckets
+    expected_time, expected_low, expected_high = brute_force(times, values, envelope.bucket_size)
+    for i, name in enumerate(channels):
+        t, low, high = envelope.channel(name)
+        np.testing.assert_array_equal(t, expected_time)
+        np.testing.assert_array_equal(low, expected_low[i])
+        np.testing.assert_array_equal(high, expected_high[i])
+
+
+def test_spike_survives_merging():
+    envelope = minmax_envelope(['current'], max_buckets=8)
+    values = np.zeros((1, 10000))
+    values[0, 4321] = 50.0
+    values[0, 8765] = -50.0
+    envelope.add(np.arange(10000.0), values)
+    _, low, high = envelope.channel('current')
+    assert high.max() == 50.0
+    assert low.min() == -50.0
+
+
+def test_odd_max_buckets_is_rejected():
+    with pytest.raises(ValueError):
+        minmax_envelope(['current'], max_buckets=5)
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pytest
+
+import data_logger
+import log_archive
+
+LOG_CHANNELS = ['batt_voltage', 'batt_current', 'batt_soc']
+
+
+def test_round_trip(tmp_path):
+    blog, barc = str(tmp_path / 'run.blog'), str(tmp_path / 'run.barc')
+    values = np.random.default_rng(0).uniform(0, 100, (1000, 3))
+    with data_logger.binary_logger(blog, LOG_CHANNELS, sync=False) as logger:
+        logger.append_block(np.arange(1000.0), values)
+
+    assert log_archive.convert(blog, barc, block_size=300) == 1000
+    archive = log_archive.log_archive(barc)
+    assert archive.channels == LOG_CHANNELS
+    assert np.array_equal(archive.read()['batt_soc'], values[:, 2].astype(np.float32))
+    assert not os.path.exists(barc + '.tmp')
+
+
+@pytest.mark.parametrize('log', ['empty.blog', 'empty.csv', 'missing.csv'])
+def test_failed_conversion_leaves_no_files(tmp_path, log):
+    if log == 'empty.blog':
+        data_logger.binary_logger(str(tmp_path / log), LOG_CHANNELS, sync=False).close()
+    elif log == 'empty.csv':
+        (tmp_path / log).write_text('time,batt_voltage,batt_current,batt_soc\n')
+    barc = str(tmp_path / 'run.barc')
+
+    with pytest.raises((OSError, ValueError)):
+        log_archive.convert(str(tmp_path / log), barc)
+    assert not os.path.exists(barc)
+    assert not os.path.exists(barc + '.tmp')
@@ -0,0 +1,107 @@
+import io
+
+import pytest
+
+from batt_test_profile_loader import compile_profile, validate_profile
+from profile_dry_run import dry_run, summary_lines
+
+HEADER = 'step,Vsp,Ilim_pos,Ilim_neg,command,value,message\n'
+
+
+def profile(*rows):
+    return io.StringIO(HEADER + ''.join(row + '\n' for row in rows))
+
+
+def test_valid_profile_has_no_problems():
+    assert validate_profile(profile('1,14.4,10,10,output_state,1,On',
+                                    '2,14.4,10,-10,end_current,0.5,Charge',
+                                    '3,0,0,0,timeout,0,Done')) == []
+
+
+@pytest.mark.parametrize('row, message', [
+    ('1,abc,10,10,timeout,5,x', 'Profile line 2: Vsp \'abc\' is not a number'),
+    ('1,14.4,inf,10,timeout,5,x', 'Profile line 2: Ilim_pos \'inf\' is not finite'),
+    ('1,14.4,-1,10,timeout,5,x', 'Profile line 2: Ilim_pos must not be negative'),
+    ('1,14.4,10,10,wait,5,x', 'Profile line 2: unknown command \'wait\' (expected one of timeout, end_current, output_state, float_voltage)'),
+    ('1,14.4,10,10,output_state,2,x', 'Profile line 2: output_state value must be 0 or 1'),
+    ('1,14.4,10,10,timeout,-5,x', 'Profile line 2: timeout must not be negative'),
+    ('one,14.4,10,10,timeout,5,x', 'Profile line 2: step \'one\' is not an integer'),
+    ])
+def test_row_problem_messages(row, message):
+    assert validate_profile(profile(row)) == [message]
+
+
+def test_every_problem_is_reported():
+    problems = validate_profile(profile('1,14.4,10,10,timeout,5,x',
+                                        '3,14.4,10,10,timeout,x,y',
+                                        '4,14.4,10,10,hold,5,z'))
+    assert problems == ['Profile line 3: step 3 follows step 1, steps must count up by one',
+                        'Profile line 3: value \'x\' is not a number',
+                        'Profile line 4: unknown command \'hold\' (expected one of timeout, end_current, output_state, float_voltage)']
+
+
+def test_profile_level_problems():
+    assert validate_profile(io.StringIO('step,Vsp,command\n1,14.4,timeout\n')) == [
+        'Profile is missing column(s) Ilim_pos, Ilim_neg, value, message']
+    assert validate_profile(profile()) == ['Profile has no steps']
+
+
+def test_compile_raises_the_first_problem():
+    with pytest.raises(ValueError, match='unknown command'):
+        compile_profile(profile('1,14.4,10,10,timeout,5,x', '2,14.4,10,10,hold,5,z', '4,14.4,10,10,timeout,5,x'))
+
+
+def test_dry_run_timeline():
+    steps = compile_profile(profile('1,14.4,10,10,output_state,1,On',
+                                    '2,14.4,10,10,timeout,1800,Bulk',
+                                    '3,14.4,10,10,end_current,0.5,Absorption',
+                                    '4,12.0,10,5,timeout,600,Discharge',
+                                    '5,0,0,0,output_state,0,Off'))
+    estimates = dry_run(steps, capacity_ah=30.0, soc=50.0)
+
+    assert [estimate.step for estimate in estimates] == [1, 2, 3, 4, 5]
+    assert all(estimate.ends for estimate in estimates)
+    for previous, estimate in zip(estimates, estimates[1:]):
+        assert estimate.start == pytest.approx(previous.start + previous.duration)
+    on, bulk, absorption, discharge, off = estimates
+    assert on.duration == 0 and on.soc == 50.0
+    # Current limited at 10 A for half an hour: 5 Ah into 30 Ah
+    assert bulk.duration == pytest.approx(1800.0)
+    assert bulk.charge_in_ah == pytest.approx(5.0)
+    assert bulk.soc == pytest.approx(50.0 + 100.0 * 5.0 / 30.0)
+    assert absorption.duration > 0
+    assert absorption.soc > 95.0
+    assert absorption.charge_out_ah == 0
+    # 5 A discharge limit for 10 minutes
+    assert discharge.duration == pytest.approx(600.0)
+    assert discharge.charge_out_ah == pytest.approx(5.0 * 600.0 / 3600.0)
+    assert off.duration == 0
+    assert summary_lines(estimates, steps)[0].startswith('Total duration = ')
+
+
+def test_ilim_neg_sign_does_not_matter():
+    def discharged(ilim_neg):
+        steps = compile_profile(profile('1,12.0,10,{},output_state,1,On'.format(ilim_neg),
+                                        '2,12.0,10,{},timeout,600,Discharge'.format(ilim_neg)))
+        return dry_run(steps)[-1].charge_out_ah
+
+    assert discharged(-5) == discharged(5)
+
+
+def test_dry_run_stops_at_a_step_that_never_ends():
+    steps = compile_profile(profile('1,14.4,10,10,output_state,1,On',
+                                    '2,14.4,10,10,float_voltage,15.0,Unreachable',
+                                    '3,14.4,10,10,timeout,60,Never reached'))
+    estimates = dry_run(steps, max_step_time=24 * 3600)
+
+    assert [estimate.ends for estimate in estimates] == [True, False]
+    # Charging settles below 15 V, the run gives up there rather than at max_step_time
+    assert 0 < estimates[-1].duration <= 24 * 3600
+    assert summary_lines(estimates, steps)[-1] == 'Step 2 never ends, 1 step(s) after it not reached'
+
+
+def test_condition_with_output_off_never_ends():
+    steps = compile_profile(profile('1,14.4,10,10,float_voltage,14.0,Charger is off'))
+    estimate, = dry_run(steps)
+    assert not estimate.ends
+    assert estimate.duration == 0
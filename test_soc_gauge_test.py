@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+import soc_gauge_test
+from async_acquisition import async_acquisition, acquisition_source
+
+
+class slow_visa():
+    """ Fake VISA resource with a slow query that records overlapping calls."""
+
+    def __init__(self, query_time=0.3):
+        self.query_time = query_time
+        self.active = 0
+        self.overlaps = 0
+        self.calls = []
+        self.guard = threading.Lock()
+
+    def _enter(self, kind, message):
+        with self.guard:
+            self.active += 1
+            if self.active > 1:
+                self.overlaps += 1
+            self.calls.append((kind, message))
+
+    def _leave(self):
+        with self.guard:
+            self.active -= 1
+
+    def query(self, message):
+        self._enter('query', message)
+        time.sleep(self.query_time)
+        self._leave()
+        return ';'.join('1.0' for _ in message.split(';'))
+
+    def write(self, message):
+        self._enter('write', message)
+        time.sleep(0.01)
+        self._leave()
+
+
+def test_setpoints_wait_for_a_timed_out_measurement():
+    visa = slow_visa()
+    charger = soc_gauge_test.psu('charger', visa)
+    with async_acquisition([acquisition_source('charger', charger.measure, timeout=0.15)]) as acquisition:
+        assert acquisition.acquire()['charger'] is None
+        # The query is still in flight on the acquisition thread
+        charger.set_charger_setpoints(14.4, 10, 10, 'ON')
+        charger.set_output('OFF')
+    assert visa.overlaps == 0
+    assert [kind for kind, _ in visa.calls] == ['query', 'write', 'write']
+    assert visa.calls[1][1] == 'VOLT 14.4;:CURR:LIM 10;:CURR:LIM:NEG 10;:OUTPUT ON'
+
+
+def test_idn_waits_for_a_running_query():
+    visa = slow_visa(query_time=0.1)
+    charger = soc_gauge_test.psu('charger', visa)
+    reader = threading.Thread(target=charger.read_data)
+    reader.start()
+    time.sleep(0.02)
+    charger.idn()
+    reader.join()
+    assert visa.overlaps == 0
+    assert charger.voltage == 1.0 and charger.current == 1.0
+
+
+def test_soc_error_limit_needs_the_battery_capacity():
+    with pytest.raises(ValueError, match='capacity_ah'):
+        soc_gauge_test.test_channel('t', sim=True, soc_error_limit=5.0)
+    channel = soc_gauge_test.test_channel('t', sim=True, soc_error_limit=5.0, capacity_ah=30.0)
+    assert channel.soc_tracker.qmax_as == 30.0 * 3600
@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+
+from telemetry_store import telemetry_store
+
+CHANNELS = ['voltage', 'current', 'soc', 'temperature']
+SCALES = np.arange(1, len(CHANNELS) + 1, dtype=float)
+
+
+def sample(i):
+    """ Row i, every channel derived from the time so a torn row shows up."""
+    return float(i), SCALES * i
+
+
+def assert_consistent(rows):
+    np.testing.assert_array_equal(rows[:, 1:], rows[:, :1] * SCALES)
+
+
+def test_since_returns_new_rows_in_order():
+    store = telemetry_store(CHANNELS, capacity=8)
+    assert store.latest() is None
+    for i in range(5):
+        time, values = sample(i)
+        store.append(time, *values)
+    rows, count = store.since(0)
+    assert count == 5
+    np.testing.assert_array_equal(rows[:, 0], np.arange(5))
+    rows, count = store.since(count)
+    assert len(rows) == 0 and count == 5
+    assert store.value(store.latest(), 'soc') == 4 * 3
+
+
+def test_since_drops_overwritten_rows():
+    store = telemetry_store(CHANNELS, capacity=8)
+    for i in range(21):
+        time, values = sample(i)
+        store.append(time, *values)
+    rows, count = store.since(3)
+    assert count == 21
+    # Only the newest capacity rows are left, across the ring wrap
+    np.testing.assert_array_equal(rows[:, 0], np.arange(13, 21))
+    assert_consistent(rows)
+    np.testing.assert_array_equal(store.window(3)[:, 0], [18, 19, 20])
+    np.testing.assert_array_equal(store.window(100)[:, 0], np.arange(13, 21))
+
+
+def test_reader_waits_for_a_half_written_row():
+    store = telemetry_store(CHANNELS, capacity=8)
+    for i in range(3):
+        time, values = sample(i)
+        store.append(time, *values)
+    # Stop the writer halfway through row 3, the way append() would be interrupted
+    store._sequence += 1
+    store.rows[3, 0] = 3.0
+    result = []
+    reader = threading.Thread(target=lambda: result.append(store.since(0)))
+    reader.start()
+    reader.join(0.2)
+    assert reader.is_alive()
+
+    store.rows[3, 1:] = SCALES * 3
+    store.count += 1
+    store._sequence += 1
+    reader.join(5)
+    rows, count = result[0]
+    assert count == 4
+    assert_consistent(rows)
+
+
+def test_readers_follow_a_writer_thread():
+    store = telemetry_store(CHANNELS, capacity=64)
+    samples = 50000
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        for i in range(samples):
+            time, values = sample(i)
+            store.append(time, *values)
+        stop.set()
+
+    def reader():
+        count = 0
+        last_time = -1.0
+        try:
+            while not stop.is_set() or count < store.count:
+                row = store.latest()
+                if row is not None:
+                    assert_consistent(row[None, :])
+                rows, count = store.since(count)
+                if len(rows):
+                    assert_consistent(rows)
+                    assert rows[0, 0] > last_time
+                    assert np.all(np.diff(rows[:, 0]) == 1)
+                    last_time = rows[-1, 0]
+            assert last_time == samples - 1
+        except AssertionError as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(3)]
+    for thread in readers:
+        thread.start()
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    writer_thread.join()
+    for thread in readers:
+        thread.join()
+    assert not errors, errors[0]